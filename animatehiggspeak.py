@@ -1,18 +1,81 @@
 # coding=utf-8
-import ROOT
+import collections
+import hashlib
+import itertools
+import multiprocessing
 import os
 import time
 import PIL.Image
+import numpy as np
+import diskcache
 import images2gif
 import math
+import voigtprofile
 
+# all data needed to render the frames of an animation (spectra: array of frames x bins x (1 + bosons), see
+# compute_spectra)
+AnimationData = collections.namedtuple('AnimationData', ['values_ma', 'values_tan_beta', 'list_higgs_boson',
+                                                         'prod_mode', 'spectra', 'num_bins', 'x_min', 'x_max',
+                                                         'y_height', 'log_scale', 'y_heights'])
+# y_heights: y axis maximum of every frame (array) for the dynamic y range, else None (y_height for all frames)
 
-def calc_max_voigt_height(width, sigma_gaussian, mass, br, xs, num_bosons, int_lumi=1e-15):
+# histogram bins of the plot (see get_bin_grid)
+BinGrid = collections.namedtuple('BinGrid', ['edges', 'centres', 'values_x'])
+
+# number of histogram bins (the voigt profiles are sampled for all but the last two bins)
+NUM_BINS = 1000
+
+# number of frames evaluated at once in compute_spectra (limits the memory of the float64 intermediate arrays)
+SPECTRA_CHUNK_FRAMES = 100
+
+# space above the highest peak for the exact and dynamic y range (factor)
+Y_RANGE_MARGIN = 1.05
+
+# number of frames rendered in advance to create the shared GIF palette
+PALETTE_SAMPLE_FRAMES = 5
+
+# maximum number of frames per task and tasks per worker process, which are rendered but not yet written to the GIF
+# file (limits the memory of the finished frames, if the workers render faster than the frames are encoded)
+RENDER_CHUNK_FRAMES = 4
+PENDING_CHUNKS_PER_JOB = 2
+
+# version of the frames drawn by a renderer (part of the frame cache keys, increase it if the frames change)
+RENDERER_VERSIONS = {'root': 1, 'fast': 1}
+
+# renderer of a worker process (see _init_render_worker)
+_worker_renderer = None
+
+# time of the last performance time measurement (see perf_time_measure)
+perf = None
+
+
+def calc_sigma_values(sigma_gaussian, mass):
+    """
+    calculates the gaussian sigma values for the voigt profiles from the sigma specification
+
+    :rtype : numpy.ndarray
+    :param sigma_gaussian: sigma value (string), relative to mass if last char is %, default is 20% of mass
+    :param mass: mass values (array or (nested) list)
+    :return: sigma values (same shape as mass)
+    """
+    mass = np.asarray(mass, dtype=np.float64)
+    if sigma_gaussian is None:
+        # default sigma is 20% of mean value
+        return mass * 0.2
+    elif sigma_gaussian.find('%') >= 0:
+        # sigma can be specified in percent of mean value
+        return mass * float(sigma_gaussian[:-1]) / 100.0
+    else:
+        # sigma is fixed and absolute
+        return np.full(mass.shape, float(sigma_gaussian))
+
+
+def calc_max_voigt_height(width, sigma_gaussian, mass, br, xs, num_bosons, int_lumi=1e-15, per_frame=False):
     """
     method estimates maximum voigt profile height (normalized to xs * int_lumi) for given lists of width and sigma
     estimation, see https://en.wikipedia.org/wiki/Voigt_profile
 
-    :rtype : float
+    :rtype : float or tuple
     :param width: list of voigt width values lists (gamma)
     :param sigma_gaussian: sigma value (string)
     :param mass: list of mass value lists
@@ -20,45 +83,151 @@ def calc_max_voigt_height(width, sigma_gaussian, mass, br, xs, num_bosons, int_l
     :param xs: list of cross section values lists
     :param num_bosons: number of higgs bosons
     :param int_lumi: luminosity
-    :return: estimated maximum voigt profile height
-    """
-    # calc sigma
-    sigma = []
-    for n in xrange(num_bosons):
-        if sigma_gaussian is None:
-            # default sigma is 20% of mean value
-            for i in xrange(len(mass[n])):
-                sigma.append(mass[n][i] * 0.2)
-        elif (sigma_gaussian is not None) and (sigma_gaussian.find('%') >= 0):
-            # sigma can be specified in percent of mean value
-            for i in xrange(len(mass[n])):
-                sigma.append(mass[n][i] * float(sigma_gaussian[:-1]) / 100.0)
+    :param per_frame: return also the estimated maximum height of every frame
+    :return: estimated maximum voigt profile height (and array of the maximum heights per frame, if per_frame)
+    """
+    # arrays of bosons x frames
+    width = np.asarray(width, dtype=np.float64)[:num_bosons]
+    sigma = calc_sigma_values(sigma_gaussian, mass)[:num_bosons]
+    # check, if branching ratio is given
+    if len(br) != 0:
+        br = np.asarray(br, dtype=np.float64)[:num_bosons]
+    else:
+        br = 1.0
+    xs = np.asarray(xs, dtype=np.float64)[:num_bosons]
+
+    # # voigtian height ~= 15 * A / voigt_fwhm
+    # more precise calculation:
+    # f_g = 2 * sigma * math.sqrt(2 * math.log(2))
+    f_g = sigma * 2.35482
+    f_l = 2 * width
+    # f_v = (0.5346 * f_l) + sqrt((0.2166 * sqr(f_l)) + sqr(2 * sigma * f_g))
+    f_v = (0.5346 * f_l) + np.sqrt((0.2166 * f_l ** 2) + f_g ** 2)
+    height = 15 * br * (xs * int_lumi) / f_v
+
+    # maximum of all bosons per frame
+    frame_heights = height.max(axis=0)
+    if per_frame:
+        return float(frame_heights.max()), frame_heights
+    return float(frame_heights.max())
+
+
+def calc_max_spectrum_height(spectra, per_frame=False):
+    """
+    calculates the maximum height of the summed spectrum (the highest histogram of the plot)
+
+    :rtype : float or tuple
+    :param spectra: spectra array (frames x bins x (1 + bosons), sum of all bosons first, see compute_spectra)
+    :param per_frame: return also the maximum height of every frame
+    :return: maximum height over all frames (and array of the maximum heights per frame, if per_frame)
+    """
+    frame_heights = spectra[:, :, 0].max(axis=1).astype(np.float64)
+    if per_frame:
+        return float(frame_heights.max()), frame_heights
+    return float(frame_heights.max())
+
+
+def compute_spectra(values_x, list_values_mass, list_values_width, list_values_xs, list_values_br, sigma_gaussian,
+                    integration_range, voigt_mode='exact', normalization='analytic',
+                    chunk_frames=SPECTRA_CHUNK_FRAMES):
+    """
+    evaluates the spectra of all bosons and their sum for all frames (compute stage of the animation, the frames
+    are evaluated in chunks)
+
+    :rtype : numpy.ndarray
+    :param values_x: x values the spectra are sampled at (see get_bin_grid)
+    :param list_values_mass: list (one list per boson) of mass value lists (one value per frame)
+    :param list_values_width: list (one list per boson) of width value lists (one value per frame)
+    :param list_values_xs: list (one list per boson) of cross section value lists (one value per frame)
+    :param list_values_br: list (one list per boson) of branching ratio value lists (one value per frame) or empty
+    :param sigma_gaussian: (string) gaussian sigma value, interpreted as relative value to boson mass if last char is %
+    :param integration_range: x range (minimum, maximum) of the voigt profile normalization
+    :param voigt_mode: voigt profile evaluation mode ('exact' or 'pseudo', see voigtprofile.voigtian)
+    :param normalization: voigt profile normalization ('analytic' or 'roofit' numeric integration for validation)
+    :param chunk_frames: number of frames evaluated at once
+    :return: spectra (frames x bins x (1 + bosons), float32, contiguous): sum of all bosons at index 0, the bosons
+             (in list order) at the following indices
+    """
+    values_x = np.asarray(values_x, dtype=np.float64)
+    values_mass = np.array(list_values_mass, dtype=np.float64)
+    values_width = np.array(list_values_width, dtype=np.float64)
+    values_sigma = calc_sigma_values(sigma_gaussian, values_mass)
+    # calculate normalization factor
+    # get cross section from list, multiply by luminosity
+    norm_area = np.array(list_values_xs, dtype=np.float64) * 10 * (10 ** -15)
+    # multiply by branching ratio, if decay branch was chosen
+    if len(list_values_br) != 0:
+        norm_area = norm_area * np.array(list_values_br, dtype=np.float64)
+
+    num_bosons, num_frames = values_mass.shape
+    spectra = np.empty((num_frames, len(values_x), num_bosons + 1), dtype=np.float32)
+    for first_frame in xrange(0, num_frames, chunk_frames):
+        frames = slice(first_frame, min(first_frame + chunk_frames, num_frames))
+        mass = values_mass[:, frames]
+        width = values_width[:, frames]
+        sigma = values_sigma[:, frames]
+        # evaluate the voigt profiles for all bosons, frames and bins of the chunk (shape: bosons x frames x bins)
+        profiles = voigtprofile.voigtian(values_x, mass[:, :, np.newaxis], width[:, :, np.newaxis],
+                                         sigma[:, :, np.newaxis], mode=voigt_mode)
+        # integrals of the voigt profiles over the x range (normalization of the pdf values)
+        if normalization == 'roofit':
+            integrals = calc_roofit_integrals(integration_range[0], integration_range[1], mass, width, sigma)
         else:
-            # sigma is fixed and absolute
-            for i in xrange(len(mass[n])):
-                sigma.append(float(sigma_gaussian))
-
-    height_list = []
-    for i in xrange(len(width)):
-        l_height = []
-        for n in xrange(num_bosons):
-            # # voigtian height ~= 15 * A / voigt_fwhm
-            # more precise calculation:
-            # f_g = 2 * sigma[i] * math.sqrt(2 * math.log(2))
-            f_g = sigma[i] * 2.35482
-            f_l = 2 * width[n][i]
-            # f_v = (0.5346 * f_l) + sqrt((0.2166 * sqr(f_l)) + sqr(2 * sigma * f_g))
-            f_v = (0.5346 * f_l) + math.sqrt((0.2166 * math.pow(f_l, 2)) + math.pow(f_g, 2))
-            # check, if branching ratio is given
-            if len(br) != 0:
-                br_val = br[n][i]
-            else:
-                br_val = 1
-            height = 15 * br_val * (xs[n][i] * int_lumi) / f_v
-            # if height is greater than all past heights save
-            l_height.append(height)
-        height_list.append(max(l_height))
-    return max(height_list)
+            integrals = voigtprofile.voigtian_integral(integration_range[0], integration_range[1], mass, width,
+                                                       sigma, mode=voigt_mode)
+        # normalized pdf values scaled to the expected number of events
+        profiles *= (norm_area[:, frames] / (integrals * integrals))[:, :, np.newaxis]
+        spectra[frames, :, 1:] = profiles.transpose(1, 2, 0)
+        spectra[frames, :, 0] = profiles.sum(axis=0)
+    return spectra
+
+
+def export_spectra(filename, data, bin_grid):
+    """
+    saves the spectra of an animation with the frame and bin values as NumPy .npz file
+
+    :param filename: output filename
+    :param data: AnimationData of the animation
+    :param bin_grid: BinGrid of the histograms (see get_bin_grid)
+    """
+    np.savez(filename, spectra=data.spectra, values_ma=np.asarray(data.values_ma, dtype=np.float64),
+             values_tan_beta=np.asarray(data.values_tan_beta, dtype=np.float64),
+             higgs_bosons=np.array(data.list_higgs_boson), prod_mode=data.prod_mode, bin_edges=bin_grid.edges,
+             bin_centres=bin_grid.centres, values_x=bin_grid.values_x)
+
+
+def calc_roofit_integrals(x_min, x_max, mass, width, sigma):
+    """
+    calculates the voigt profile integrals with RooFit numeric integration (RooVoigtian.createIntegral),
+    slow reference for voigtprofile.voigtian_integral
+
+    :rtype : numpy.ndarray
+    :param x_min: lower integration limit
+    :param x_max: upper integration limit
+    :param mass: array of mass values (bosons x frames)
+    :param width: array of width values (bosons x frames)
+    :param sigma: array of sigma values (bosons x frames)
+    :return: array of integrals (bosons x frames)
+    """
+    import ROOT
+
+    # suppress INFO:NumericIntegration log
+    ROOT.RooMsgService.instance().setGlobalKillBelow(ROOT.RooFit.WARNING)
+
+    x = ROOT.RooRealVar("x", "m / GeV", x_min, x_max)
+    x.setRange("integrate", x_min, x_max)
+    mean_var = ROOT.RooRealVar("mean", "mean", 0)
+    width_var = ROOT.RooRealVar("width", "width", 0)
+    sigma_var = ROOT.RooRealVar("sigma", "sigma", 0)
+    pdf = ROOT.RooVoigtian("voigtian", "Voigtian", x, mean_var, width_var, sigma_var)
+
+    integrals = np.empty(mass.shape)
+    for index in np.ndindex(*mass.shape):
+        mean_var.setVal(mass[index])
+        width_var.setVal(width[index])
+        sigma_var.setVal(sigma[index])
+        integrals[index] = pdf.createIntegral(ROOT.RooArgSet(x), "integrate").getVal()
+    return integrals
 
 
 def perf_time_measure(start_time, comment=''):
@@ -80,7 +249,7 @@ def get_ma_val(ma_list, bin_index, nr_bins):
     Interpolate m_A value for finer bin resolution than ma_list resolution
 
     :rtype : float
-    :param ma_list: list of m_A values (only max() and min() is used)
+    :param ma_list: list of m_A values (only max() and min() is used, see get_bin_grid for all bins at once)
     :param bin_index: the bin index to get the interpolated m_A value for
     :param nr_bins: total number of bins
     :return:
@@ -92,6 +261,356 @@ def get_ma_val(ma_list, bin_index, nr_bins):
     return ma_min + (bin_index * ma_delta)
 
 
+def get_bin_grid(x_min, x_max, num_bins, num_values=None):
+    """
+    histogram bin grid of the plot, computed once and used for all bosons and frames
+
+    :rtype : BinGrid
+    :param x_min: lower edge of the first bin (TH1F xlow)
+    :param x_max: upper edge of the last bin (TH1F xup)
+    :param num_bins: number of bins
+    :param num_values: number of x values the spectra are sampled at (default: num_bins)
+    :return: bin edges (num_bins + 1) and centres (num_bins) as in TH1F, sampled x values (from x_min in steps of
+             (x_max - x_min) / num_values, the same values as get_ma_val)
+    """
+    if num_values is None:
+        num_values = num_bins
+    bin_width = float(x_max - x_min) / num_bins
+    edges = x_min + np.arange(num_bins + 1) * bin_width
+    centres = x_min + (np.arange(num_bins) + 0.5) * bin_width
+    values_x = x_min + np.arange(num_values) * (float(x_max - x_min) / float(num_values))
+    return BinGrid(edges=edges, centres=centres, values_x=values_x)
+
+
+def get_x_range(values_ma, x_range=None):
+    """
+    mass (x axis) range of the plot
+
+    :rtype : tuple
+    :param values_ma: m_A list (one value per frame)
+    :param x_range: (minimum, maximum) or None: m_A range of the frames (0.5 to 1.5 times m_A for a fixed m_A)
+    :return: minimum and maximum mass
+    """
+    if x_range is not None:
+        return float(x_range[0]), float(x_range[1])
+    ma_min = float(min(values_ma))
+    ma_max = float(max(values_ma))
+    if ma_max > ma_min:
+        return ma_min, ma_max
+    return 0.5 * ma_min, 1.5 * ma_max
+
+
+def remove_output(filename):
+    """
+    removes an output file (if present)
+
+    :param filename: filename
+    """
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def get_frame_filename(filename, frame_index):
+    """
+    filename of a single frame image ('<filename>/<filename>_N.png')
+
+    :rtype : str
+    :param filename: animated GIF output filename
+    :param frame_index: index of the frame
+    :return: frame image filename
+    """
+    return filename[:-4] + '/' + filename[:-4] + "_" + str(frame_index) + '.png'
+
+
+def create_renderer(data, renderer='root', batch=False):
+    """
+    creates the frame renderer (ROOT is only imported for the ROOT renderer, slow dictionary loading at import)
+
+    :rtype : rootrenderer.RootRenderer or fastrenderer.FastRenderer
+    :param data: AnimationData of the animation
+    :param renderer: 'root' (TCanvas) or 'fast' (NumPy/PIL, fast_mode only)
+    :param batch: use ROOT batch mode (no graphics window)
+    :return: renderer
+    """
+    if renderer == 'fast':
+        import fastrenderer
+        return fastrenderer.FastRenderer(data, batch=batch)
+    import rootrenderer
+    return rootrenderer.RootRenderer(data, batch=batch)
+
+
+def _init_render_worker(data, renderer='root'):
+    """
+    initializes the renderer of a worker process
+
+    :param data: AnimationData of the animation
+    :param renderer: renderer name (see create_renderer)
+    """
+    global _worker_renderer
+    _worker_renderer = create_renderer(data, renderer, batch=True)
+
+
+def _render_worker_frames(frame_indices):
+    """
+    renders frames in a worker process
+
+    :rtype : list
+    :param frame_indices: list of frame indices
+    :return: list of frame images (RGB arrays)
+    """
+    images = []
+    for frame_index in frame_indices:
+        _worker_renderer.draw(frame_index)
+        images.append(_worker_renderer.get_image())
+    return images
+
+
+def get_frame_key(data, frame_index, renderer='root'):
+    """
+    frame cache key of a frame: everything the frame image depends on, the spectra of the frame as digest (so the
+    input file, decay branch, sigma and voigt settings are covered without being listed)
+
+    :rtype : dict
+    :param data: AnimationData of the animation
+    :param frame_index: index of the frame
+    :param renderer: renderer name (see create_renderer)
+    :return: key (see diskcache.key_digest)
+    """
+    if data.y_heights is not None:
+        y_height = data.y_heights[frame_index]
+    else:
+        y_height = data.y_height
+    return {'renderer': renderer,
+            'renderer_version': RENDERER_VERSIONS[renderer],
+            'm_A': float(data.values_ma[frame_index]),
+            'tan_beta': float(data.values_tan_beta[frame_index]),
+            'tan_beta_scan': bool(min(data.values_tan_beta) != max(data.values_tan_beta)),
+            'higgs_bosons': list(data.list_higgs_boson),
+            'prod_mode': data.prod_mode,
+            'x_range': [float(data.x_min), float(data.x_max), int(data.num_bins)],
+            'y_height': float(y_height),
+            'log_scale': data.log_scale if data.log_scale in (None, False) else float(data.log_scale),
+            'spectra': hashlib.sha1(np.ascontiguousarray(data.spectra[frame_index])).hexdigest()}
+
+
+class FrameSource(object):
+    """
+    frame images of an animation in fast_mode: read from the frame cache (if given) or rendered in worker processes
+    or in this process; the renderer and the worker processes are only created, if frames are rendered, the rendered
+    frames are written to the frame cache in a background thread (see diskcache.CacheWriter)
+    """
+
+    def __init__(self, data, renderer='root', batch=False, jobs=1, frame_cache=None):
+        """
+        :param data: AnimationData of the animation
+        :param renderer: renderer name (see create_renderer)
+        :param batch: use ROOT batch mode (no graphics window)
+        :param jobs: number of worker processes for rendering (1: render in this process)
+        :param frame_cache: diskcache.DiskCache for the rendered frames (None: no frame cache)
+        """
+        self.data = data
+        self.renderer = renderer
+        self.batch = batch
+        self.jobs = jobs
+        self.frame_cache = frame_cache
+        if frame_cache is not None:
+            self.frame_keys = [get_frame_key(data, frame_index, renderer)
+                               for frame_index in xrange(len(data.values_ma))]
+            self.cache_writer = diskcache.CacheWriter(frame_cache)
+        else:
+            self.frame_keys = None
+            self.cache_writer = None
+        self.frame_renderer = None
+        self.pool = None
+        # number of rendered frames and frames read from the frame cache
+        self.num_rendered = 0
+        self.num_cached = 0
+
+    def is_cached(self, frame_index):
+        """
+        checks, if a frame is in the frame cache
+
+        :rtype : bool
+        :param frame_index: index of the frame
+        :return: True, if the frame is cached
+        """
+        return self.frame_keys is not None and self.frame_cache.contains(self.frame_keys[frame_index])
+
+    def get_cached(self, frame_index):
+        """
+        reads a frame from the frame cache
+
+        :rtype : numpy.ndarray
+        :param frame_index: index of the frame
+        :return: frame image (RGB array) or None, if not cached
+        """
+        if self.frame_keys is None:
+            return None
+        image = self.frame_cache.get_array(self.frame_keys[frame_index])
+        if image is not None:
+            self.num_cached += 1
+        return image
+
+    def render(self, frame_indices):
+        """
+        renders frames (chunks of consecutive frames in the worker processes) and stores them in the frame cache
+
+        :rtype : generator
+        :param frame_indices: list of frame indices
+        :return: frame images (RGB arrays) in the order of frame_indices
+        """
+        if self.jobs > 1:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.jobs, initializer=_init_render_worker,
+                                                 initargs=(self.data, self.renderer))
+            chunk_size = max(1, min(RENDER_CHUNK_FRAMES, int(math.ceil(float(len(frame_indices)) / (self.jobs * 4)))))
+            tasks = [frame_indices[first_index:first_index + chunk_size]
+                     for first_index in xrange(0, len(frame_indices), chunk_size)]
+            frame_images = itertools.izip(frame_indices, itertools.chain.from_iterable(
+                self.render_chunks(tasks)))
+        else:
+            if self.frame_renderer is None:
+                self.frame_renderer = create_renderer(self.data, self.renderer, batch=self.batch)
+            frame_images = self.draw_frames(frame_indices)
+
+        for frame_index, image in frame_images:
+            if self.cache_writer is not None:
+                self.cache_writer.put_array(self.frame_keys[frame_index], image)
+            self.num_rendered += 1
+            yield image
+
+    def render_chunks(self, tasks):
+        """
+        renders chunks of frames in the worker processes, at most PENDING_CHUNKS_PER_JOB chunks per process are
+        submitted ahead of the chunk returned next (the workers wait for the consumer of the frames)
+
+        :rtype : generator
+        :param tasks: list of frame index lists
+        :return: lists of frame images (RGB arrays) in the order of the tasks
+        """
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(self.pool.apply_async(_render_worker_frames, (task,)))
+            if len(pending) >= PENDING_CHUNKS_PER_JOB * self.jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def draw_frames(self, frame_indices):
+        """
+        renders frames in this process
+
+        :rtype : generator
+        :param frame_indices: list of frame indices
+        :return: (frame index, frame image) tuples
+        """
+        for frame_index in frame_indices:
+            self.frame_renderer.draw(frame_index)
+            yield frame_index, self.frame_renderer.get_image()
+
+    def get_images(self, frame_indices):
+        """
+        frame images from the frame cache or rendered
+
+        :rtype : dict
+        :param frame_indices: list of frame indices
+        :return: dictionary of frame images (frame index: RGB array)
+        """
+        images = {}
+        for frame_index in frame_indices:
+            image = self.get_cached(frame_index)
+            if image is not None:
+                images[frame_index] = image
+        missing_frames = [frame_index for frame_index in frame_indices if frame_index not in images]
+        images.update(zip(missing_frames, self.render(missing_frames)))
+        return images
+
+    def iter_images(self, images):
+        """
+        all frame images in frame order, the frames, which are neither given nor cached, are rendered in advance
+        (in the worker processes)
+
+        :rtype : generator
+        :param images: dictionary of frame images already available (frame index: RGB array, see get_images)
+        :return: (frame index, frame image) tuples
+        """
+        num_frames = len(self.data.values_ma)
+        render_frames = [frame_index for frame_index in xrange(num_frames)
+                         if frame_index not in images and not self.is_cached(frame_index)]
+        rendered_images = self.render(render_frames)
+        render_frames = set(render_frames)
+        for frame_index in xrange(num_frames):
+            if frame_index in images:
+                image = images.pop(frame_index)
+            elif frame_index in render_frames:
+                image = next(rendered_images)
+            else:
+                image = self.get_cached(frame_index)
+                if image is None:
+                    # removed from the frame cache in the meantime (by another process)
+                    image = next(self.render([frame_index]))
+            yield frame_index, image
+
+    def close(self):
+        """
+        stops the worker processes, waits until the rendered frames are written to the frame cache
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.cache_writer is not None:
+            self.cache_writer.close()
+            self.cache_writer = None
+
+
+def get_palette_sample_frames(num_frames):
+    """
+    indices of the frames used to create the shared GIF palette (evenly distributed over the animation)
+
+    :rtype : list
+    :param num_frames: number of frames
+    :return: list of frame indices
+    """
+    sample_frames = np.linspace(0, num_frames - 1, min(num_frames, PALETTE_SAMPLE_FRAMES))
+    return sorted(set(int(round(frame_index)) for frame_index in sample_frames))
+
+
+def open_gif_writer(gif_writer, filename, sample_images, max_rectangles=1, encoder='pil', encode_jobs=0):
+    """
+    opens the GIF file for streaming, with a shared palette created from sample frames (if given)
+
+    :param gif_writer: images2gif.GifWriter
+    :param filename: animated GIF output filename
+    :param sample_images: list of sample frame images (RGB arrays) or empty list (palette per frame)
+    :param max_rectangles: maximum number of changed rectangles written per frame
+    :param encoder: GIF image data encoder ('pil' or 'lzw', see images2gif.getImageData)
+    :param encode_jobs: number of worker processes compressing the frames (0: no worker processes)
+    """
+    if len(sample_images) > 0:
+        palette = gif_writer.makeSharedPalette(sample_images)
+    else:
+        palette = None
+    gif_writer.open(filename, palette=palette, maxRectangles=max_rectangles, encoder=encoder,
+                    processes=encode_jobs)
+
+
+def add_frame(gif_writer, image, duration, frame_filename=None):
+    """
+    adds a frame to the animated GIF (streaming mode), optionally saves it as image file
+
+    :param gif_writer: images2gif.GifWriter opened for writing
+    :param image: frame image (RGB array)
+    :param duration: frame duration in seconds
+    :param frame_filename: image filename of the frame (None: do not save)
+    """
+    gif_writer.addFrame(image, duration=duration)
+    if frame_filename is not None:
+        PIL.Image.fromarray(image).save(frame_filename)
+
+
 def animate_higgs_peak(values_ma,
                        list_values_mass,
                        list_values_width,
@@ -106,10 +625,22 @@ def animate_higgs_peak(values_ma,
                        keep_frames=True,
                        frame_time=20,
                        debug=0,
-                       log_scale=False):
+                       log_scale=False,
+                       voigt_mode='exact',
+                       normalization='analytic',
+                       jobs=1,
+                       palette_mode='shared',
+                       max_rectangles=1,
+                       gif_encoder='pil',
+                       encode_jobs=0,
+                       renderer='root',
+                       y_range='exact',
+                       export_filename=None,
+                       x_range=None,
+                       frame_cache=None):
 
     """
-    animate higgs peaks
+    animate higgs peaks: compute stage (compute_spectra) and render stage (render_animation)
 
     :rtype : None
     :param values_ma: m_A list (one value per frame)
@@ -117,17 +648,36 @@ def animate_higgs_peak(values_ma,
     :param list_values_width: list (one list per boson) of width value lists (one value per frame)
     :param list_values_xs: list (one list per boson) of cross section value lists (one value per frame)
     :param list_values_br: list (one list per boson) of branching ratio value lists (one value per frame)
-    :param tan_beta: tangent beta value
+    :param tan_beta: tangent beta value or list (one value per frame, e.g. for tan beta scans)
     :param list_higgs_boson: list of higgs bosons
     :param sigma_gaussian: (string) gaussian sigma value, interpreted as relative value to boson mass if last char is %
     :param prod_mode: production mode (for legend)
-    :param filename: animated GIF output filename
+    :param filename: animated GIF output filename (None: no rendering)
     :param fast_mode: use fast gif creation mode (larger filesize)
-    :param keep_frames: do not delete temporary created images for every frames
+    :param keep_frames: save the frames also as images (fast_mode only)
     :param frame_time: time (in ms) per single frame/images
     :param debug: debug verbosity (0 means least debug output)
     :param log_scale: use logarithmic y axis scale
+    :param voigt_mode: voigt profile evaluation mode ('exact' or 'pseudo', see voigtprofile.voigtian)
+    :param normalization: voigt profile normalization ('analytic' or 'roofit' numeric integration for validation)
+    :param jobs: number of worker processes for rendering (requires fast_mode if greater than 1)
+    :param palette_mode: GIF palette in fast_mode ('shared' by all frames or 'frame' palette per frame)
+    :param max_rectangles: maximum number of changed rectangles per frame in fast_mode (see images2gif.GifWriter.open)
+    :param gif_encoder: GIF image data encoder in fast_mode ('pil' or 'lzw', see images2gif.getImageData)
+    :param encode_jobs: number of worker processes compressing the frames in fast_mode (0: compress while rendering)
+    :param renderer: frame renderer ('root' TCanvas or 'fast' NumPy/PIL rasterizer, requires fast_mode)
+    :param y_range: y axis maximum: 'exact' (highest peak of the animation), 'estimate' (from the voigt widths, see
+                    calc_max_voigt_height) or 'dynamic' (highest peak of every frame)
+    :param export_filename: save the spectra as NumPy .npz file (see export_spectra), None: no export
+    :param x_range: mass (x axis) range (minimum, maximum), None: m_A range of the frames (see get_x_range)
+    :param frame_cache: diskcache.DiskCache of rendered frames in fast_mode (see render_animation)
     """
+    if jobs > 1 and not fast_mode:
+        raise ValueError("rendering with several jobs requires fast_mode")
+
+    if renderer == 'fast' and not fast_mode:
+        raise ValueError("the fast renderer requires fast_mode")
+
     if debug > 2:
         # initialize performance time measurement
         global perf
@@ -137,225 +687,268 @@ def animate_higgs_peak(values_ma,
         # performance time measurement
         perf = perf_time_measure(perf)
 
-    # remove gif file (if present)
-    try:
-        os.remove(filename)
-    except OSError:
-        pass
+    data, bin_grid = create_animation_data(values_ma, list_values_mass, list_values_width, list_values_xs,
+                                           list_values_br, tan_beta, list_higgs_boson, sigma_gaussian, prod_mode,
+                                           log_scale=log_scale, voigt_mode=voigt_mode, normalization=normalization,
+                                           y_range=y_range, x_range=x_range, debug=debug)
+
+    if export_filename is not None:
+        export_spectra(export_filename, data, bin_grid)
+
+    # render stage
+    if filename is not None:
+        render_animation(data, filename, fast_mode=fast_mode, keep_frames=keep_frames, frame_time=frame_time,
+                         debug=debug, jobs=jobs, palette_mode=palette_mode, max_rectangles=max_rectangles,
+                         gif_encoder=gif_encoder, encode_jobs=encode_jobs, renderer=renderer,
+                         frame_cache=frame_cache)
+
+
+def create_animation_data(values_ma,
+                          list_values_mass,
+                          list_values_width,
+                          list_values_xs,
+                          list_values_br,
+                          tan_beta,
+                          list_higgs_boson,
+                          sigma_gaussian,
+                          prod_mode,
+                          log_scale=False,
+                          voigt_mode='exact',
+                          normalization='analytic',
+                          y_range='exact',
+                          spectra=None,
+                          x_range=None,
+                          debug=0):
+    """
+    computes the spectra (compute stage) and the y axis range of an animation
 
-    if not os.path.exists(filename[:-4] + '/'):
-        os.makedirs(filename[:-4] + '/')
+    :rtype : tuple
+    :param values_ma: m_A list (one value per frame)
+    :param list_values_mass: list (one list per boson) of mass value lists (one value per frame)
+    :param list_values_width: list (one list per boson) of width value lists (one value per frame)
+    :param list_values_xs: list (one list per boson) of cross section value lists (one value per frame)
+    :param list_values_br: list (one list per boson) of branching ratio value lists (one value per frame)
+    :param tan_beta: tangent beta value or list (one value per frame, e.g. for tan beta scans)
+    :param list_higgs_boson: list of higgs bosons
+    :param sigma_gaussian: (string) gaussian sigma value, interpreted as relative value to boson mass if last char is %
+    :param prod_mode: production mode (for legend)
+    :param log_scale: use logarithmic y axis scale
+    :param voigt_mode: voigt profile evaluation mode ('exact' or 'pseudo', see voigtprofile.voigtian)
+    :param normalization: voigt profile normalization ('analytic' or 'roofit' numeric integration for validation)
+    :param y_range: y axis maximum ('exact', 'estimate' or 'dynamic', see animate_higgs_peak)
+    :param spectra: spectra computed before with the same values (see compute_spectra), None: compute them
+    :param x_range: mass (x axis) range (minimum, maximum), None: m_A range of the frames (see get_x_range)
+    :param debug: debug verbosity (0 means least debug output)
+    :return: AnimationData and BinGrid of the animation
+    """
+    global perf
+    if debug > 2 and perf is None:
+        # initialize performance time measurement
+        perf = time.time()
 
     num_bosons = len(list_values_mass)
 
-    # calculate plot y axis range (max height)
-    y_height = calc_max_voigt_height(list_values_width, sigma_gaussian, list_values_mass, list_values_br,
-                                     list_values_xs, num_bosons)
-    if debug > 1:
-        print "height", y_height
+    values_tan_beta = [float(value) for value in np.broadcast_to(tan_beta, (len(values_ma),))]
 
-    rf = ROOT.RooFit
+    x_min, x_max = get_x_range(values_ma, x_range)
+    x_span = x_max - x_min
 
-    if debug > 2:
-        # performance time measurement
-        perf = perf_time_measure(perf, 'some calcs')
-
-    # suppress INFO:NumericIntegration log
-    ROOT.RooMsgService.instance().setGlobalKillBelow(ROOT.RooFit.WARNING)
+    # x values of the bins (TH1F binning over the x range)
+    bin_grid = get_bin_grid(x_min, x_max, NUM_BINS, NUM_BINS - 2)
 
-    ma_min = min(values_ma)
-    ma_max = max(values_ma)
-    ma_range = ma_max - ma_min
-    x = ROOT.RooRealVar("x", "m / GeV", ma_min - ma_range, ma_max + ma_range)
-    x.setRange("integrate", ma_min - ma_range, ma_max + ma_range)
+    # compute stage: spectra of all bosons and frames
+    if spectra is None:
+        spectra = compute_spectra(bin_grid.values_x, list_values_mass, list_values_width, list_values_xs,
+                                  list_values_br, sigma_gaussian, (x_min - x_span, x_max + x_span),
+                                  voigt_mode=voigt_mode, normalization=normalization)
 
-    canvas = ROOT.TCanvas("canvas", "canvas", 1300, 750)
-    if log_scale is not False:
-        canvas.SetLogy(1)
-
-    width = []
-    mean = []
-    pdf = []
-    sigma = []
-    hist = []
+        if debug > 2:
+            # performance time measurement
+            perf = perf_time_measure(perf, 'voigt profiles evaluated')
 
-    if debug > 2:
-        # performance time measurement
-        perf = perf_time_measure(perf, 'before RooRealVar loop')
-
-    # do not modify ROOT file
-    ROOT.TH1.AddDirectory(False)
-
-    list_hist_names = ['sum'] + list_higgs_boson
-    num_hists = num_bosons + 1
-    num_bins_visible = 1000
-    for boson_index in range(num_bosons):
-        width.append(ROOT.RooRealVar("width", "width", 0))
-        mean.append(ROOT.RooRealVar("mean", "mean", 0))
-        sigma.append(ROOT.RooRealVar("sigma", "sigma", 0))
-        pdf.append(ROOT.RooVoigtian("voigtian", "Voigtian", x, mean[boson_index], width[boson_index],
-                                    sigma[boson_index]))
-    for hist_nr in range(num_hists):
-        hist.append(ROOT.TH1F(list_hist_names[hist_nr], "", num_bins_visible,
-                              float(min(values_ma)), float(max(values_ma))))
-
-    frame_filenames = []
-
-    # open logo, create logo frame
-    logo = ROOT.TImage.Open("logo.png")
-    logo_frame = ROOT.TPad("logo_pad", "", 0.17, 0.9, 0.3, 1.0)
+    # calculate plot y axis range (max height)
+    y_heights = None
+    if y_range == 'estimate':
+        y_height = calc_max_voigt_height(list_values_width, sigma_gaussian, list_values_mass, list_values_br,
+                                         list_values_xs, num_bosons)
+    else:
+        y_height, frame_heights = calc_max_spectrum_height(spectra, per_frame=True)
+        y_height *= Y_RANGE_MARGIN
+        if y_range == 'dynamic':
+            # frames without peaks keep the maximum of the animation
+            y_heights = np.where(frame_heights > 0, frame_heights * Y_RANGE_MARGIN, y_height)
+    if debug > 1:
+        print "height", y_height
 
     if debug > 2:
         # performance time measurement
-        perf = perf_time_measure(perf, 'before main loop')
-
-    if debug > 1:
-        print 'Rendering', round(len(list_values_mass[0])), 'frames ...'
-        print 'Animation time:', round(len(list_values_mass[0])) * 40, 'ms'
+        perf = perf_time_measure(perf, 'y range calculated')
+
+    data = AnimationData(values_ma=values_ma,
+                         values_tan_beta=values_tan_beta,
+                         list_higgs_boson=list_higgs_boson,
+                         prod_mode=prod_mode,
+                         spectra=spectra,
+                         num_bins=NUM_BINS,
+                         x_min=x_min,
+                         x_max=x_max,
+                         y_height=y_height,
+                         log_scale=log_scale,
+                         y_heights=y_heights)
+
+    return data, bin_grid
+
+
+def render_animation(data,
+                     filename,
+                     fast_mode=False,
+                     keep_frames=True,
+                     frame_time=20,
+                     debug=0,
+                     jobs=1,
+                     palette_mode='shared',
+                     max_rectangles=1,
+                     gif_encoder='pil',
+                     encode_jobs=0,
+                     renderer='root',
+                     batch=False,
+                     frame_cache=None):
+    """
+    renders the frames of an animation and writes the animated GIF file (render stage of the animation)
 
-    for ma_index in xrange(0, len(values_ma)):
-        if debug > 2:
-            # performance time measurement
-            perf = perf_time_measure(perf, 'loop begin')
-
-        for boson_index in range(num_bosons):
-            hist_index = boson_index + 1
-            mean[boson_index].setVal(list_values_mass[boson_index][ma_index])
-            width[boson_index].setVal(list_values_width[boson_index][ma_index])
-            if sigma_gaussian is None:
-                # default sigma is 20% of mean value
-                sigma[boson_index].setVal(list_values_mass[boson_index][ma_index] * 0.2)
-            elif (sigma_gaussian is not None) and (sigma_gaussian.find('%') >= 0):
-                # sigma can be specified in percent of mean value
-                sigma[boson_index].setVal(list_values_mass[boson_index][ma_index] * float(sigma_gaussian[:-1]) / 100.0)
-            else:
-                # sigma is fixed and absolute
-                sigma[boson_index].setVal(float(sigma_gaussian))
-
-            # fill TH1F histograms with vales from pdf
-            num_bins_visible = hist[boson_index].GetNbinsX() - 2
-            for bin_index in xrange(num_bins_visible):
-                x.setVal(get_ma_val(values_ma, bin_index, num_bins_visible))
-                val = pdf[boson_index].getVal(ROOT.RooArgSet(x))
-                # hist_index = boson_index + 1
-                hist[hist_index].SetBinContent(bin_index + 1, val)
-            # calculate normalization factor
-            # get cross section from list, multiply by luminosity
-            norm_area = list_values_xs[boson_index][ma_index] * 10 * (10 ** -15)
-            # multiply by branching ratio, if decay branch was chosen
-            if len(list_values_br) != 0:
-                print(str(list_values_br))
-                norm_area = norm_area * list_values_br[boson_index][ma_index]
-            scale_factor = norm_area / pdf[boson_index].createIntegral(ROOT.RooArgSet(x), "integrate").getVal()
-            hist[hist_index].Scale(scale_factor)
-
-        # set sum of histogram bin values as hist_sum histogram value
-        for bin_nr in xrange(hist[0].GetNbinsX()):
-            val = 0.0
-            # iterate over all histograms except histogram 0 (sum)
-            for hist_index_l in xrange(1, num_hists):
-                val += hist[hist_index_l].GetBinContent(bin_nr)
-            hist[0].SetBinContent(bin_nr, val)
-
-        # create legend
-        leg = ROOT.TLegend(0.70, 0.70, 0.99, 0.99)  # over default legend box
-        leg.SetFillColor(0)
-        leg.SetLineColor(1)
-
-        # set histogram title and axis labels (fist histogram only)
-        hist[0].SetTitle("MSSM-Higgs-Viewer")
-        hist[0].GetXaxis().SetTitle("m [GeV]")
-        hist[0].GetYaxis().SetTitle("Events / GeV")
-
-        # draw all histograms
-        for hist_index in range(num_hists):
-            # set previous estimated height
-            hist[hist_index].SetMaximum(y_height)
-            # set minimum (for logarithmic scale)
-            if log_scale is not False:
-                if log_scale is None:
-                    hist[hist_index].SetMinimum(1e-18)
-                else:
-                    hist[hist_index].SetMinimum(log_scale)
-            else:
-                hist[hist_index].SetMinimum(0)
-            # set histogram style
-            ROOT.gStyle.SetHistFillColor(hist_index + 1)
-            ROOT.gStyle.SetHistFillStyle(3003)
-            ROOT.gStyle.SetHistLineColor(hist_index + 1)
-            ROOT.gStyle.SetHistLineStyle(0)
-            ROOT.gStyle.SetHistLineWidth(2)
-            hist[hist_index].UseCurrentStyle()
-            # set x axis range
-            hist[hist_index].GetXaxis().SetRange(1, num_bins_visible)
-            # draw histogram
-            hist[hist_index].Draw("HIST SAME")
-            # add legend entry
-            if hist_index == 0:
-                leg.AddEntry(hist[hist_index], "sum of all Higgs bosons")
-            else:
-                # boson_index = (hist_index - 1)
-                leg.AddEntry(hist[hist_index], list_higgs_boson[hist_index - 1] + " - Higgs boson")
+    :rtype : None
+    :param data: AnimationData of the animation (see animate_higgs_peak)
+    :param filename: animated GIF output filename
+    :param fast_mode: use fast gif creation mode (larger filesize)
+    :param keep_frames: save the frames also as images (fast_mode only)
+    :param frame_time: time (in ms) per single frame/images
+    :param debug: debug verbosity (0 means least debug output)
+    :param jobs: number of worker processes for rendering (requires fast_mode if greater than 1)
+    :param palette_mode: GIF palette in fast_mode ('shared' by all frames or 'frame' palette per frame)
+    :param max_rectangles: maximum number of changed rectangles per frame in fast_mode (see images2gif.GifWriter.open)
+    :param gif_encoder: GIF image data encoder in fast_mode ('pil' or 'lzw', see images2gif.getImageData)
+    :param encode_jobs: number of worker processes compressing the frames in fast_mode (0: compress while rendering)
+    :param renderer: frame renderer ('root' TCanvas or 'fast' NumPy/PIL rasterizer, requires fast_mode)
+    :param batch: use ROOT batch mode (no graphics window)
+    :param frame_cache: diskcache.DiskCache of rendered frames in fast_mode (see get_frame_key), only the frames not
+                        in the cache are rendered (None: no frame cache; not used with the fast renderer)
+    """
+    global perf
+    if jobs > 1 and not fast_mode:
+        raise ValueError("rendering with several jobs requires fast_mode")
 
-        # add legend header and draw
-        leg.SetHeader("prod. mode = " + prod_mode + "   m_{A}" +
-                      " = {0:04d}   tan(#beta) = {1:2.0f}".format(int(values_ma[ma_index]), tan_beta))
-        leg.Draw()
+    if renderer == 'fast' and not fast_mode:
+        raise ValueError("the fast renderer requires fast_mode")
 
-        # draw logo frame and logo, change back to canvas
-        logo_frame.Draw()
-        logo_frame.cd()
-        logo.Draw()
-        canvas.cd()
+    if frame_cache is not None and not fast_mode:
+        raise ValueError("the frame cache requires fast_mode")
 
-        if debug > 2:
-            # performance time measurement
-            perf = perf_time_measure(perf, 'loop bosons plotted')
+    if frame_cache is not None and renderer == 'fast':
+        # the fast renderer draws a frame in about the time needed to compress and write it, the frame cache only
+        # pays off for the ROOT renderer
+        if debug > 1:
+            print 'Frame cache not used with the fast renderer'
+        frame_cache = None
 
-        if not fast_mode:
-            # animation delay in centiseconds (10ms)
-            canvas.Print(filename + "+" + str(int(round(frame_time / 10))))
+    if debug > 2 and perf is None:
+        # initialize performance time measurement
+        perf = time.time()
 
-        if fast_mode:
-            frame_filename = filename[:-4] + '/' + filename[:-4] + "_" + str(ma_index) + '.png'
-            canvas.Print(frame_filename)
-            frame_filenames.append(frame_filename)
+    values_ma = data.values_ma
 
-        if debug > 2:
-            # performance time measurement
-            perf = perf_time_measure(perf, 'loop canvas printed')
+    # remove gif file (if present)
+    remove_output(filename)
 
-    if debug > 2:
-        # performance time measurement
-        perf = perf_time_measure(perf, 'loop done')
+    # frame images are only a side output of the fast mode
+    save_frames = fast_mode and keep_frames
+    if save_frames and not os.path.exists(filename[:-4] + '/'):
+        os.makedirs(filename[:-4] + '/')
 
-    if not fast_mode:
-        # infinite loop gif
-        canvas.Print(filename + "++100++")
+    if debug > 1:
+        print 'Rendering', round(len(values_ma)), 'frames ...'
+        print 'Animation time:', round(len(values_ma)) * 40, 'ms'
 
     if fast_mode:
-        # open frame images
-        images = [PIL.Image.open(img) for img in frame_filenames]
-
-        if debug > 2:
-            # performance time measurement
-            perf = perf_time_measure(perf, 'imgs loaded')
-
-        # write gif
-        images2gif.writeGif(filename, images, duration=(frame_time/1000.0))
-
-        if not keep_frames:
-            for frame_filename in frame_filenames:
-                try:
-                    os.remove(frame_filename)
-                except OSError:
-                    print "error removing ", frame_filename
-                    pass
-            try:
-                os.rmdir(filename[:-4])
-            except OSError:
-                print "error removing ", filename[:-4] + '/'
-                pass
+        # frames are encoded and written to the GIF file as soon as they are rendered (or read from the frame cache)
+        gif_writer = images2gif.GifWriter()
+        frame_duration = frame_time / 1000.0
+        if palette_mode == 'shared':
+            palette_frames = get_palette_sample_frames(len(values_ma))
+        else:
+            palette_frames = []
+
+        frame_source = FrameSource(data, renderer, batch=batch, jobs=jobs, frame_cache=frame_cache)
+        try:
+            # the sample frames are not rendered again
+            images = frame_source.get_images(palette_frames)
+            open_gif_writer(gif_writer, filename, [images[frame_index] for frame_index in palette_frames],
+                            max_rectangles, gif_encoder, encode_jobs)
+
+            if debug > 2:
+                # performance time measurement
+                perf = perf_time_measure(perf, 'before main loop')
+
+            for frame_index, image in frame_source.iter_images(images):
+                add_frame(gif_writer, image, frame_duration,
+                          get_frame_filename(filename, frame_index) if save_frames else None)
+
+                if debug > 2:
+                    # performance time measurement
+                    perf = perf_time_measure(perf, 'loop frame written')
+
+            if debug > 2:
+                # performance time measurement
+                perf = perf_time_measure(perf, 'loop done')
+
+            # complete gif
+            gif_writer.close()
+        except:
+            # stop the encoder processes, no truncated GIF file
+            gif_writer.abort()
+            remove_output(filename)
+            raise
+        finally:
+            frame_source.close()
+
+        if frame_cache is not None and debug > 1:
+            print 'Frame cache:', frame_source.num_cached, 'frames read,', frame_source.num_rendered, \
+                'frames rendered'
+    else:
+        try:
+            frame_renderer = create_renderer(data, renderer, batch=batch)
+
+            if debug > 2:
+                # performance time measurement
+                perf = perf_time_measure(perf, 'renderer created')
+
+            for ma_index in xrange(0, len(values_ma)):
+                if debug > 2:
+                    # performance time measurement
+                    perf = perf_time_measure(perf, 'loop begin')
+
+                frame_renderer.draw(ma_index)
+
+                if debug > 2:
+                    # performance time measurement
+                    perf = perf_time_measure(perf, 'loop bosons plotted')
+
+                # animation delay in centiseconds (10ms)
+                frame_renderer.print_frame(filename + "+" + str(int(round(frame_time / 10))))
+
+                if debug > 2:
+                    # performance time measurement
+                    perf = perf_time_measure(perf, 'loop frame written')
+
+            if debug > 2:
+                # performance time measurement
+                perf = perf_time_measure(perf, 'loop done')
+
+            # infinite loop gif
+            frame_renderer.print_frame(filename + "++100++")
+        except:
+            # no truncated GIF file
+            remove_output(filename)
+            raise
 
     if debug > 2:
         # performance time measurement
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+Performance benchmarks of the mssm-higgs-viewer components (run with -h for the list of benchmarks).
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# size of the animation frames (see rootrenderer)
+FRAME_WIDTH = 1300
+FRAME_HEIGHT = 750
+
+# code to produce the data of the first frame (grids, interpolation, voigt profile) in a fresh interpreter
+FIRST_FRAME_CODE = """
+import numpy as np
+import animatehiggspeak, gridcache, th2grid, voigtprofile
+grids = gridcache.load_grids({input_filename!r}, ['m_H', 'width_H', 'xs_gg_H'], cache_dir={cache_dir!r})
+mass, width, xs = th2grid.interpolate_grids(grids, [{m_a}], {tan_beta})
+x = np.linspace(0.5 * mass[0], 1.5 * mass[0], 998)
+voigtprofile.voigtian(x, mass, width, animatehiggspeak.calc_sigma_values(None, mass))
+"""
+
+
+def time_command(command, repeat=3):
+    """
+    measures the wall time of a command (minimum of several runs)
+
+    :rtype : float
+    :param command: command (list of arguments)
+    :param repeat: number of runs
+    :return: minimum wall time in seconds or None, if the command failed
+    """
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in xrange(repeat):
+            start_time = time.time()
+            if subprocess.call(command, cwd=PACKAGE_DIR, stdout=devnull, stderr=devnull) != 0:
+                return None
+            times.append(time.time() - start_time)
+    return min(times)
+
+
+def time_function(function, repeat=3):
+    """
+    measures the wall time of a function call (minimum of several runs)
+
+    :rtype : tuple
+    :param function: function without arguments
+    :param repeat: number of runs
+    :return: minimum wall time in seconds and the result of the last call
+    """
+    times = []
+    for _ in xrange(repeat):
+        start_time = time.time()
+        result = function()
+        times.append(time.time() - start_time)
+    return min(times), result
+
+
+def make_plot_frame(width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    """
+    creates an RGB image similar to an animation frame (white background, axes, hatched peaks with
+    smooth edges)
+
+    :rtype : numpy.ndarray
+    :param width: image width
+    :param height: image height
+    :return: image array (height x width x 3, uint8)
+    """
+    import numpy as np
+    image = np.full((height, width, 3), 255.0)
+    x = np.arange(width)
+    y = np.arange(height)[:, np.newaxis]
+    for peak_index, color in enumerate([(255, 0, 0), (0, 255, 0), (0, 0, 255)]):
+        curve = height * (0.9 - 0.7 * np.exp(-0.5 * ((x - width * (0.3 + 0.2 * peak_index)) / 40.0) ** 2))
+        # fraction of the pixel below the curve (smooth edges), hatched area
+        coverage = np.clip(y - curve + 0.5, 0, 1) * (y < 0.9 * height)
+        coverage = coverage * np.where((x + y) % 8 < 2, 1.0, 0.15)
+        image = image * (1 - coverage[:, :, np.newaxis]) + coverage[:, :, np.newaxis] * np.array(color)
+    image[int(0.9 * height), int(0.1 * width):int(0.95 * width)] = 0
+    image[int(0.1 * height):int(0.9 * height), int(0.1 * width)] = 0
+    return image.round().astype(np.uint8)
+
+
+def make_animation_data(num_frames=10, num_bins=1000):
+    """
+    creates animation data with gaussian peaks of two bosons moving through the plot
+
+    :rtype : animatehiggspeak.AnimationData
+    :param num_frames: number of frames
+    :param num_bins: number of histogram bins
+    :return: animation data
+    """
+    import numpy as np
+    import animatehiggspeak
+    values_ma = np.linspace(200.0, 800.0, num_frames)
+    x = np.arange(num_bins - 2) + 0.5
+    peaks = np.array([[1e-16 * np.exp(-0.5 * ((x - factor * m_a) / 30.0) ** 2) for factor in (1.0, 1.1)]
+                      for m_a in values_ma])
+    # frames x bins x (sum, bosons)
+    spectra = np.concatenate((peaks.sum(axis=1)[:, np.newaxis, :], peaks), axis=1).transpose(0, 2, 1)
+    spectra = np.ascontiguousarray(spectra, dtype=np.float32)
+    return animatehiggspeak.AnimationData(values_ma=list(values_ma), values_tan_beta=[10.0] * num_frames,
+                                          list_higgs_boson=['H', 'A'], prod_mode='gg', spectra=spectra,
+                                          num_bins=num_bins, x_min=0.0, x_max=float(num_bins), y_height=2.5e-16,
+                                          log_scale=False, y_heights=None)
+
+
+def print_time(comment, seconds):
+    """
+    prints a benchmark result
+
+    :param comment: benchmark description
+    :param seconds: time in seconds or None, if not available
+    """
+    if seconds is None:
+        print '{0:50s} not available'.format(comment)
+    else:
+        print '{0:50s} {1:8.3f} s'.format(comment, seconds)
+
+
+def benchmark_startup(args):
+    """
+    startup time: argument parsing (viewer.py --help), ROOT import and time to the first frame data
+    from the ROOT file (including ROOT startup) and from the NumPy grid cache (without ROOT)
+    """
+    print_time('viewer.py --help', time_command([sys.executable, 'viewer.py', '--help'], args.repeat))
+    print_time('import ROOT', time_command([sys.executable, '-c', 'import ROOT'], args.repeat))
+
+    if args.input_filename is not None:
+        input_filename = os.path.abspath(args.input_filename)
+        code_parameters = dict(input_filename=input_filename, m_a=args.m_a, tan_beta=args.tan_beta)
+
+        # a not existing cache directory forces reading the ROOT file
+        code = FIRST_FRAME_CODE.format(cache_dir=os.path.join(PACKAGE_DIR, 'no-cache'), **code_parameters)
+        print_time('first frame data (ROOT file)', time_command([sys.executable, '-c', code], args.repeat))
+
+        import gridcache
+        if gridcache.is_cache_valid(input_filename):
+            code = FIRST_FRAME_CODE.format(cache_dir=None, **code_parameters)
+            print_time('first frame data (grid cache)', time_command([sys.executable, '-c', code], args.repeat))
+        else:
+            print 'no valid grid cache, create it with: ./gridcache.py -i', args.input_filename
+
+
+def benchmark_neuquant(args):
+    """
+    NeuQuant palette learning (sequential and in batches) and quantization (color search, lookup tables) of a
+    frame sized test image
+    """
+    import numpy as np
+    import PIL.Image
+    import images2gif
+
+    image = PIL.Image.fromarray(make_plot_frame()).convert("RGBA")
+    pixels = np.asarray(image)[:, :, :3].reshape(-1, 3).astype(np.int32)
+    # progress messages of NeuQuant
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        sequential_time, sequential = time_function(
+            lambda: images2gif.NeuQuant(image, args.samplefac, batchsize=1), 1)
+        batch_time, batch = time_function(
+            lambda: images2gif.NeuQuant(image, args.samplefac, batchsize=args.batchsize), args.repeat)
+        quantize_time, quantized = time_function(lambda: batch.quantize_without_scipy(image), args.repeat)
+        # the first call builds/fills the lookup table, further frames only read it
+        lookup_times = []
+        for bits in (8, 6, 5):
+            build_time = time_function(lambda: batch.quantize_with_lookup_table(image, bits), 1)[0]
+            lookup_time = time_function(lambda: batch.quantize_with_lookup_table(image, bits), args.repeat)[0]
+            lookup_times.append((bits, build_time, lookup_time))
+        if images2gif.get_cKDTree() is not None:
+            scipy_time = time_function(lambda: batch.quantize_with_scipy(image), args.repeat)[0]
+        else:
+            scipy_time = None
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    print_time('learning (sequential, batchsize 1)', sequential_time)
+    print_time('learning (batchsize {0})'.format(args.batchsize), batch_time)
+    print_time('quantization (color search)', quantize_time)
+    for bits, build_time, lookup_time in lookup_times:
+        print_time('quantization ({0} bit lookup table, first frame)'.format(bits), build_time)
+        print_time('quantization ({0} bit lookup table)'.format(bits), lookup_time)
+    print_time('quantization (scipy cKDTree)', scipy_time)
+
+    # distances between the palettes and mean quantization errors
+    for comment, neuquant in [('sequential', sequential), ('batchsize {0}'.format(args.batchsize), batch)]:
+        palette = neuquant.colormap[:, :3]
+        other = (batch if neuquant is sequential else sequential).colormap[:, :3]
+        distance = np.sqrt(((palette[:, np.newaxis, :] - other[np.newaxis, :, :]) ** 2).sum(2).min(1)).mean()
+        error = np.abs(palette[neuquant.inxsearch(pixels[:, 0], pixels[:, 1], pixels[:, 2])] - pixels).mean()
+        print '{0:50s} {1:8.3f}'.format('mean palette distance to other (' + comment + ')', distance)
+        print '{0:50s} {1:8.3f}'.format('mean quantization error (' + comment + ')', error)
+    print '{0:50s} {1:8d}'.format('colors of quantized image', len(quantized.getcolors(256) or []))
+
+
+def benchmark_grid(args):
+    """
+    x values of the histogram bins: get_ma_val per bin and precomputed bin grid (the sampled values have to be
+    unchanged)
+    """
+    import numpy as np
+    import animatehiggspeak
+    values_ma = list(np.linspace(args.ma_min, args.ma_max, args.frames + 1)[1:])
+    num_values = args.bins - 2
+
+    per_bin_time, per_bin = time_function(
+        lambda: np.array([animatehiggspeak.get_ma_val(values_ma, bin_index, num_values)
+                          for bin_index in xrange(num_values)]), args.repeat)
+    grid_time, bin_grid = time_function(
+        lambda: animatehiggspeak.get_bin_grid(min(values_ma), max(values_ma), args.bins, num_values), args.repeat)
+    print_time('x values (get_ma_val per bin)', per_bin_time)
+    print_time('x values (bin grid)', grid_time)
+
+    if not np.array_equal(per_bin, bin_grid.values_x):
+        sys.exit('sampled x values changed (maximum difference {0:g})'.format(
+            np.abs(per_bin - bin_grid.values_x).max()))
+    print 'sampled x values unchanged'
+
+
+def benchmark_render(args):
+    """
+    rendering time per frame: fast renderer with the cached static layer and with the static layer drawn for every
+    frame, time of the y axis region redrawn for the dynamic y range, ROOT renderer (if available)
+    """
+    import fastrenderer
+    # the renderers read the logo from the working directory
+    os.chdir(PACKAGE_DIR)
+    data = make_animation_data(args.frames)
+
+    renderer = fastrenderer.FastRenderer(data)
+
+    def draw_frames(static_layer):
+        for frame_index in xrange(args.frames):
+            if not static_layer:
+                renderer.static_image = renderer.draw_static()
+            renderer.draw(frame_index)
+            renderer.get_image()
+
+    static_time = time_function(renderer.draw_static, args.repeat)[0]
+    y_axis_time = time_function(lambda: renderer.draw_y_axis(renderer.static_image.copy()), args.repeat)[0]
+    cached_time = time_function(lambda: draw_frames(True), args.repeat)[0] / args.frames
+    uncached_time = time_function(lambda: draw_frames(False), args.repeat)[0] / args.frames
+    print_time('fast renderer static layer', static_time)
+    print_time('fast renderer y axis (dynamic y range)', y_axis_time)
+    print_time('fast renderer frame (static layer drawn per frame)', uncached_time)
+    print_time('fast renderer frame (cached static layer)', cached_time)
+    print_time('fast renderer saving per frame', uncached_time - cached_time)
+
+    try:
+        import rootrenderer
+    except ImportError:
+        rootrenderer = None
+    if rootrenderer is not None:
+        renderer = rootrenderer.RootRenderer(data, batch=True)
+        draw_frames(True)
+        print_time('ROOT renderer frame', time_function(lambda: draw_frames(True), args.repeat)[0] / args.frames)
+    else:
+        print_time('ROOT renderer frame', None)
+
+
+def main():
+    # create parser, add arguments
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-r", "--repeat", required=False, type=int, default=3,
+                        help="number of repetitions (minimum time is shown, default=3)")
+    subparsers = parser.add_subparsers(title="benchmarks")
+
+    parser_startup = subparsers.add_parser("startup", help=benchmark_startup.__doc__.strip())
+    parser_startup.add_argument("-i", "--input_filename", required=False, type=str, help="ROOT input filename")
+    parser_startup.add_argument("-m", "--m_a", required=False, type=float, default=500.0,
+                                help="m_A value of the first frame (default=500)")
+    parser_startup.add_argument("-t", "--tan_beta", required=False, type=float, default=10.0,
+                                help="tangent beta value (default=10)")
+    parser_startup.set_defaults(benchmark=benchmark_startup)
+
+    parser_neuquant = subparsers.add_parser("neuquant", help=benchmark_neuquant.__doc__.strip())
+    parser_neuquant.add_argument("-s", "--samplefac", required=False, type=int, default=10,
+                                 help="NeuQuant sample factor (default=10)")
+    parser_neuquant.add_argument("-b", "--batchsize", required=False, type=int, default=64,
+                                 help="NeuQuant batch size (default=64)")
+    parser_neuquant.set_defaults(benchmark=benchmark_neuquant)
+
+    parser_grid = subparsers.add_parser("grid", help=benchmark_grid.__doc__.strip())
+    parser_grid.add_argument("--ma_min", required=False, type=float, default=90.0,
+                             help="minimum m_A value (default=90)")
+    parser_grid.add_argument("--ma_max", required=False, type=float, default=2000.0,
+                             help="maximum m_A value (default=2000)")
+    parser_grid.add_argument("-f", "--frames", required=False, type=int, default=1000,
+                             help="number of frames (default=1000)")
+    parser_grid.add_argument("-n", "--bins", required=False, type=int, default=1000,
+                             help="number of histogram bins (default=1000)")
+    parser_grid.set_defaults(benchmark=benchmark_grid)
+
+    parser_render = subparsers.add_parser("render", help=benchmark_render.__doc__.strip())
+    parser_render.add_argument("-f", "--frames", required=False, type=int, default=20,
+                               help="number of frames (default=20)")
+    parser_render.set_defaults(benchmark=benchmark_render)
+
+    args = parser.parse_args()
+    args.benchmark(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+# coding=utf-8
+"""
+Persistent content-addressed cache: values are stored in files named by the SHA-1 digest of their key (any JSON
+serializable value), least recently used files are removed if the cache exceeds its maximum size.
+"""
+
+import hashlib
+import io
+import json
+import os
+import Queue
+import tempfile
+import threading
+import zlib
+import numpy as np
+
+# default maximum cache size in bytes
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+# block size for reading files in file_digest
+DIGEST_BLOCK_SIZE = 1024 * 1024
+
+# zlib compression level of the cached arrays (level 1 is about three times faster than the default level 6, the
+# files of rendered frames are only 50 % larger)
+ARRAY_COMPRESS_LEVEL = 1
+
+# size of the cache after an eviction (fraction of the maximum size), so the following writes do not evict again
+EVICT_FRACTION = 0.9
+
+# number of arrays waiting in the queue of a CacheWriter
+WRITER_QUEUE_SIZE = 16
+
+
+def key_digest(key):
+    """
+    digest of a cache key
+
+    :rtype : str
+    :param key: JSON serializable key (e.g. dictionary of parameters)
+    :return: SHA-1 hex digest of the key
+    """
+    return hashlib.sha1(json.dumps(key, sort_keys=True)).hexdigest()
+
+
+class DiskCache(object):
+    """
+    cache of byte strings and NumPy arrays in a directory (one file per value, in subdirectories of the first two
+    digest characters); can be used by several processes
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        """
+        creates the cache directory (if not present)
+
+        :param directory: cache directory
+        :param max_size: maximum size of all cached files in bytes (see evict)
+        """
+        self.directory = directory
+        self.max_size = max_size
+        # size of all cached files: determined at the first write (or with update_size), then increased by the
+        # writes of this object (the writes of other processes are only seen by the next update_size or evict)
+        self.estimated_size = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        """
+        filename of a cached value
+
+        :rtype : str
+        :param key: cache key
+        :return: filename
+        """
+        digest = key_digest(key)
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def contains(self, key):
+        """
+        checks, if a value is cached
+
+        :rtype : bool
+        :param key: cache key
+        :return: True, if the value is cached
+        """
+        return os.path.isfile(self.path(key))
+
+    def get(self, key):
+        """
+        reads a cached value and marks it as used
+
+        :rtype : str
+        :param key: cache key
+        :return: value or None, if not cached
+        """
+        filename = self.path(key)
+        try:
+            with open(filename, 'rb') as cache_file:
+                value = cache_file.read()
+        except IOError:
+            return None
+        try:
+            # modification time as time of the last use (see evict)
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        """
+        stores a value (written to a temporary file and renamed, so readers never see incomplete files)
+
+        :param key: cache key
+        :param value: value (byte string)
+        """
+        filename = self.path(key)
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another process
+                pass
+        file_descriptor, temp_filename = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as temp_file:
+                temp_file.write(value)
+            os.rename(temp_filename, filename)
+        except:
+            os.remove(temp_filename)
+            raise
+
+        if self.estimated_size is None:
+            self.update_size()
+        else:
+            self.estimated_size += len(value)
+        if self.estimated_size > self.max_size:
+            self.evict()
+
+    def get_array(self, key):
+        """
+        reads a cached NumPy array
+
+        :rtype : numpy.ndarray
+        :param key: cache key
+        :return: array or None, if not cached
+        """
+        value = self.get(key)
+        if value is None:
+            return None
+        return np.load(io.BytesIO(zlib.decompress(value)))
+
+    def put_array(self, key, array):
+        """
+        stores a NumPy array (.npy format, zlib compressed)
+
+        :param key: cache key
+        :param array: array
+        """
+        array_file = io.BytesIO()
+        np.save(array_file, array)
+        self.put(key, zlib.compress(array_file.getvalue(), ARRAY_COMPRESS_LEVEL))
+
+    def list_files(self):
+        """
+        cached files with their size and time of the last use
+
+        :rtype : list
+        :return: list of (time of the last use, size, filename)
+        """
+        files = []
+        for directory, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.startswith('.tmp'):
+                    continue
+                filename = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, filename))
+        return files
+
+    def size(self):
+        """
+        size of all cached files
+
+        :rtype : int
+        :return: size in bytes
+        """
+        return sum(size for _, size, _ in self.list_files())
+
+    def update_size(self):
+        """
+        determines the size of all cached files (estimated_size, see put)
+
+        :rtype : int
+        :return: size in bytes
+        """
+        self.estimated_size = self.size()
+        return self.estimated_size
+
+    def evict(self):
+        """
+        removes the least recently used files, if the cache is larger than its maximum size (down to EVICT_FRACTION
+        of the maximum size); called by put, if the estimated size exceeds the maximum size
+
+        :rtype : int
+        :return: number of removed files
+        """
+        files = sorted(self.list_files())
+        total_size = sum(size for _, size, _ in files)
+        num_removed = 0
+        if total_size > self.max_size:
+            target_size = self.max_size * EVICT_FRACTION
+        else:
+            target_size = self.max_size
+        for _, size, filename in files:
+            if total_size <= target_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            total_size -= size
+            num_removed += 1
+        self.estimated_size = total_size
+        return num_removed
+
+    def file_digest(self, filename):
+        """
+        SHA-1 digest of the content of a file (cached for the file path, size and modification time)
+
+        :rtype : str
+        :param filename: filename
+        :return: hex digest
+        """
+        stat = os.stat(filename)
+        key = ['file_digest', os.path.abspath(filename), stat.st_size, stat.st_mtime]
+        digest = self.get(key)
+        if digest is None:
+            digest = file_digest(filename)
+            self.put(key, digest)
+        return digest
+
+
+class CacheWriter(object):
+    """
+    stores arrays in a DiskCache in a background thread, so the caller does not wait for the compression and the
+    file I/O (both release the GIL)
+    """
+
+    def __init__(self, cache, queue_size=WRITER_QUEUE_SIZE):
+        """
+        starts the writer thread
+
+        :param cache: DiskCache
+        :param queue_size: maximum number of arrays waiting to be written (put_array blocks, if the queue is full)
+        """
+        self.cache = cache
+        self.queue = Queue.Queue(queue_size)
+        # number of arrays, which could not be written
+        self.num_errors = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put_array(self, key, array):
+        """
+        queues an array to be stored (see DiskCache.put_array)
+
+        :param key: cache key
+        :param array: array (not modified afterwards)
+        """
+        self.queue.put((key, array))
+
+    def run(self):
+        """
+        writes the queued arrays until close is called (writer thread)
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self.cache.put_array(*item)
+            except (IOError, OSError):
+                # a missing cache entry only costs a later render
+                self.num_errors += 1
+
+    def close(self):
+        """
+        waits until all queued arrays are written and stops the writer thread
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+
+def file_digest(filename):
+    """
+    SHA-1 digest of the content of a file
+
+    :rtype : str
+    :param filename: filename
+    :return: hex digest
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(DIGEST_BLOCK_SIZE), ''):
+            sha1.update(block)
+    return sha1.hexdigest()
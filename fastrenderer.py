@@ -0,0 +1,472 @@
+# coding=utf-8
+"""
+Rendering of the animation frames with NumPy and PIL (without ROOT), similar to the TCanvas output of rootrenderer.
+
+The static parts of the canvas (frame, axes, titles, legend box and entries, logo) are drawn once. For every frame
+they are copied, the histograms are drawn into the RGB array and the legend (with the frame dependent header) is
+copied on top. With a frame dependent y range only the y axis region is redrawn.
+"""
+
+import math
+import numpy as np
+import PIL.Image
+import PIL.ImageDraw
+import PIL.ImageFont
+
+# canvas size (as the ROOT canvas)
+CANVAS_WIDTH = 1300
+CANVAS_HEIGHT = 750
+
+# pad margins (fraction of the canvas size, ROOT defaults)
+MARGIN_LEFT = 0.1
+MARGIN_RIGHT = 0.1
+MARGIN_TOP = 0.1
+MARGIN_BOTTOM = 0.1
+
+# legend box and logo pad (NDC: x1, y1, x2, y2 with y from the bottom, as in rootrenderer)
+LEGEND_BOX = (0.70, 0.70, 0.99, 0.99)
+LOGO_BOX = (0.17, 0.9, 0.3, 1.0)
+
+# RGB values of the ROOT colour indices
+ROOT_COLORS = {0: (255, 255, 255), 1: (0, 0, 0), 2: (255, 0, 0), 3: (0, 255, 0), 4: (0, 0, 255), 5: (255, 255, 0),
+               6: (255, 0, 255), 7: (0, 255, 255), 8: (89, 212, 84), 9: (89, 84, 216)}
+
+# text and tick sizes (fraction of the canvas height)
+TEXT_SIZE = 0.03
+TICK_LENGTH = 0.02
+
+# width of the y axis region right of the plot frame (in text sizes, room for ticks and the common factor)
+Y_AXIS_FACTOR_WIDTH = 5
+
+# TrueType fonts tried in this order (PIL default font else)
+FONT_NAMES = ['DejaVuSans.ttf', 'FreeSans.ttf', 'LiberationSans-Regular.ttf', 'Arial.ttf']
+
+SUPERSCRIPT_DIGITS = {'-': u'⁻', '0': u'⁰', '1': u'¹', '2': u'²', '3': u'³', '4': u'⁴',
+                      '5': u'⁵', '6': u'⁶', '7': u'⁷', '8': u'⁸', '9': u'⁹'}
+
+
+def load_font(size):
+    """
+    loads the first available TrueType font of FONT_NAMES (or the PIL default font)
+
+    :rtype : PIL.ImageFont.ImageFont
+    :param size: font size in pixels
+    :return: font
+    """
+    for font_name in FONT_NAMES:
+        try:
+            return PIL.ImageFont.truetype(font_name, size)
+        except IOError:
+            pass
+    return PIL.ImageFont.load_default()
+
+
+def is_truetype(font):
+    """
+    checks, if a font is a TrueType font (with unicode characters)
+
+    :rtype : bool
+    :param font: font
+    :return: True for TrueType fonts
+    """
+    return isinstance(font, PIL.ImageFont.FreeTypeFont)
+
+
+def root_text(text, font):
+    """
+    converts ROOT TLatex text (greek letters, sub- and superscripts) to plain text
+
+    :rtype : unicode
+    :param text: TLatex text
+    :param font: font used to draw the text
+    :return: text
+    """
+    text = unicode(text)
+    if is_truetype(font):
+        text = text.replace('#beta', u'β')
+    else:
+        text = text.replace('#beta', 'beta')
+    for latex in ['_{', '^{', '}']:
+        text = text.replace(latex, '')
+    return text
+
+
+def power_text(exponent, font):
+    """
+    text of a power of ten
+
+    :rtype : unicode
+    :param exponent: exponent
+    :param font: font used to draw the text
+    :return: text (e.g. '10^-3' with superscript digits)
+    """
+    if not is_truetype(font):
+        return u'1e{0:d}'.format(exponent)
+    return u'10' + u''.join(SUPERSCRIPT_DIGITS[digit] for digit in str(exponent))
+
+
+def linear_ticks(value_min, value_max, max_ticks=10):
+    """
+    tick values of a linear axis with steps of 1, 2 or 5 times a power of ten
+
+    :rtype : numpy.ndarray
+    :param value_min: lower axis limit
+    :param value_max: upper axis limit
+    :param max_ticks: maximum number of ticks
+    :return: tick values
+    """
+    if value_max <= value_min:
+        return np.array([value_min])
+    raw_step = float(value_max - value_min) / max_ticks
+    power = 10.0 ** math.floor(math.log10(raw_step))
+    step = power * 10
+    for factor in [1, 2, 5]:
+        if factor * power >= raw_step:
+            step = factor * power
+            break
+    first = math.ceil(value_min / step)
+    last = math.floor(value_max / step)
+    return np.arange(first, last + 1) * step
+
+
+def log_ticks(value_min, value_max, max_ticks=10):
+    """
+    tick values (powers of ten) of a logarithmic axis
+
+    :rtype : numpy.ndarray
+    :param value_min: lower axis limit
+    :param value_max: upper axis limit
+    :param max_ticks: maximum number of ticks
+    :return: tick exponents
+    """
+    first = int(math.ceil(math.log10(value_min) - 1e-9))
+    last = int(math.floor(math.log10(value_max) + 1e-9))
+    step = max(1, int(math.ceil(float(last - first + 1) / max_ticks)))
+    return np.arange(first, last + 1, step)
+
+
+class FastRenderer(object):
+    """
+    draws single frames of the animation (histograms, legend and logo) into an RGB array with NumPy and PIL;
+    same interface as rootrenderer.RootRenderer
+    """
+
+    def __init__(self, data, batch=False):
+        """
+        draws the static parts of the canvas
+
+        :param data: animatehiggspeak.AnimationData of the animation
+        :param batch: unused (no graphics window)
+        """
+        self.data = data
+        self.image = None
+        # static parts without the y axis (see draw_static)
+        self.base_image = None
+        # tan beta with one decimal place for tan beta scans
+        self.tan_beta_format = "{1:2.0f}" if min(data.values_tan_beta) == max(data.values_tan_beta) else "{1:4.1f}"
+
+        width = CANVAS_WIDTH
+        height = CANVAS_HEIGHT
+        self.font = load_font(int(round(TEXT_SIZE * height)))
+        self.small_font = load_font(int(round(0.7 * TEXT_SIZE * height)))
+
+        # plot area (pixels)
+        self.plot_x1 = int(round(MARGIN_LEFT * width))
+        self.plot_x2 = int(round((1 - MARGIN_RIGHT) * width))
+        self.plot_y1 = int(round(MARGIN_TOP * height))
+        self.plot_y2 = int(round((1 - MARGIN_BOTTOM) * height))
+        plot_width = self.plot_x2 - self.plot_x1
+        plot_height = self.plot_y2 - self.plot_y1
+
+        # visible x range (see SetRange in rootrenderer) and y range
+        num_bins_visible = data.spectra.shape[1]
+        bin_width = (data.x_max - data.x_min) / float(data.num_bins)
+        self.x_range = (data.x_min, data.x_min + num_bins_visible * bin_width)
+        if data.log_scale is not False:
+            self.y_range = (1e-18 if data.log_scale is None else data.log_scale, data.y_height)
+        else:
+            self.y_range = (0.0, data.y_height)
+
+        # histogram bin of every pixel column, row numbers and fill pattern (ROOT fill style 3003) of the plot area
+        self.column_bins = ((np.arange(plot_width) + 0.5) * num_bins_visible / plot_width).astype(np.intp)
+        self.rows = np.arange(plot_height)[:, np.newaxis]
+        columns = np.arange(plot_width)[np.newaxis, :]
+        self.hatch = (((self.rows % 4) == 0) & ((columns % 4) == 0)) | (((self.rows % 4) == 2) & ((columns % 4) == 2))
+
+        # legend box (pixels)
+        self.legend_x1, self.legend_y1 = self.ndc_to_pixel(LEGEND_BOX[0], LEGEND_BOX[3])
+        self.legend_x2, self.legend_y2 = self.ndc_to_pixel(LEGEND_BOX[2], LEGEND_BOX[1])
+        self.legend_row_height = float(self.legend_y2 - self.legend_y1) / (len(data.list_higgs_boson) + 2)
+        self.header_font = self.fit_font(self.header_text(0, self.font), 0.95 * (self.legend_x2 - self.legend_x1))
+
+        # region of the y axis (see draw_y_axis): left margin down to the lowest label and the top left margin with
+        # the common factor of the labels
+        self.y_axis_region = (slice(0, min(height, self.plot_y2 + self.font.size)),
+                              slice(0, min(width, self.plot_x1 + Y_AXIS_FACTOR_WIDTH * self.font.size)))
+
+        self.static_image = self.draw_static()
+
+    def ndc_to_pixel(self, x, y):
+        """
+        converts NDC coordinates (y from the bottom) to pixel coordinates
+
+        :rtype : tuple
+        :param x: x coordinate (0..1)
+        :param y: y coordinate (0..1)
+        :return: pixel column and row
+        """
+        return int(round(x * CANVAS_WIDTH)), int(round((1 - y) * CANVAS_HEIGHT))
+
+    def header_text(self, frame_index, font):
+        """
+        legend header of a frame (text as in rootrenderer)
+
+        :rtype : unicode
+        :param frame_index: index of the frame
+        :param font: font used to draw the text
+        :return: text
+        """
+        data = self.data
+        return root_text("prod. mode = " + data.prod_mode + "   m_{A}" +
+                         (" = {0:04d}   tan(#beta) = " + self.tan_beta_format).format(
+                             int(data.values_ma[frame_index]), data.values_tan_beta[frame_index]), font)
+
+    def fit_font(self, text, width):
+        """
+        largest font (up to the text size) for a text fitting into a width
+
+        :rtype : PIL.ImageFont.ImageFont
+        :param text: text
+        :param width: available width in pixels
+        :return: font
+        """
+        font = self.font
+        draw = PIL.ImageDraw.Draw(PIL.Image.new('RGB', (1, 1)))
+        while is_truetype(font) and font.size > 6 and draw.textsize(text, font=font)[0] > width:
+            font = load_font(font.size - 1)
+        return font
+
+    def value_to_row(self, values):
+        """
+        converts y values to rows of the plot area (values below the y range give the number of rows)
+
+        :rtype : numpy.ndarray
+        :param values: y values
+        :return: rows (integer)
+        """
+        y_min, y_max = self.y_range
+        plot_height = self.plot_y2 - self.plot_y1
+        if self.data.log_scale is not False:
+            values = np.log10(np.maximum(values, 1e-300))
+            y_min, y_max = math.log10(y_min), math.log10(y_max)
+        fraction = np.clip((values - y_min) / (y_max - y_min), 0, 1)
+        return np.round(plot_height * (1 - fraction)).astype(np.intp)
+
+    def draw_text(self, draw, position, text, font, align='left', color=(0, 0, 0)):
+        """
+        draws a text line
+
+        :param draw: PIL.ImageDraw.Draw
+        :param position: pixel position (column, row) of the anchor point
+        :param text: text
+        :param font: font
+        :param align: horizontal alignment to the anchor point ('left', 'center' or 'right'), vertically centred
+        :param color: text colour
+        """
+        text_width, text_height = draw.textsize(text, font=font)
+        x, y = position
+        if align == 'center':
+            x -= text_width / 2
+        elif align == 'right':
+            x -= text_width
+        draw.text((x, y - text_height / 2), text, font=font, fill=color)
+
+    def draw_static(self):
+        """
+        draws the static parts of the canvas: the base layer (see draw_base) and the y axis (see draw_y_axis)
+
+        :rtype : numpy.ndarray
+        :return: image (height x width x 3, uint8)
+        """
+        self.base_image = self.draw_base()
+        image = self.base_image.copy()
+        self.draw_y_axis(image)
+        return image
+
+    def draw_base(self):
+        """
+        draws the static parts of the canvas, which do not depend on the y range: frame, x axis ticks and labels,
+        title, legend box and entries, logo
+
+        :rtype : numpy.ndarray
+        :return: image (height x width x 3, uint8)
+        """
+        data = self.data
+        image = PIL.Image.new('RGB', (CANVAS_WIDTH, CANVAS_HEIGHT), (255, 255, 255))
+        draw = PIL.ImageDraw.Draw(image)
+        font = self.font
+        tick_length = int(round(TICK_LENGTH * CANVAS_HEIGHT))
+        x1, x2, y1, y2 = self.plot_x1, self.plot_x2, self.plot_y1, self.plot_y2
+
+        # title (centred above the plot) and frame
+        self.draw_text(draw, ((x1 + x2) / 2, y1 / 2), u'MSSM-Higgs-Viewer', font, 'center')
+        draw.rectangle([x1, y1, x2 - 1, y2 - 1], outline=(0, 0, 0))
+
+        # x axis
+        x_min, x_max = self.x_range
+        for tick in linear_ticks(x_min, x_max):
+            column = x1 + int(round((tick - x_min) / (x_max - x_min) * (x2 - x1 - 1)))
+            draw.line([(column, y2 - 1), (column, y2 - 1 - tick_length)], fill=(0, 0, 0))
+            self.draw_text(draw, (column, y2 + font.size), u'{0:g}'.format(tick), font, 'center')
+        self.draw_text(draw, (x2, y2 + 2.5 * font.size), root_text('m [GeV]', font), font, 'right')
+
+        # legend box and entries (the header is drawn per frame)
+        draw.rectangle([self.legend_x1, self.legend_y1, self.legend_x2 - 1, self.legend_y2 - 1], fill=(255, 255, 255),
+                       outline=(0, 0, 0))
+        labels = ['sum of all Higgs bosons'] + [boson + ' - Higgs boson' for boson in data.list_higgs_boson]
+        legend_width = self.legend_x2 - self.legend_x1
+        for hist_index, label in enumerate(labels):
+            row = self.legend_y1 + (hist_index + 1.5) * self.legend_row_height
+            color = ROOT_COLORS.get(hist_index + 1, (0, 0, 0))
+            # sample box with fill pattern and line
+            box_x1 = self.legend_x1 + int(0.05 * legend_width)
+            box_x2 = self.legend_x1 + int(0.2 * legend_width)
+            box_y1 = int(row - 0.3 * self.legend_row_height)
+            box_y2 = int(row + 0.3 * self.legend_row_height)
+            for box_row in xrange(box_y1, box_y2):
+                for box_column in xrange(box_x1, box_x2):
+                    if (box_row % 4 == 0 and box_column % 4 == 0) or (box_row % 4 == 2 and box_column % 4 == 2):
+                        image.putpixel((box_column, box_row), color)
+            draw.rectangle([box_x1, box_y1, box_x2, box_y2], outline=color)
+            draw.rectangle([box_x1 + 1, box_y1 + 1, box_x2 - 1, box_y2 - 1], outline=color)
+            self.draw_text(draw, (self.legend_x1 + int(0.25 * legend_width), int(row)), label, font)
+
+        # logo (scaled into the logo pad, aspect ratio kept)
+        try:
+            logo = PIL.Image.open('logo.png').convert('RGBA')
+        except IOError:
+            logo = None
+        if logo is not None:
+            pad_x1, pad_y1 = self.ndc_to_pixel(LOGO_BOX[0], LOGO_BOX[3])
+            pad_x2, pad_y2 = self.ndc_to_pixel(LOGO_BOX[2], LOGO_BOX[1])
+            scale = min(float(pad_x2 - pad_x1) / logo.size[0], float(pad_y2 - pad_y1) / logo.size[1])
+            logo = logo.resize((max(1, int(logo.size[0] * scale)), max(1, int(logo.size[1] * scale))),
+                               PIL.Image.BILINEAR)
+            image.paste(logo, (pad_x1, pad_y1), logo)
+
+        return np.array(image)
+
+    def draw_y_axis(self, image):
+        """
+        draws the y axis (ticks, labels, common factor and title) of the current y range into the y axis region
+        (left and top left margin) of an image, the region is restored from the base layer first; for the dynamic y
+        range only this region is redrawn, if the maximum changes
+
+        :param image: static image (height x width x 3, uint8), modified in place
+        """
+        data = self.data
+        region = self.y_axis_region
+        # the region starts at the top left corner, so canvas coordinates are region coordinates
+        layer = PIL.Image.fromarray(np.ascontiguousarray(self.base_image[region]))
+        draw = PIL.ImageDraw.Draw(layer)
+        font = self.font
+        tick_length = int(round(TICK_LENGTH * CANVAS_HEIGHT))
+        x1, y1, y2 = self.plot_x1, self.plot_y1, self.plot_y2
+
+        # y axis
+        y_min, y_max = self.y_range
+        if data.log_scale is not False:
+            ticks = [(10.0 ** exponent, power_text(exponent, font)) for exponent in log_ticks(y_min, y_max)]
+        else:
+            values = linear_ticks(y_min, y_max)
+            exponent = int(math.floor(math.log10(np.abs(values).max()))) if np.abs(values).max() > 0 else 0
+            if abs(exponent) < 3:
+                exponent = 0
+            ticks = [(value, u'{0:g}'.format(round(value / 10.0 ** exponent, 6))) for value in values]
+            if exponent != 0:
+                # common factor above the axis
+                self.draw_text(draw, (x1, y1 - font.size / 2), u'×' + power_text(exponent, font), font)
+        label_width = 0
+        for value, label in ticks:
+            row = y1 + int(self.value_to_row(np.array([value]))[0])
+            row = min(row, y2 - 1)
+            draw.line([(x1, row), (x1 + tick_length, row)], fill=(0, 0, 0))
+            self.draw_text(draw, (x1 - font.size / 3, row), label, font, 'right')
+            label_width = max(label_width, draw.textsize(label, font=font)[0])
+
+        # rotated y axis title (top aligned)
+        title = root_text('Events / GeV', font)
+        title_width, title_height = draw.textsize(title, font=font)
+        title_image = PIL.Image.new('L', (title_width, title_height), 0)
+        PIL.ImageDraw.Draw(title_image).text((0, 0), title, font=font, fill=255)
+        title_image = title_image.rotate(90, expand=True)
+        layer.paste((0, 0, 0), (max(0, x1 - label_width - font.size / 2 - title_height), y1), title_image)
+
+        image[region] = np.asarray(layer)
+
+    def draw(self, frame_index):
+        """
+        draws a frame of the animation
+
+        :param frame_index: index of the frame
+        """
+        data = self.data
+        # y axis maximum of the frame (dynamic y range), only the y axis is redrawn on the base layer if it changes
+        if data.y_heights is not None and data.y_heights[frame_index] != self.y_range[1]:
+            self.y_range = (self.y_range[0], data.y_heights[frame_index])
+            self.draw_y_axis(self.static_image)
+        image = self.static_image.copy()
+        plot = image[self.plot_y1:self.plot_y2, self.plot_x1:self.plot_x2]
+        plot_height = self.plot_y2 - self.plot_y1
+
+        # sum first, bosons on top (as ROOT "HIST SAME"); only the rows below the highest line are changed
+        for hist_index, values in enumerate(data.spectra[frame_index].T):
+            color = ROOT_COLORS.get(hist_index + 1, (0, 0, 0))
+            tops = self.value_to_row(values[self.column_bins])[np.newaxis, :]
+            # line (width 2): top of the bins and steps between bins
+            previous_tops = np.concatenate(([[plot_height]], tops[:, :-1]), axis=1)
+            line_top = np.minimum(tops, previous_tops) - 1
+            line_bottom = np.maximum(tops, previous_tops)
+            first_row = max(0, int(line_top.min()))
+            rows = self.rows[first_row:]
+            dirty = plot[first_row:]
+            # fill pattern below the histogram, line on top
+            dirty[(rows >= tops) & self.hatch[first_row:]] = color
+            dirty[(rows >= line_top) & (rows <= line_bottom)] = color
+
+        # restore frame lines and legend
+        static = self.static_image
+        for rows, columns in [(slice(self.plot_y1, self.plot_y1 + 1), slice(self.plot_x1, self.plot_x2)),
+                              (slice(self.plot_y2 - 1, self.plot_y2), slice(self.plot_x1, self.plot_x2)),
+                              (slice(self.plot_y1, self.plot_y2), slice(self.plot_x1, self.plot_x1 + 1)),
+                              (slice(self.plot_y1, self.plot_y2), slice(self.plot_x2 - 1, self.plot_x2))]:
+            image[rows, columns] = static[rows, columns]
+        legend = (slice(self.legend_y1, self.legend_y2), slice(self.legend_x1, self.legend_x2))
+        image[legend] = static[legend]
+
+        # legend header
+        header_y2 = self.legend_y1 + int(self.legend_row_height)
+        header = PIL.Image.fromarray(image[self.legend_y1 + 1:header_y2, self.legend_x1 + 1:self.legend_x2 - 1])
+        header_draw = PIL.ImageDraw.Draw(header)
+        self.draw_text(header_draw, (header.size[0] / 2, header.size[1] / 2),
+                       self.header_text(frame_index, self.header_font), self.header_font, 'center')
+        image[self.legend_y1 + 1:header_y2, self.legend_x1 + 1:self.legend_x2 - 1] = np.asarray(header)
+
+        self.image = image
+
+    def get_image(self):
+        """
+        returns the last drawn frame
+
+        :rtype : numpy.ndarray
+        :return: image (height x width x 3, uint8)
+        """
+        return self.image
+
+    def print_frame(self, filename):
+        """
+        saves the last drawn frame as image file (format from the file extension)
+
+        :param filename: output filename
+        """
+        PIL.Image.fromarray(self.image).save(filename)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+Cache of the benchmark TH2 histograms (m_*, width_*, xs_<mode>_* and br_*) as raw NumPy .npy files.
+
+The ROOT input file is converted once (run this file with -i <ROOT file>), afterwards the grids are read
+memory-mapped with np.load(mmap_mode='r') as long as the cache is newer than the ROOT file, so ROOT is
+neither imported nor used for reading the benchmark data.
+"""
+
+import argparse
+import os
+import numpy as np
+import th2grid
+
+# prefixes of the histograms stored in the cache
+GRID_PREFIXES = ('m_', 'width_', 'xs_', 'br_')
+
+# file written after all grids, marks a complete cache
+STAMP_FILENAME = 'source.txt'
+
+
+def default_cache_dir(input_filename):
+    """
+    default cache directory of a ROOT input file ('<input_filename>.npcache/')
+
+    :rtype : str
+    :param input_filename: ROOT input filename
+    :return: cache directory
+    """
+    return input_filename + '.npcache'
+
+
+def is_cache_valid(input_filename, cache_dir=None, verbose=0):
+    """
+    checks, if a complete cache exists and is newer than the ROOT input file (a cache without ROOT input file, e.g.
+    shipped on its own, is used as it is)
+
+    :rtype : bool
+    :param input_filename: ROOT input filename
+    :param cache_dir: cache directory (default: default_cache_dir(input_filename))
+    :param verbose: verbosity
+    :return: True, if the cache can be used
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir(input_filename)
+    stamp_filename = os.path.join(cache_dir, STAMP_FILENAME)
+    if not os.path.isfile(stamp_filename):
+        return False
+    if not os.path.exists(input_filename):
+        if verbose > 0:
+            print "ROOT file", input_filename, "not found, using grid cache", cache_dir
+        return True
+    return os.path.getmtime(stamp_filename) >= os.path.getmtime(input_filename)
+
+
+def convert_root_file(input_filename, cache_dir=None, verbose=0):
+    """
+    extracts all benchmark TH2 histograms of a ROOT file into the cache directory
+    (<name>.npy: bin contents, <name>.x_edges.npy and <name>.y_edges.npy: bin edges)
+
+    :rtype : list
+    :param input_filename: ROOT input filename
+    :param cache_dir: cache directory (default: default_cache_dir(input_filename))
+    :param verbose: verbosity
+    :return: list of converted histogram names
+    """
+    import ROOT
+
+    if cache_dir is None:
+        cache_dir = default_cache_dir(input_filename)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    # invalidate an existing cache until the conversion is complete
+    stamp_filename = os.path.join(cache_dir, STAMP_FILENAME)
+    if os.path.exists(stamp_filename):
+        os.remove(stamp_filename)
+
+    f = ROOT.TFile(input_filename)
+    if f.IsZombie():
+        raise IOError("Could not open ROOT file '" + input_filename + "'")
+
+    hist_names = []
+    for key in f.GetListOfKeys():
+        name = key.GetName()
+        if not name.startswith(GRID_PREFIXES) or not key.GetClassName().startswith('TH2'):
+            continue
+        grid = th2grid.read_th2_grid(key.ReadObj())
+        np.save(os.path.join(cache_dir, name + '.npy'), grid.contents)
+        np.save(os.path.join(cache_dir, name + '.x_edges.npy'), grid.x_edges)
+        np.save(os.path.join(cache_dir, name + '.y_edges.npy'), grid.y_edges)
+        hist_names.append(name)
+        if verbose > 1:
+            print "converted", name, grid.contents.shape
+    f.Close()
+
+    with open(stamp_filename, 'w') as stamp_file:
+        stamp_file.write(os.path.abspath(input_filename) + '\n')
+
+    return hist_names
+
+
+def read_cached_grid(cache_dir, hist_name):
+    """
+    reads a (memory-mapped) grid from the cache directory
+
+    :rtype : th2grid.TH2Grid
+    :param cache_dir: cache directory
+    :param hist_name: histogram name
+    :return: grid
+    """
+    filename = os.path.join(cache_dir, hist_name + '.npy')
+    if not os.path.isfile(filename):
+        raise IOError("Histogram '" + hist_name + "' not found in cache '" + cache_dir + "'")
+    return th2grid.TH2Grid(np.load(os.path.join(cache_dir, hist_name + '.x_edges.npy')),
+                           np.load(os.path.join(cache_dir, hist_name + '.y_edges.npy')),
+                           np.load(filename, mmap_mode='r'))
+
+
+def load_grids(input_filename, hist_names, cache_dir=None, verbose=0):
+    """
+    reads the grids of the given histograms from the cache (if valid) or from the ROOT input file
+
+    :rtype : list
+    :param input_filename: ROOT input filename
+    :param hist_names: list of histogram names
+    :param cache_dir: cache directory (default: default_cache_dir(input_filename))
+    :param verbose: verbosity
+    :return: list of th2grid.TH2Grid
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir(input_filename)
+
+    if is_cache_valid(input_filename, cache_dir, verbose=verbose):
+        if verbose > 1:
+            print "reading grids from cache", cache_dir
+        return [read_cached_grid(cache_dir, hist_name) for hist_name in hist_names]
+
+    import ROOT
+
+    if verbose > 1:
+        print "reading grids from ROOT file", input_filename
+    f = ROOT.TFile(input_filename)
+    if f.IsZombie():
+        raise IOError("Could not open ROOT file '" + input_filename + "'")
+    grids = []
+    for hist_name in hist_names:
+        hist = f.Get(hist_name)
+        if not hist:
+            raise IOError("Histogram '" + hist_name + "' not found in '" + input_filename + "'")
+        grids.append(th2grid.read_th2_grid(hist))
+    f.Close()
+    return grids
+
+
+def main():
+    # create parser, add arguments
+    parser = argparse.ArgumentParser(description="convert the benchmark histograms of a ROOT file into a "
+                                                 "NumPy grid cache")
+    parser.add_argument("-i", "--input_filename", required=True, type=str, help="ROOT input filename")
+    parser.add_argument("-c", "--cache_dir",      required=False, type=str,
+                        help="cache directory (default: <input_filename>.npcache)")
+    parser.add_argument("-v", "--verbose", action="count", default=0, help="increase output verbosity")
+
+    args = parser.parse_args()
+
+    hist_names = convert_root_file(args.input_filename, args.cache_dir, verbose=args.verbose)
+    print len(hist_names), "histograms converted"
+
+
+if __name__ == '__main__':
+    main()
@@ -66,6 +66,7 @@ Usefull links
 # todo: This module should be part of imageio (or at least based on)
 
 import os, time
+import collections, hashlib, multiprocessing
 
 def encode(x):
   if False:
@@ -84,6 +85,9 @@ try:
 except ImportError:
     np = None
 
+# Number of images used by writeGif to create a shared palette
+PALETTE_SAMPLE_SIZE = 10
+
 def get_cKDTree():
     try:
         from scipy.spatial import cKDTree
@@ -148,6 +152,124 @@ def intToBin(i):
     return chr(i1) + chr(i2)
 
 
+def lzwEncode(indices, minCodeSize=8):
+    """ lzwEncode(indices, minCodeSize=8)
+
+    LZW-compress color indices (numpy array or bytes, all indices below
+    2**minCodeSize) as GIF image data. Returns the code stream (bytes,
+    without the sub-block lengths). The dictionary search is done per
+    pixel, the variable-length codes are packed with numpy.
+
+    """
+
+    clearCode = 1 << minCodeSize
+    endCode = clearCode + 1
+    data = bytearray(np.ascontiguousarray(indices, np.uint8).tobytes())
+
+    codes = [clearCode]
+    # Code size changes: (index of the first code, code size)
+    sizeChanges = [(0, minCodeSize+1)]
+    if data:
+        table = {}
+        nextCode = clearCode + 2
+        codeSize = minCodeSize + 1
+        maxCode = 1 << codeSize
+        prefix = data[0]
+        for c in data[1:]:
+            key = (prefix << 8) | c
+            code = table.get(key)
+            if code is not None:
+                prefix = code
+                continue
+            codes.append(prefix)
+            prefix = c
+            if nextCode < 4096:
+                table[key] = nextCode
+                nextCode += 1
+                if nextCode > maxCode and codeSize < 12:
+                    codeSize += 1
+                    maxCode <<= 1
+                    sizeChanges.append((len(codes), codeSize))
+            else:
+                # Table full, start again
+                codes.append(clearCode)
+                table = {}
+                nextCode = clearCode + 2
+                codeSize = minCodeSize + 1
+                maxCode = 1 << codeSize
+                sizeChanges.append((len(codes), codeSize))
+        codes.append(prefix)
+    codes.append(endCode)
+
+    # Code size of every code
+    codes = np.array(codes, np.uint32)
+    sizes = np.empty(len(codes), np.uint32)
+    ends = [start for start, size in sizeChanges[1:]] + [len(codes)]
+    for (start, size), end in zip(sizeChanges, ends):
+        sizes[start:end] = size
+
+    # Pack the codes, least significant bit first
+    bitPositions = np.arange(12, dtype=np.uint32)
+    bits = ((codes[:,np.newaxis] >> bitPositions) & 1).astype(np.uint8)
+    bits = bits[bitPositions[np.newaxis,:] < sizes[:,np.newaxis]]
+    bits = np.concatenate((bits, np.zeros(-len(bits) % 8, np.uint8)))
+    return np.dot(bits.reshape(-1, 8), 1 << np.arange(8)).astype(np.uint8).tobytes()
+
+
+def getDataBlocks(stream):
+    """ getDataBlocks(stream)
+
+    Split a code stream into data sub-blocks (at most 255 bytes, each
+    preceded by its length) followed by the block terminator.
+
+    """
+
+    blocks = [chr(len(stream[i:i+255])) + stream[i:i+255]
+              for i in range(0, len(stream), 255)]
+    blocks.append('\x00')
+    return blocks
+
+
+def getImageData(im, encoder='pil', minCodeSize=None):
+    """ getImageData(im, encoder='pil', minCodeSize=None)
+
+    Compress a paletted PIL image. Returns the LZW minimum code size
+    (byte) and the list of data blocks. The encoder is 'pil' (the GIF
+    encoder of PIL) or 'lzw' (lzwEncode). The minimum code size of the
+    lzw encoder is the smallest one for the used indices by default
+    (smaller frames with few colors), but can be given.
+
+    """
+
+    if encoder == 'pil':
+        data = getdata(im)
+        imdes, data = data[0], data[1:]
+        # LZW minimum code size: part of the image descriptor in PIL,
+        # a separate data block in Pillow
+        if len(imdes) > 10:
+            lzwsize = imdes[10:]
+        else:
+            lzwsize, data = data[0], data[1:]
+        return lzwsize, data
+    elif encoder == 'lzw':
+        indices = np.asarray(im)
+        if minCodeSize is None:
+            minCodeSize = max(2, int(indices.max()).bit_length())
+        return chr(minCodeSize), getDataBlocks(lzwEncode(indices, minCodeSize))
+    else:
+        raise ValueError("Unknown encoder: " + str(encoder))
+
+
+def encodeImageData(args):
+    """ encodeImageData(args)
+
+    getImageData(*args) for worker processes (e.g. multiprocessing.Pool).
+
+    """
+
+    return getImageData(*args)
+
+
 class GifWriter:
     """ GifWriter()
 
@@ -168,13 +290,14 @@ class GifWriter:
         return bb
 
 
-    def getImageDescriptor(self, im, xy=None):
-        """ getImageDescriptor(im, xy=None)
+    def getImageDescriptor(self, im, xy=None, localPalette=True):
+        """ getImageDescriptor(im, xy=None, localPalette=True)
 
         Used for the local color table properties per image.
         Otherwise global color table applies to all frames irrespective of
         whether additional colors comes in play that require a redefined
         palette. Still a maximum of 256 color per frame, obviously.
+        If localPalette is False, the frame uses the global color table.
 
         Written by Ant1 on 2010-08-22
         Modified by Alex Robinson in Janurari 2011 to implement subrectangles.
@@ -196,7 +319,11 @@ class GifWriter:
 
         # packed field: local color table flag1, interlace0, sorted table0,
         # reserved00, lct size111=7=2^(7+1)=256.
-        bb += '\x87'
+        # Without local color table all bits are zero.
+        if localPalette:
+            bb += '\x87'
+        else:
+            bb += '\x00'
 
         # LZW minimum size code now comes later, begining of [image data] blocks
         return bb
@@ -254,6 +381,112 @@ class GifWriter:
         return bb
 
 
+    def toRGBArray(self, im):
+        """ toRGBArray(im)
+
+        Convert a PIL image or numpy array (see checkImages) to a numpy
+        RGB array (height x width x 3).
+
+        """
+
+        if isinstance(im, Image.Image):
+            im = im.convert('RGB')
+        a = self.toArray(im)
+        if a.ndim==2:
+            a = np.dstack((a, a, a))
+        return a[:,:,:3]
+
+
+    def packColors(self, a):
+        """ packColors(a)
+
+        Pack the colors of an RGB array (... x 3) into single integers
+        (0xRRGGBB), e.g. to count or compare colors.
+
+        """
+
+        a = a.astype(np.uint32)
+        return (a[...,0] << 16) | (a[...,1] << 8) | a[...,2]
+
+
+    def makeSharedPalette(self, images, maxColors=256):
+        """ makeSharedPalette(images, maxColors=256)
+
+        Create a palette to be shared by all frames of an animation from
+        a sample of the frames (PIL images or numpy arrays). If the sample
+        contains at most maxColors colors (e.g. plots), the palette
+        consists of exactly these colors. Otherwise the colors are chosen
+        with the adaptive PIL algorithm. Returns the palette as numpy
+        array (colors x 3).
+
+        """
+
+        # Collect the colors of all images
+        pixels = np.concatenate([self.toRGBArray(im).reshape(-1, 3)
+                                 for im in checkImages(images)])
+        colors = np.unique(self.packColors(pixels))
+
+        if len(colors) <= maxColors:
+            # Use the exact colors
+            palette = np.empty((len(colors), 3), np.uint8)
+            palette[:,0] = colors >> 16
+            palette[:,1] = colors >> 8
+            palette[:,2] = colors
+            return palette
+
+        # Too many colors, quantize all pixels of the sample at once
+        im = Image.fromarray(pixels.reshape(-1, 1, 3), 'RGB')
+        im = im.convert('P', palette=Image.ADAPTIVE, colors=maxColors)
+        return np.array(im.getpalette()[:3*maxColors], np.uint8).reshape(-1, 3)
+
+
+    def paletteToBytes(self, palette):
+        """ paletteToBytes(palette)
+
+        Convert a palette (colors x 3 array, at most 256 colors) to a
+        256 color table (bytes) as used in the gif file.
+
+        """
+
+        table = np.zeros((256, 3), np.uint8)
+        palette = np.asarray(palette, np.uint8).reshape(-1, 3)
+        table[:len(palette)] = palette
+        return table.tobytes()
+
+
+    def getLookupTable(self, palette):
+        """ getLookupTable(palette)
+
+        Get the ColorLookupTable of a palette (colors x 3 array). The
+        table of the last palette is kept, so it is built only once for
+        all frames that share the palette (the full 8 bit table is only
+        used for the shared palette, see quantizeToPalette).
+
+        """
+
+        key = self.paletteToBytes(palette)
+        lookupTable = getattr(self, '_lookupTable', None)
+        if lookupTable is None or lookupTable[0] != key:
+            lookupTable = key, ColorLookupTable(palette)
+            self._lookupTable = lookupTable
+        return lookupTable[1]
+
+
+    def quantizeToPalette(self, im, palette):
+        """ quantizeToPalette(im, palette)
+
+        Map an image (PIL image or numpy array) to the nearest colors of
+        the given palette (colors x 3 array, see makeSharedPalette) with
+        a cached lookup table. Returns a paletted PIL image.
+
+        """
+
+        index = self.getLookupTable(palette).lookup(self.toRGBArray(im))
+        im = Image.fromarray(index, 'P')
+        im.putpalette(self.paletteToBytes(palette))
+        return im
+
+
     def handleSubRectangles(self, images, subRectangles):
         """ handleSubRectangles(images)
 
@@ -288,13 +521,7 @@ class GifWriter:
 
             # First make numpy arrays if required
             for i in range(len(images)):
-                im = images[i]
-                if isinstance(im, Image.Image):
-                    tmp = im.convert() # Make without palette
-                    a = np.asarray(tmp)
-                    if len(a.shape)==0:
-                        raise MemoryError("Too little memory to convert PIL image to array")
-                    images[i] = a
+                images[i] = self.toArray(images[i])
 
             # Determine the sub rectangles
             images, xy = self.getSubRectangles(images)
@@ -303,6 +530,23 @@ class GifWriter:
         return images, xy
 
 
+    def toArray(self, im):
+        """ toArray(im)
+
+        Convert a PIL image to a numpy array (without palette). Numpy
+        arrays are returned unchanged.
+
+        """
+
+        if isinstance(im, Image.Image):
+            tmp = im.convert() # Make without palette
+            a = np.asarray(tmp)
+            if len(a.shape)==0:
+                raise MemoryError("Too little memory to convert PIL image to array")
+            return a
+        return im
+
+
     def getSubRectangles(self, ims):
         """ getSubRectangles(ims)
 
@@ -332,27 +576,10 @@ class GifWriter:
         # Iterate over images
         prev = ims[0]
         for im in ims[1:]:
-
-            # Get difference, sum over colors
-            diff = np.abs(im-prev)
-            if diff.ndim==3:
-                diff = diff.sum(2)
-            # Get begin and end for both dimensions
-            X = np.argwhere(diff.sum(0))
-            Y = np.argwhere(diff.sum(1))
-            # Get rect coordinates
-            if X.size and Y.size:
-                x0, x1 = X[0], X[-1]+1
-                y0, y1 = Y[0], Y[-1]+1
-            else: # No change ... make it minimal
-                x0, x1 = 0, 2
-                y0, y1 = 0, 2
-
-            # Cut out and store
-            im2 = im[y0:y1,x0:x1]
+            im2, xy2 = self.getSubRectangle(prev, im)
             prev = im
             ims2.append(im2)
-            xy.append((x0,y0))
+            xy.append(xy2)
 
         # Done
         #print('%1.2f seconds to determine subrectangles of  %i images' %
@@ -360,14 +587,131 @@ class GifWriter:
         return ims2, xy
 
 
-    def convertImagesToPIL(self, images, dither, nq=0):
-        """ convertImagesToPIL(images, nq=0)
+    def getSubRectangle(self, prev, im):
+        """ getSubRectangle(prev, im)
+
+        Calculate the minimal rectangle of im that changed with respect
+        to the previous image prev (both numpy arrays). Returns a
+        two-element tuple containing the cropped image and its x-y
+        position.
+
+        """
+
+        # Compare the packed pixels
+        changed = self.packFrame(im) != self.packFrame(prev)
+        rects = self.getDirtyRectangles(changed)
+        if rects:
+            x0, y0, x1, y1 = rects[0]
+        else: # No change ... make it minimal
+            x0, x1 = 0, 2
+            y0, y1 = 0, 2
+
+        # Cut out
+        return im[y0:y1,x0:x1], (x0,y0)
+
+
+    def packFrame(self, im):
+        """ packFrame(im)
+
+        Pack the pixels of a numpy image (gray, RGB or RGBA) into single
+        integers, so two frames are compared with one comparison per
+        pixel.
+
+        """
+
+        if im.ndim==2:
+            return im
+        packed = self.packColors(im)
+        if im.shape[2]==4:
+            packed |= im[:,:,3].astype(np.uint32) << 24
+        return packed
+
+
+    def getBoundingBox(self, changed):
+        """ getBoundingBox(changed)
+
+        Bounding box (x0, y0, x1, y1) of the True pixels of a boolean
+        array, or None if there are none.
+
+        """
+
+        rows = np.flatnonzero(changed.any(1))
+        if not rows.size:
+            return None
+        y0, y1 = int(rows[0]), int(rows[-1])+1
+        cols = np.flatnonzero(changed[y0:y1].any(0))
+        return int(cols[0]), y0, int(cols[-1])+1, y1
+
+
+    def getDirtyRectangles(self, changed, maxRectangles=1):
+        """ getDirtyRectangles(changed, maxRectangles=1)
+
+        Rectangles (x0, y0, x1, y1) that cover all changed pixels (boolean
+        array). Starting with the bounding box, the rectangles are split
+        at the largest unchanged row or column gap (largest unchanged
+        area) until there are maxRectangles rectangles or no gaps are
+        left. Returns an empty list if nothing changed.
+
+        """
+
+        box = self.getBoundingBox(changed)
+        if box is None:
+            return []
+        rects = [box]
+
+        while len(rects) < maxRectangles:
+            # Find the largest gap of all rectangles
+            best = None
+            for i, (x0, y0, x1, y1) in enumerate(rects):
+                sub = changed[y0:y1,x0:x1]
+                for axis, length in ((0, x1-x0), (1, y1-y0)):
+                    # axis 0: gap of rows, axis 1: gap of columns
+                    profile = sub.any(1-axis).astype(np.int8)
+                    edges = np.flatnonzero(np.diff(profile))
+                    if not edges.size:
+                        continue
+                    # Gaps start after a falling and end at a rising edge
+                    starts, ends = edges[0::2]+1, edges[1::2]+1
+                    sizes = ends - starts
+                    j = sizes.argmax()
+                    if best is None or sizes[j]*length > best[0]:
+                        best = (sizes[j]*length, i, axis, starts[j], ends[j])
+            if best is None:
+                break
+
+            # Split the rectangle at the gap, shrink both parts
+            area, i, axis, start, end = best
+            x0, y0, x1, y1 = rects.pop(i)
+            if axis == 0:
+                parts = [(x0, y0, x1, y0+start), (x0, y0+end, x1, y1)]
+            else:
+                parts = [(x0, y0, x0+start, y1), (x0+end, y0, x1, y1)]
+            for px0, py0, px1, py1 in parts:
+                bx0, by0, bx1, by1 = self.getBoundingBox(changed[py0:py1,px0:px1])
+                rects.append((px0+bx0, py0+by0, px0+bx1, py0+by1))
+
+        # At least 2x2 pixels (single pixel wide images are not encoded
+        # correctly by PIL), in reading order
+        height, width = changed.shape
+        for i, (x0, y0, x1, y1) in enumerate(rects):
+            x0 = max(0, min(x0, x1-2))
+            y0 = max(0, min(y0, y1-2))
+            rects[i] = (x0, y0, min(width, max(x1, x0+2)), min(height, max(y1, y0+2)))
+        return sorted(rects, key=lambda rect: (rect[1], rect[0]))
+
+
+    def convertImagesToPIL(self, images, dither, nq=0, palette=None):
+        """ convertImagesToPIL(images, nq=0, palette=None)
 
         Convert images to Paletted PIL images, which can then be
-        written to a single animaged GIF.
+        written to a single animaged GIF. If a palette (colors x 3 array)
+        is given, all images are mapped to it (without dithering).
 
         """
 
+        if palette is not None:
+            return [self.quantizeToPalette(im, palette) for im in images]
+
         # Convert to PIL images
         images2 = []
         for im in images:
@@ -412,69 +756,41 @@ class GifWriter:
 
         """
 
-        # Obtain palette for all images and count each occurance
-        palettes, occur = [], []
+        # Obtain palette (and its id) for all images and count each occurance
+        self.resetPaletteIds()
+        palettes, paletteIds = [], []
         for im in images:
-            #palette = getheader(im)[1]
-            palette = getheader(im)[0][-1]
-            if not palette:
-              #palette = PIL.ImagePalette.ImageColor
-                palette = im.palette.tobytes()
+            palette = self.getPalette(im)
             palettes.append(palette)
-        for palette in palettes:
-            occur.append( palettes.count( palette ) )
+            paletteIds.append(self.getPaletteId(palette))
+        occur = collections.Counter(paletteIds)
 
         # Select most-used palette as the global one (or first in case no max)
-        globalPalette = palettes[ occur.index(max(occur)) ]
+        maxOccur = max(occur.values())
+        for globalId, palette in zip(paletteIds, palettes):
+            if occur[globalId] == maxOccur:
+                globalPalette = palette
+                break
 
         # Init
         frames = 0
         firstFrame = True
+        imageDatas = self.encodeImages(images)
 
 
-        for im, palette in zip(images, palettes):
+        for im, palette, paletteId in zip(images, palettes, paletteIds):
 
             if firstFrame:
                 # Write header
-
-                # Gather info
-                header = self.getheaderAnim(im)
-                appext = self.getAppExt(loops)
-
-                # Write
-                fp.write(encode(header))
-                fp.write(globalPalette)
-                fp.write(encode(appext))
+                self.writeHeaderToFile(fp, im, globalPalette, loops)
 
                 # Next frame is not the first
                 firstFrame = False
 
-            if True:
-                # Write palette and image data
-
-                # Gather info
-                data = getdata(im)
-                imdes, data = data[0], data[1:]
-                graphext = self.getGraphicsControlExt(durations[frames],
-                                                        disposes[frames])
-                # Make image descriptor suitable for using 256 local color palette
-                lid = self.getImageDescriptor(im, xys[frames])
-
-                # Write local header
-                if (palette != globalPalette) or (disposes[frames] != 2):
-                    # Use local color palette
-                    fp.write(encode(graphext))
-                    fp.write(encode(lid)) # write suitable image descriptor
-                    fp.write(palette) # write local color table
-                    fp.write(encode('\x08')) # LZW minimum size code
-                else:
-                    # Use global color palette
-                    fp.write(encode(graphext))
-                    fp.write(imdes) # write suitable image descriptor
-
-                # Write image data
-                for d in data:
-                    fp.write(d)
+            # Write palette and image data
+            self.writeFrameToFile(fp, im, palette, paletteId != globalId,
+                                  durations[frames], xys[frames], disposes[frames],
+                                  next(imageDatas))
 
             # Prepare for next round
             frames = frames + 1
@@ -483,14 +799,378 @@ class GifWriter:
         return frames
 
 
+    def getPalette(self, im):
+        """ getPalette(im)
+
+        Get the palette (bytes) of a paletted PIL image.
+
+        """
+
+        #palette = getheader(im)[1]
+        palette = getheader(im)[0][-1]
+        if not palette:
+          #palette = PIL.ImagePalette.ImageColor
+            palette = im.palette.tobytes()
+        return palette
+
+
+    def setEncoder(self, encoder='pil', processes=0):
+        """ setEncoder(encoder='pil', processes=0)
+
+        Set the encoder of the image data ('pil' or 'lzw', see
+        getImageData). If processes is larger than zero, the frames are
+        compressed concurrently in a pool of worker processes and
+        written in order. Call closeEncoder() when done.
+
+        """
+
+        if encoder not in ('pil', 'lzw'):
+            raise ValueError("Unknown encoder: " + str(encoder))
+        self.closeEncoder()
+        self._encoder = encoder
+        self._processes = int(processes)
+        if self._processes > 0:
+            self._pool = multiprocessing.Pool(self._processes)
+
+
+    def getEncoder(self):
+        """ getEncoder()
+
+        Get the encoder of the image data (see setEncoder).
+
+        """
+
+        return getattr(self, '_encoder', 'pil')
+
+
+    def closeEncoder(self):
+        """ closeEncoder()
+
+        Stop the worker processes of the encoder (if any).
+
+        """
+
+        pool = getattr(self, '_pool', None)
+        self._pool = None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+    def encodeImages(self, images):
+        """ encodeImages(images)
+
+        Compress paletted PIL images. Returns an iterator of the image
+        data (see getImageData) in the order of the images.
+
+        """
+
+        args = [(im, self.getEncoder()) for im in images]
+        if getattr(self, '_pool', None) is None:
+            return (encodeImageData(arg) for arg in args)
+        return self._pool.imap(encodeImageData, args)
+
+
+    def resetPaletteIds(self):
+        """ resetPaletteIds()
+
+        Forget the palettes known by getPaletteId().
+
+        """
+
+        self._paletteIds = {}
+
+
+    def getPaletteId(self, palette):
+        """ getPaletteId(palette)
+
+        Get an id of a palette (bytes), which is equal for equal palettes
+        (the first palette gets 0). The palettes are identified by their
+        digest, so each palette is hashed once instead of being compared
+        to all others.
+
+        """
+
+        digest = hashlib.sha1(palette).digest()
+        return self._paletteIds.setdefault(digest, len(self._paletteIds))
+
+
+    def writeHeaderToFile(self, fp, im, globalPalette, loops):
+        """ writeHeaderToFile(fp, im, globalPalette, loops)
+
+        Write the GIF header, the global color table and the application
+        extension (loops) to the stream. im is the first image.
+
+        """
+
+        # Gather info
+        header = self.getheaderAnim(im)
+        appext = self.getAppExt(loops)
+
+        # Write
+        fp.write(encode(header))
+        fp.write(globalPalette)
+        fp.write(encode(appext))
+
+
+    def writeFrameToFile(self, fp, im, palette, localPalette, duration, xy,
+                         dispose, imageData=None):
+        """ writeFrameToFile(fp, im, palette, localPalette, duration, xy,
+                             dispose, imageData=None)
+
+        Write a single paletted PIL image to the stream, with palette as
+        local color table if localPalette is True (else the global color
+        table is used). imageData is the compressed image (see
+        getImageData), it is created if not given.
+
+        """
+
+        # Gather info
+        if imageData is None:
+            imageData = getImageData(im, self.getEncoder())
+        lzwsize, data = imageData
+        graphext = self.getGraphicsControlExt(duration, dispose)
+        # Make image descriptor suitable for using 256 local color palette
+        lid = self.getImageDescriptor(im, xy)
+
+        # Write local header
+        if localPalette:
+            # Use local color palette
+            fp.write(encode(graphext))
+            fp.write(encode(lid)) # write suitable image descriptor
+            fp.write(palette) # write local color table
+            fp.write(lzwsize) # LZW minimum size code
+        else:
+            # Use global color palette
+            lid = self.getImageDescriptor(im, xy, localPalette=False)
+            fp.write(encode(graphext))
+            fp.write(encode(lid)) # write suitable image descriptor
+            fp.write(lzwsize) # LZW minimum size code
+
+        # Write image data
+        for d in data:
+            fp.write(d)
+
+
+    ## Incremental writing
+
+    def open(self, filename, repeat=True, dither=False, nq=0,
+             subRectangles=True, dispose=None, palette=None, maxRectangles=1,
+             encoder='pil', processes=0):
+        """ open(filename, repeat=True, dither=False, nq=0,
+                 subRectangles=True, dispose=None, palette=None,
+                 maxRectangles=1, encoder='pil', processes=0)
+
+        Open a file to write an animated gif frame by frame. Frames are
+        added with addFrame() and encoded and written to the file
+        immediately, so the memory usage does not depend on the number
+        of frames. The file is completed with close(). The parameters are
+        the same as for writeGif(), except that subRectangles can only
+        be True or False and palette has to be an array (see
+        makeSharedPalette) if given. Without shared palette, the palette
+        of the first frame is used as the global color table.
+
+        With subRectangles, the changed part of a frame can be written as
+        up to maxRectangles rectangles (see getDirtyRectangles), e.g. if
+        distant parts change. All rectangles but the last one are written
+        with zero duration. Note that some viewers (e.g. browsers) show
+        images with zero duration for a minimum time, which slows down
+        the animation, so maxRectangles=1 is the safe choice.
+
+        With processes, the frames are compressed by worker processes
+        while the next frames are added (see setEncoder). At most two
+        frames per process are pending, they are written in order.
+
+        """
+
+        # Check PIL
+        if PIL is None:
+            raise RuntimeError("Need PIL to write animated gif files.")
+
+        # Check Numpy
+        if subRectangles and np is None:
+            raise RuntimeError("Need Numpy to use auto-subRectangles.")
+
+        # Check loops
+        if repeat is False:
+            self._loops = 1
+        elif repeat is True:
+            self._loops = 0 # zero means infinite
+        else:
+            self._loops = int(repeat)
+
+        # Check dispose
+        if dispose is None:
+            if subRectangles:
+                dispose = 1 # Leave image in place
+            else:
+                dispose = 2 # Restore to background color.
+
+        self._dither = dither
+        self._nq = nq
+        self._palette = palette
+        self._subRectangles = bool(subRectangles)
+        self._maxRectangles = max(1, int(maxRectangles))
+        self._dispose = dispose
+        self._previous = None
+        self._globalPaletteId = None
+        self.resetPaletteIds()
+        self.setEncoder(encoder, processes)
+        self._pending = collections.deque()
+        self._maxPending = 2 * self._processes
+        self._frames = 0
+        self._fp = open(filename, 'wb')
+
+
+    def addFrame(self, image, duration=0.1):
+        """ addFrame(image, duration=0.1)
+
+        Encode a frame (PIL image or numpy array, see writeGif) and write
+        it to the file opened with open(). duration is the frame duration
+        in seconds.
+
+        """
+
+        if getattr(self, '_fp', None) is None:
+            raise RuntimeError("No gif file opened.")
+
+        # Check image
+        im = checkImages([image])[0]
+
+        # Determine changed rectangles, keep previous (packed) frame only
+        ims, xys = [im], [(0, 0)]
+        if self._subRectangles:
+            im = self.toArray(im)
+            packed = self.packFrame(im)
+            previous, self._previous = self._previous, packed
+            if previous is not None:
+                if previous.shape != packed.shape:
+                    raise ValueError("All frames should have the same size.")
+                rects = self.getDirtyRectangles(packed != previous,
+                                                self._maxRectangles)
+                if not rects: # No change ... make it minimal
+                    rects = [(0, 0, 2, 2)]
+                ims = [im[y0:y1,x0:x1] for x0, y0, x1, y1 in rects]
+                xys = [(x0, y0) for x0, y0, x1, y1 in rects]
+
+        # Make images in a format that we can write easy
+        ims = self.convertImagesToPIL(ims, self._dither, self._nq,
+                                      self._palette)
+
+        for i, (im, xy) in enumerate(zip(ims, xys)):
+            if self._palette is None:
+                palette = self.getPalette(im)
+                paletteId = self.getPaletteId(palette)
+            else:
+                palette = self.paletteToBytes(self._palette)
+                paletteId = 0
+
+            if self._frames == 0:
+                # Write header, the first (or shared) palette is the global one
+                self._globalPaletteId = paletteId
+                self.writeHeaderToFile(self._fp, im, palette, self._loops)
+
+            # The frame is shown after its last rectangle
+            if i < len(ims)-1:
+                imDuration = 0
+            else:
+                imDuration = duration
+            self._pending.append((im, palette, paletteId != self._globalPaletteId,
+                                  imDuration, xy, self.submitImageData(im)))
+        self._frames += 1
+
+        self.writePendingFrames()
+
+
+    def submitImageData(self, im):
+        """ submitImageData(im)
+
+        Compress a paletted PIL image, in a worker process if available.
+        Returns the image data or the pending result.
+
+        """
+
+        if self._pool is None:
+            return getImageData(im, self.getEncoder())
+        return self._pool.apply_async(encodeImageData, ((im, self.getEncoder()),))
+
+
+    def writePendingFrames(self, wait=False):
+        """ writePendingFrames(wait=False)
+
+        Write the compressed frames in order, as long as they are ready
+        or too many frames are pending. With wait, all pending frames are
+        written.
+
+        """
+
+        while self._pending:
+            im, palette, localPalette, duration, xy, imageData = self._pending[0]
+            if not isinstance(imageData, tuple):
+                if not (wait or imageData.ready() or
+                        len(self._pending) > self._maxPending):
+                    break
+                imageData = imageData.get()
+            self._pending.popleft()
+            self.writeFrameToFile(self._fp, im, palette, localPalette,
+                                  duration, xy, self._dispose, imageData)
+
+
+    def close(self):
+        """ close()
+
+        Complete and close the file opened with open(). Returns the
+        number of written frames.
+
+        """
+
+        if getattr(self, '_fp', None) is None:
+            return 0
+
+        try:
+            self.writePendingFrames(wait=True)
+            self._fp.write(encode(";"))  # end gif
+        finally:
+            self.closeEncoder()
+            self._fp.close()
+            self._fp = None
+            self._previous = None
+            self._pending = None
+        return self._frames
+
+
+    def abort(self):
+        """ abort()
+
+        Stop writing the file opened with open(), e.g. after an error:
+        pending frames are discarded, the encoder processes are stopped
+        and the incomplete file (without trailer) is closed. The caller
+        should remove the file. Does nothing if no file is open.
+
+        """
+
+        if getattr(self, '_fp', None) is None:
+            return
+
+        try:
+            self.closeEncoder()
+        finally:
+            self._fp.close()
+            self._fp = None
+            self._previous = None
+            self._pending = None
+
+
 
 
 ## Exposed functions
 
 def writeGif(filename, images, duration=0.1, repeat=True, dither=False,
-                nq=0, subRectangles=True, dispose=None):
+                nq=0, subRectangles=True, dispose=None, palette=None,
+                encoder='pil', processes=0):
     """ writeGif(filename, images, duration=0.1, repeat=True, dither=False,
-                    nq=0, subRectangles=True, dispose=None)
+                    nq=0, subRectangles=True, dispose=None, palette=None,
+                    encoder='pil', processes=0)
 
     Write an animated gif from the specified images.
 
@@ -527,6 +1207,19 @@ def writeGif(filename, images, duration=0.1, repeat=True, dither=False,
         in place. 2 means the background color should be restored after
         each frame. 3 means the decoder should restore the previous frame.
         If subRectangles==False, the default is 2, otherwise it is 1.
+    palette : None, True or array
+        If None, every frame gets its own palette. Otherwise all frames
+        are mapped to a single palette (stored as global color table),
+        which avoids the quantization and the color table of every frame.
+        If True, the palette is created from a sample of the images, an
+        array (colors x 3, at most 256 colors) is used as palette.
+    encoder : 'pil' or 'lzw'
+        The encoder of the image data: the GIF encoder of PIL or the
+        lzwEncode function (with the smallest code size for the colors
+        of each frame).
+    processes : int
+        If larger than zero, the frames are compressed in this number
+        of worker processes.
 
     """
 
@@ -540,6 +1233,11 @@ def writeGif(filename, images, duration=0.1, repeat=True, dither=False,
     # Instantiate writer object
     gifWriter = GifWriter()
 
+    # Check palette
+    if palette is True:
+        step = max(1, len(images) // PALETTE_SAMPLE_SIZE)
+        palette = gifWriter.makeSharedPalette(images[::step])
+
     # Check loops
     if repeat is False:
         loops = 1
@@ -577,13 +1275,15 @@ def writeGif(filename, images, duration=0.1, repeat=True, dither=False,
 
 
     # Make images in a format that we can write easy
-    images = gifWriter.convertImagesToPIL(images, dither, nq)
+    images = gifWriter.convertImagesToPIL(images, dither, nq, palette)
 
     # Write
     fp = open(filename, 'wb')
     try:
+        gifWriter.setEncoder(encoder, processes)
         gifWriter.writeGifToFile(fp, images, duration, loops, xy, dispose)
     finally:
+        gifWriter.closeEncoder()
         fp.close()
 
 
@@ -638,6 +1338,128 @@ def readGif(filename, asNumpy=True):
     return images
 
 
+class ColorLookupTable:
+    """ ColorLookupTable(palette, bits=8, sparse=False)
+
+    Table of the nearest palette color (squared RGB distance) of every
+    RGB color, so whole images are quantized with a single gather.
+    With bits=8 the table has the full resolution (exact) and is filled
+    with the colors of the images as they occur. With less bits per
+    channel (e.g. 5 or 6) the table is built at once for the centers of
+    the reduced color cells.
+
+    The full 8 bit table has 2**24 entries (32 MB), which pays off for a
+    palette shared by many frames. With sparse (8 bits only), just the
+    colors seen so far are kept in a sorted array, e.g. for a palette
+    used by a single frame; the result is the same.
+
+    """
+
+    def __init__(self, palette, bits=8, sparse=False):
+
+        # Check Numpy
+        if np is None:
+            raise RuntimeError("Need Numpy for color lookup tables.")
+        if not 1 <= bits <= 8:
+            raise ValueError("bits should be between 1 and 8.")
+
+        self.palette = np.asarray(palette, np.int32).reshape(-1, 3)
+        if len(self.palette) > 256:
+            raise ValueError("Palette should have at most 256 colors.")
+        self.bits = bits
+        self.shift = 8 - bits
+        self.sparse = sparse and bits == 8
+
+        if self.sparse:
+            # Sorted keys of the colors seen so far and their indices
+            self.knownKeys = np.zeros(0, np.int32)
+            self.knownIndex = np.zeros(0, np.uint8)
+        elif bits == 8:
+            # Filled on demand (-1 is not known yet)
+            self.table = np.empty(1 << 24, np.int16)
+            self.table.fill(-1)
+        else:
+            # Centers of all color cells
+            values = (np.arange(1 << bits) << self.shift) + ((1 << self.shift) >> 1)
+            r, g, b = np.meshgrid(values, values, values, indexing='ij')
+            colors = np.column_stack((r.ravel(), g.ravel(), b.ravel()))
+            self.table = self.nearest(colors).astype(np.uint8)
+
+    def nearest(self, colors):
+        """ nearest(colors)
+
+        Index of the nearest palette color of every color (n x 3 array).
+
+        """
+
+        colors = np.asarray(colors, np.int32).reshape(-1, 3)
+        index = np.empty(len(colors), np.uint8)
+        block = 4096
+        for i in range(0, len(colors), block):
+            diff = colors[i:i+block,np.newaxis,:] - self.palette[np.newaxis,:,:]
+            index[i:i+block] = (diff*diff).sum(2).argmin(1)
+        return index
+
+    def keys(self, rgb):
+        """ keys(rgb)
+
+        Table positions of the colors of an RGB array (... x 3).
+
+        """
+
+        rgb = np.asarray(rgb)
+        r = rgb[...,0].astype(np.int32) >> self.shift
+        g = rgb[...,1].astype(np.int32) >> self.shift
+        b = rgb[...,2].astype(np.int32) >> self.shift
+        return (r << (2*self.bits)) | (g << self.bits) | b
+
+    def lookup(self, rgb):
+        """ lookup(rgb)
+
+        Palette indices (uint8 array) of the colors of an RGB array
+        (... x 3), e.g. an image.
+
+        """
+
+        keys = self.keys(rgb)
+        if self.sparse:
+            return self.lookupSparse(keys)
+        index = self.table[keys]
+        if self.bits == 8:
+            # Add the colors that are not in the table yet
+            missing = index < 0
+            if missing.any():
+                new = np.unique(keys[missing])
+                colors = np.column_stack((new >> 16, (new >> 8) & 0xFF, new & 0xFF))
+                self.table[new] = self.nearest(colors)
+                index = self.table[keys]
+        return index.astype(np.uint8)
+
+    def lookupSparse(self, keys):
+        """ lookupSparse(keys)
+
+        Palette indices of table positions (see keys) with the sorted
+        array of the colors seen so far (sparse table).
+
+        """
+
+        position = np.searchsorted(self.knownKeys, keys)
+        known = position < len(self.knownKeys)
+        known[known] = self.knownKeys[position[known]] == keys[known]
+        if not known.all():
+            # Add the colors that are not known yet
+            new = np.unique(keys[~known])
+            colors = np.column_stack((new >> 16, (new >> 8) & 0xFF, new & 0xFF))
+            allKeys = np.concatenate((self.knownKeys, new))
+            allIndex = np.concatenate((self.knownIndex, self.nearest(colors)))
+            order = allKeys.argsort()
+            self.knownKeys = allKeys[order]
+            self.knownIndex = allIndex[order]
+            position = np.searchsorted(self.knownKeys, keys)
+        return self.knownIndex[position]
+
+
+
 class NeuQuant:
     """ NeuQuant(image, samplefac=10, colors=256)
 
@@ -716,11 +1538,12 @@ class NeuQuant:
 
     pixels = None
     samplefac = None
+    lookupTables = None
 
     a_s = None
 
 
-    def setconstants(self, samplefac, colors):
+    def setconstants(self, samplefac, colors, batchsize=64):
         self.NCYCLES = 100 # Number of learning cycles
         self.NETSIZE = colors # Number of colours used
         self.SPECIALS = 3 # Number of reserved colours used
@@ -751,10 +1574,12 @@ class NeuQuant:
 
         self.pixels = None
         self.samplefac = samplefac
+        self.batchsize = max(1, int(batchsize))
+        self.lookupTables = {}
 
         self.a_s = {}
 
-    def __init__(self, image, samplefac=10, colors=256):
+    def __init__(self, image, samplefac=10, colors=256, batchsize=64):
 
         # Check Numpy
         if np is None:
@@ -767,8 +1592,8 @@ class NeuQuant:
             raise IOError("Image mode should be RGBA.")
 
         # Initialize
-        self.setconstants(samplefac, colors)
-        self.pixels = np.fromstring(image.tostring(), np.uint32)
+        self.setconstants(samplefac, colors, batchsize)
+        self.pixels = np.frombuffer(image.tobytes(), np.uint32)
         self.setUpArrays()
 
         self.learn()
@@ -809,98 +1634,82 @@ class NeuQuant:
 
     # Omitted: setPixels
 
-    def altersingle(self, alpha, i, b, g, r):
-        """Move neuron i towards biased (b,g,r) by factor alpha"""
-        n = self.network[i] # Alter hit neuron
-        n[0] -= (alpha*(n[0] - b))
-        n[1] -= (alpha*(n[1] - g))
-        n[2] -= (alpha*(n[2] - r))
-
-    def geta(self, alpha, rad):
-        try:
-            return self.a_s[(alpha, rad)]
-        except KeyError:
-            length = rad*2-1
-            mid = int(length//2)
-            q = np.array(list(range(mid-1,-1,-1))+list(range(-1,mid)))
-            a = alpha*(rad*rad - q*q)/(rad*rad)
-            a[mid] = 0
-            self.a_s[(alpha, rad)] = a
-            return a
-
-    def alterneigh(self, alpha, rad, i, b, g, r):
-        if i-rad >= self.SPECIALS-1:
-            lo = i-rad
-            start = 0
-        else:
-            lo = self.SPECIALS-1
-            start = (self.SPECIALS-1 - (i-rad))
-
-        if i+rad <= self.NETSIZE:
-            hi = i+rad
-            end = rad*2-1
-        else:
-            hi = self.NETSIZE
-            end = (self.NETSIZE - (i+rad))
-
-        a = self.geta(alpha, rad)[start:end]
-
-        p = self.network[lo+1:hi]
-        p -= np.transpose(np.transpose(p - np.array([b, g, r])) * a)
-
-    #def contest(self, b, g, r):
-    #    """ Search for biased BGR values
-    #            Finds closest neuron (min dist) and updates self.freq
-    #            finds best neuron (min dist-self.bias) and returns position
-    #            for frequently chosen neurons, self.freq[i] is high and self.bias[i] is negative
-    #            self.bias[i] = self.GAMMA*((1/self.NETSIZE)-self.freq[i])"""
-    #
-    #    i, j = self.SPECIALS, self.NETSIZE
-    #    dists = abs(self.network[i:j] - np.array([b,g,r])).sum(1)
-    #    bestpos = i + np.argmin(dists)
-    #    biasdists = dists - self.bias[i:j]
-    #    bestbiaspos = i + np.argmin(biasdists)
-    #    self.freq[i:j] -= self.BETA * self.freq[i:j]
-    #    self.bias[i:j] += self.BETAGAMMA * self.freq[i:j]
-    #    self.freq[bestpos] += self.BETA
-    #    self.bias[bestpos] -= self.BETAGAMMA
-    #    return bestbiaspos
-    def contest(self, b, g, r):
-        """ Search for biased BGR values
+    def alter(self, alpha, rad, js, colors):
+        """Move the neurons js (hit by the colors) and their neighbours
+        within radius rad towards the colors (n x 3). The hit neuron moves
+        by factor alpha, its neighbours by alpha*(1-((d-1)/rad)**2) with
+        the distance d. The sequential moves of every neuron are combined:
+        it moves by 1-prod(1-w) towards the weighted mean of the colors,
+        which is exact for a single color."""
+
+        # Don't learn for specials
+        learn = js >= self.SPECIALS
+        js, colors = js[learn], colors[learn]
+        if not len(js):
+            return
+
+        # Weights of all neurons (colors x neurons)
+        dist = np.abs(np.arange(self.NETSIZE)[np.newaxis,:] - js[:,np.newaxis])
+        w = np.where(dist == 0, alpha, 0.0)
+        if rad > 0:
+            q = dist - 1.0
+            neighbour = (dist > 0) & (dist < rad)
+            w = np.where(neighbour, alpha*(rad*rad - q*q)/(rad*rad), w)
+        w[:,:self.SPECIALS] = 0.0
+
+        total = w.sum(0)
+        moved = np.nonzero(total)[0]
+        w = w[:,moved]
+        mean = np.dot(w.T, colors) / total[moved,np.newaxis]
+        fraction = 1.0 - np.prod(1.0 - w, axis=0)
+        n = self.network[moved]
+        self.network[moved] = n + fraction[:,np.newaxis] * (mean - n)
+
+    def contest(self, colors):
+        """ Search for biased BGR values (n x 3 array)
                 Finds closest neuron (min dist) and updates self.freq
                 finds best neuron (min dist-self.bias) and returns position
                 for frequently chosen neurons, self.freq[i] is high and self.bias[i] is negative
-                self.bias[i] = self.GAMMA*((1/self.NETSIZE)-self.freq[i])"""
+                self.bias[i] = self.GAMMA*((1/self.NETSIZE)-self.freq[i])
+            All colors are compared with the same network and bias, the
+            updates of freq and bias equal the sequential ones."""
         i, j = self.SPECIALS, self.NETSIZE
-        dists = abs(self.network[i:j] - np.array([b,g,r])).sum(1)
-        bestpos = i + np.argmin(dists)
-        biasdists = dists - self.bias[i:j]
-        bestbiaspos = i + np.argmin(biasdists)
-        self.freq[i:j] *= (1-self.BETA)
-        self.bias[i:j] += self.BETAGAMMA * self.freq[i:j]
-        self.freq[bestpos] += self.BETA
-        self.bias[bestpos] -= self.BETAGAMMA
+        n = len(colors)
+        dists = np.abs(self.network[np.newaxis,i:j,:] - colors[:,np.newaxis,:]).sum(2)
+        bestpos = np.argmin(dists, axis=1)
+        bestbiaspos = i + np.argmin(dists - self.bias[i:j], axis=1)
+
+        # Step k: freq *= (1-BETA), bias += BETAGAMMA*freq, then the hit
+        # neuron gets freq += BETA, bias -= BETAGAMMA
+        decay = (1-self.BETA) ** np.arange(1, n+1)
+        remaining = decay[::-1] # (1-BETA)**(n-k) for step k
+        freq = self.freq[i:j]
+        hitbias = np.bincount(bestpos, (1-self.BETA) - remaining, j-i)
+        self.bias[i:j] += self.BETAGAMMA * (freq * decay.sum() + hitbias)
+        self.bias[i:j] -= self.BETAGAMMA * np.bincount(bestpos, None, j-i)
+        self.freq[i:j] = freq * decay[-1] + \
+            self.BETA * np.bincount(bestpos, remaining / (1-self.BETA), j-i)
         return bestbiaspos
 
-
-
-
-    def specialFind(self, b, g, r):
-        for i in range(self.SPECIALS):
-            n = self.network[i]
-            if n[0] == b and n[1] == g and n[2] == r:
-                return i
-        return -1
+    def specialFind(self, colors):
+        """ Index of the special neuron equal to every color (n x 3 array),
+        -1 if there is none """
+        equal = (colors[:,np.newaxis,:] ==
+                 self.network[np.newaxis,:self.SPECIALS,:]).all(2)
+        return np.where(equal.any(1), equal.argmax(1), -1)
 
     def learn(self):
+        """ Learn the network from the sampled pixels. The pixels are
+        processed in batches of self.batchsize colors, which are compared
+        with the same network state (batchsize 1 is the original sequential
+        algorithm). Batches never span a change of alpha and radius."""
         biasRadius = self.INITBIASRADIUS
-        alphadec = 30 + ((self.samplefac-1)/3)
+        alphadec = 30 + ((self.samplefac-1)//3)
         lengthcount = self.pixels.size
-        samplepixels = lengthcount / self.samplefac
-        delta = samplepixels / self.NCYCLES
+        samplepixels = lengthcount // self.samplefac
+        delta = max(1, samplepixels // self.NCYCLES)
         alpha = self.INITALPHA
 
-        i = 0;
         rad = biasRadius * 2**self.RADIUSBIASSHIFT
         if rad <= 1:
             rad = 0
@@ -908,7 +1717,6 @@ class NeuQuant:
         print("Beginning 1D learning: samplepixels = %1.2f  rad = %i" %
                                                     (samplepixels, rad) )
         step = 0
-        pos = 0
         if lengthcount%NeuQuant.PRIME1 != 0:
             step = NeuQuant.PRIME1
         elif lengthcount%NeuQuant.PRIME2 != 0:
@@ -918,37 +1726,33 @@ class NeuQuant:
         else:
             step = NeuQuant.PRIME4
 
+        # Colors of all sampled pixels
+        pos = (np.arange(samplepixels, dtype=np.int64) * step) % lengthcount
+        p = self.pixels[pos]
+        colors = np.empty((samplepixels, 3), dtype='float64')
+        colors[:,0] = (p      ) & 0xff # b
+        colors[:,1] = (p >>  8) & 0xff # g
+        colors[:,2] = (p >> 16) & 0xff # r
+
+        # Remember background colour
+        self.network[self.BGCOLOR] = colors[0]
+
         i = 0
-        printed_string = ''
         while i < samplepixels:
-            if i%100 == 99:
-                tmp = '\b'*len(printed_string)
-                printed_string = str((i+1)*100/samplepixels)+"%\n"
-                print(tmp + printed_string)
-            p = self.pixels[pos]
-            r = (p >> 16) & 0xff
-            g = (p >>  8) & 0xff
-            b = (p      ) & 0xff
-
-            if i == 0: # Remember background colour
-                self.network[self.BGCOLOR] = [b, g, r]
-
-            j = self.specialFind(b, g, r)
-            if j < 0:
-                j = self.contest(b, g, r)
-
-            if j >= self.SPECIALS: # Don't learn for specials
-                a = (1.0 * alpha) / self.INITALPHA
-                self.altersingle(a, j, b, g, r)
-                if rad > 0:
-                    self.alterneigh(a, rad, j, b, g, r)
-
-            pos = (pos+step)%lengthcount
-
-            i += 1
+            n = min(self.batchsize, delta - i%delta, samplepixels - i)
+            batch = colors[i:i+n]
+
+            j = self.specialFind(batch)
+            search = j < 0
+            if search.any():
+                j[search] = self.contest(batch[search])
+
+            self.alter((1.0 * alpha) / self.INITALPHA, rad, j, batch)
+
+            i += n
             if i%delta == 0:
-                alpha -= alpha / alphadec
-                biasRadius -= biasRadius / self.RADIUSDEC
+                alpha -= alpha // alphadec
+                biasRadius -= biasRadius // self.RADIUSDEC
                 rad = biasRadius * 2**self.RADIUSBIASSHIFT
                 if rad <= 1:
                     rad = 0
@@ -957,44 +1761,25 @@ class NeuQuant:
         print("Finished 1D learning: final alpha = %1.2f!" % finalAlpha)
 
     def fix(self):
-        for i in range(self.NETSIZE):
-            for j in range(3):
-                x = int(0.5 + self.network[i,j])
-                x = max(0, x)
-                x = min(255, x)
-                self.colormap[i,j] = x
-            self.colormap[i,3] = i
+        x = (0.5 + self.network).astype('int32')
+        self.colormap[:,:3] = np.clip(x, 0, 255)
+        self.colormap[:,3] = np.arange(self.NETSIZE)
 
     def inxbuild(self):
-        previouscol = 0
-        startpos = 0
-        for i in range(self.NETSIZE):
-            p = self.colormap[i]
-            q = None
-            smallpos = i
-            smallval = p[1] # Index on g
-            # Find smallest in i..self.NETSIZE-1
-            for j in range(i+1, self.NETSIZE):
-                q = self.colormap[j]
-                if q[1] < smallval: # Index on g
-                    smallpos = j
-                    smallval = q[1] # Index on g
-
-            q = self.colormap[smallpos]
-            # Swap p (i) and q (smallpos) entries
-            if i != smallpos:
-                p[:],q[:] = q, p.copy()
-
-            # smallval entry is now in position i
-            if smallval != previouscol:
-                self.netindex[previouscol] = (startpos+i) >> 1
-                for j in range(previouscol+1, smallval):
-                    self.netindex[j] = i
-                previouscol = smallval
-                startpos = i
-        self.netindex[previouscol] = (startpos+self.MAXNETPOS) >> 1
-        for j in range(previouscol+1, 256): # Really 256
-            self.netindex[j] = self.MAXNETPOS
+        """ Sort the colormap on g and build the index of the first
+        entries of every g value """
+        order = np.argsort(self.colormap[:,1], kind='mergesort') # Index on g
+        self.colormap[:] = self.colormap[order]
+
+        g = self.colormap[:,1]
+        values = np.arange(256) # Really 256
+        first = np.searchsorted(g, values, side='left')
+        last = np.searchsorted(g, values, side='right')
+        present = last > first
+        # Middle of the entries of a g value, start of the next entries else
+        last = np.minimum(last, self.MAXNETPOS)
+        self.netindex[:] = np.minimum(np.where(present, (first+last) >> 1, first),
+                                      self.MAXNETPOS)
 
 
     def paletteImage(self):
@@ -1002,9 +1787,7 @@ class NeuQuant:
             already has the palette, and use that in Image.quantize. This function
             returns this palette image. """
         if self.pimage is None:
-            palette = []
-            for i in range(self.NETSIZE):
-                palette.extend(self.colormap[i][:3])
+            palette = self.colormap[:,:3].ravel().tolist()
 
             palette.extend([0]*(256-self.NETSIZE)*3)
 
@@ -1015,12 +1798,32 @@ class NeuQuant:
 
 
     def quantize(self, image):
-        """ Use a kdtree to quickly find the closest palette colors for the pixels """
-        if get_cKDTree():
-            return self.quantize_with_scipy(image)
-        else:
-            print('Scipy not available, falling back to slower version.')
-            return self.quantize_without_scipy(image)
+        """ Use a lookup table to find the closest palette colors for the pixels """
+        return self.quantize_with_lookup_table(image)
+
+
+    def lookupTable(self, bits=8):
+        """ The (cached) ColorLookupTable of the palette, see ColorLookupTable
+        for the resolution (bits); the 8 bit table is sparse, as the palette
+        of a NeuQuant instance is usually used for a single image """
+        try:
+            return self.lookupTables[bits]
+        except KeyError:
+            table = ColorLookupTable(self.colormap[:,:3], bits, sparse=True)
+            self.lookupTables[bits] = table
+            return table
+
+
+    def quantize_with_lookup_table(self, image, bits=8):
+        """ Quantize the image with a single gather from the lookup table,
+        bits=8 gives the same colors as inxsearch """
+        px = np.asarray(image)
+        if px.ndim == 2:
+            px = np.asarray(image.convert("RGB"))
+        index = self.lookupTable(bits).lookup(px[:,:,:3])
+        im = Image.fromarray(index, 'P')
+        im.putpalette(self.paletteImage().getpalette())
+        return im
 
 
     def quantize_with_scipy(self, image):
@@ -1040,20 +1843,15 @@ class NeuQuant:
 
     def quantize_without_scipy(self, image):
         """" This function can be used if no scipy is availabe.
-        It's 7 times slower though.
+        Every distinct color of the image is looked up only once.
         """
         w,h = image.size
         px = np.asarray(image).copy()
-        memo = {}
-        for j in range(w):
-            for i in range(h):
-                key = (px[i,j,0],px[i,j,1],px[i,j,2])
-                try:
-                    val = memo[key]
-                except KeyError:
-                    val = self.convert(*key)
-                    memo[key] = val
-                px[i,j,0],px[i,j,1],px[i,j,2] = val
+        rgb = px[:,:,:3].reshape((w*h,3)).astype(np.uint32)
+        keys, inverse = np.unique((rgb[:,0] << 16) | (rgb[:,1] << 8) | rgb[:,2],
+                                  return_inverse=True)
+        index = self.inxsearch(keys >> 16, (keys >> 8) & 0xff, keys & 0xff)
+        px[:,:,:3] = self.colormap[index[inverse],:3].reshape((h,w,3))
         return Image.fromarray(px).convert("RGB").quantize(palette=self.paletteImage())
 
     def convert(self, *color):
@@ -1061,10 +1859,18 @@ class NeuQuant:
         return self.colormap[i,:3]
 
     def inxsearch(self, r, g, b):
-        """Search for BGR values 0..255 and return colour index"""
-        dists = (self.colormap[:,:3] - np.array([r,g,b]))
-        a= np.argmin((dists*dists).sum(1))
-        return a
+        """Search for BGR values 0..255 and return colour index
+        (or array of indices for arrays of values)"""
+        colors = np.column_stack(np.broadcast_arrays(r, g, b)).astype('int32')
+        palette = self.colormap[:,:3]
+        index = np.empty(len(colors), dtype=np.intp)
+        block = 4096
+        for i in range(0, len(colors), block):
+            dists = colors[i:i+block,np.newaxis,:] - palette[np.newaxis,:,:]
+            index[i:i+block] = np.argmin((dists*dists).sum(2), axis=1)
+        if np.ndim(r) == 0:
+            return index[0]
+        return index.reshape(np.shape(r))
 
 
 
@@ -0,0 +1,136 @@
+# coding=utf-8
+"""
+Memo of the interpolated benchmark values (mass, width, cross section and branching ratio of every frame, see
+th2grid.interpolate_grids): a least recently used dictionary in this process in front of an optional persistent
+diskcache.DiskCache, so repeated runs and sweeps neither read the benchmark grids nor interpolate them again.
+"""
+
+import collections
+import hashlib
+import os
+import numpy as np
+import diskcache
+import gridcache
+import th2grid
+
+# number of interpolation results kept in the memory of the process
+MEMORY_ENTRIES = 64
+
+# version of the interpolation (part of the keys, increase it if the interpolated values change)
+INTERPOLATION_VERSION = 1
+
+
+class PhysicsMemo(object):
+    """
+    interpolated values of the histograms of an input file, keyed by the input file (content digest), the histogram
+    names and the (m_A, tan beta) points
+    """
+
+    def __init__(self, input_filename, directory=None, max_size=diskcache.DEFAULT_MAX_SIZE,
+                 max_entries=MEMORY_ENTRIES, grid_cache=None):
+        """
+        :param input_filename: ROOT input filename
+        :param directory: directory of the persistent memo (None: memo in memory only)
+        :param max_size: maximum size of the persistent memo in bytes (see diskcache.DiskCache.evict)
+        :param max_entries: number of interpolation results kept in memory
+        :param grid_cache: NumPy grid cache directory (default: gridcache.default_cache_dir(input_filename)), identifies
+                           the benchmark data, if the ROOT input file is missing
+        """
+        if directory is not None:
+            self.cache = diskcache.DiskCache(directory, max_size=max_size)
+            # the file content identifies the benchmark data across runs
+            self.input_id = self.get_input_id(input_filename, grid_cache)
+        else:
+            self.cache = None
+            self.input_id = os.path.abspath(input_filename)
+        self.max_entries = max_entries
+        self.memory = collections.OrderedDict()
+        # number of results from memory, from the persistent memo and interpolated
+        self.num_memory = 0
+        self.num_disk = 0
+        self.num_interpolated = 0
+
+    def get_input_id(self, input_filename, grid_cache=None):
+        """
+        content digest of the benchmark data: of the ROOT input file or, if it is missing, of the files of the grid
+        cache (see gridcache.is_cache_valid)
+
+        :rtype : str
+        :param input_filename: ROOT input filename
+        :param grid_cache: NumPy grid cache directory (default: gridcache.default_cache_dir(input_filename))
+        :return: hex digest
+        """
+        if os.path.exists(input_filename):
+            return self.cache.file_digest(input_filename)
+        if grid_cache is None:
+            grid_cache = gridcache.default_cache_dir(input_filename)
+        if not gridcache.is_cache_valid(input_filename, grid_cache):
+            raise IOError("Neither ROOT file '" + input_filename + "' nor grid cache '" + grid_cache + "' found")
+        sha1 = hashlib.sha1()
+        for filename in sorted(os.listdir(grid_cache)):
+            if filename.endswith('.npy'):
+                sha1.update(filename + ':' + self.cache.file_digest(os.path.join(grid_cache, filename)) + '\n')
+        return 'grid_cache:' + sha1.hexdigest()
+
+    def get_key(self, hist_names, values_ma, tan_beta):
+        """
+        memo key of an interpolation
+
+        :rtype : dict
+        :param hist_names: list of histogram names
+        :param values_ma: m_A value of every frame
+        :param tan_beta: tangent beta value or list (one value per frame)
+        :return: key (see diskcache.key_digest)
+        """
+        values_ma, values_tan_beta = np.broadcast_arrays(np.atleast_1d(np.asarray(values_ma, dtype=np.float64)),
+                                                         np.atleast_1d(np.asarray(tan_beta, dtype=np.float64)))
+        return {'version': INTERPOLATION_VERSION,
+                'input': self.input_id,
+                'hist_names': list(hist_names),
+                'm_A': hashlib.sha1(np.ascontiguousarray(values_ma)).hexdigest(),
+                'tan_beta': hashlib.sha1(np.ascontiguousarray(values_tan_beta)).hexdigest()}
+
+    def remember(self, digest, values):
+        """
+        keeps a result in memory, removes the least recently used results
+
+        :param digest: key digest
+        :param values: interpolated values
+        """
+        self.memory.pop(digest, None)
+        self.memory[digest] = values
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def interpolate(self, hist_names, values_ma, tan_beta, load_grids):
+        """
+        interpolated values of the histograms from the memo or interpolated (and stored in the memo)
+
+        :rtype : numpy.ndarray
+        :param hist_names: list of histogram names
+        :param values_ma: m_A value of every frame
+        :param tan_beta: tangent beta value or list (one value per frame)
+        :param load_grids: function returning the grids of a list of histogram names (only called, if the values
+                           are not in the memo)
+        :return: array of interpolated values (histograms x frames, see th2grid.interpolate_grids)
+        """
+        key = self.get_key(hist_names, values_ma, tan_beta)
+        digest = diskcache.key_digest(key)
+
+        values = self.memory.get(digest)
+        if values is not None:
+            self.num_memory += 1
+        elif self.cache is not None:
+            values = self.cache.get_array(key)
+            if values is not None:
+                self.num_disk += 1
+
+        if values is None:
+            values = th2grid.interpolate_grids(load_grids(hist_names), values_ma, tan_beta)
+            self.num_interpolated += 1
+            if self.cache is not None:
+                self.cache.put_array(key, values)
+
+        self.remember(digest, values)
+        # the caller may modify the result
+        return values.copy()
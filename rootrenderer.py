@@ -0,0 +1,185 @@
+# coding=utf-8
+"""
+Rendering of the animation frames on a ROOT TCanvas.
+"""
+
+import numpy as np
+import ROOT
+
+CANVAS_WIDTH = 1300
+CANVAS_HEIGHT = 750
+
+
+class RootRenderer(object):
+    """
+    draws single frames of the animation (histograms, legend and logo) on a TCanvas;
+    every process needs its own renderer
+    """
+
+    def __init__(self, data, batch=False):
+        """
+        creates canvas, histograms and logo
+
+        :param data: animatehiggspeak.AnimationData of the animation
+        :param batch: use ROOT batch mode (no graphics window)
+        """
+        if batch:
+            ROOT.gROOT.SetBatch(True)
+
+        self.data = data
+        # tan beta with one decimal place for tan beta scans
+        self.tan_beta_format = "{1:2.0f}" if min(data.values_tan_beta) == max(data.values_tan_beta) else "{1:4.1f}"
+
+        self.canvas = ROOT.TCanvas("canvas", "canvas", CANVAS_WIDTH, CANVAS_HEIGHT)
+        if data.log_scale is not False:
+            self.canvas.SetLogy(1)
+
+        # do not modify ROOT file
+        ROOT.TH1.AddDirectory(False)
+
+        list_hist_names = ['sum'] + data.list_higgs_boson
+        self.hist = []
+        for hist_name in list_hist_names:
+            self.hist.append(ROOT.TH1F(hist_name, "", data.num_bins, data.x_min, data.x_max))
+
+        # bin contents of all histograms including underflow and overflow bins (see TH1::SetContent)
+        self.contents = np.zeros((len(self.hist), data.num_bins + 2), dtype=np.float64)
+
+        # open logo, create logo frame
+        self.logo = ROOT.TImage.Open("logo.png")
+        self.logo_frame = ROOT.TPad("logo_pad", "", 0.17, 0.9, 0.3, 1.0)
+
+        # image for the in-memory capture of the canvas
+        self.image = ROOT.TImage.Create()
+
+        self.draw_static()
+
+    def draw_static(self):
+        """
+        sets up the parts of the canvas, which are the same in every frame (titles, axis ranges, histogram styles,
+        legend entries and logo); a frame only changes the histogram contents and the legend header
+        """
+        data = self.data
+        hist = self.hist
+        num_hists = len(hist)
+        num_bins_visible = data.spectra.shape[1]
+
+        # create legend
+        self.leg = leg = ROOT.TLegend(0.70, 0.70, 0.99, 0.99)  # over default legend box
+        leg.SetFillColor(0)
+        leg.SetLineColor(1)
+        leg.SetHeader(self.header_text(0))
+
+        # set histogram title and axis labels (fist histogram only)
+        hist[0].SetTitle("MSSM-Higgs-Viewer")
+        hist[0].GetXaxis().SetTitle("m [GeV]")
+        hist[0].GetYaxis().SetTitle("Events / GeV")
+
+        # draw all histograms
+        for hist_index in range(num_hists):
+            # set previous estimated height
+            hist[hist_index].SetMaximum(data.y_height)
+            # set minimum (for logarithmic scale)
+            if data.log_scale is not False:
+                if data.log_scale is None:
+                    hist[hist_index].SetMinimum(1e-18)
+                else:
+                    hist[hist_index].SetMinimum(data.log_scale)
+            else:
+                hist[hist_index].SetMinimum(0)
+            # set histogram style
+            ROOT.gStyle.SetHistFillColor(hist_index + 1)
+            ROOT.gStyle.SetHistFillStyle(3003)
+            ROOT.gStyle.SetHistLineColor(hist_index + 1)
+            ROOT.gStyle.SetHistLineStyle(0)
+            ROOT.gStyle.SetHistLineWidth(2)
+            hist[hist_index].UseCurrentStyle()
+            # set x axis range
+            hist[hist_index].GetXaxis().SetRange(1, num_bins_visible)
+            # draw histogram, the first one clears the canvas
+            if hist_index == 0:
+                hist[hist_index].Draw("HIST")
+            else:
+                hist[hist_index].Draw("HIST SAME")
+            # add legend entry
+            if hist_index == 0:
+                leg.AddEntry(hist[hist_index], "sum of all Higgs bosons")
+            else:
+                # boson_index = (hist_index - 1)
+                leg.AddEntry(hist[hist_index], data.list_higgs_boson[hist_index - 1] + " - Higgs boson")
+
+        leg.Draw()
+
+        # draw logo frame and logo, change back to canvas
+        self.logo_frame.Draw()
+        self.logo_frame.cd()
+        self.logo.Draw()
+        self.canvas.cd()
+
+    def header_text(self, frame_index):
+        """
+        legend header of a frame
+
+        :rtype : str
+        :param frame_index: index of the frame
+        :return: header (TLatex)
+        """
+        data = self.data
+        return ("prod. mode = " + data.prod_mode + "   m_{A}" +
+                (" = {0:04d}   tan(#beta) = " + self.tan_beta_format).format(int(data.values_ma[frame_index]),
+                                                                          data.values_tan_beta[frame_index]))
+
+    def draw(self, frame_index):
+        """
+        draws a frame of the animation on the canvas (histogram contents and legend header)
+
+        :param frame_index: index of the frame
+        """
+        data = self.data
+        hist = self.hist
+        num_hists = len(hist)
+        num_bins_visible = data.spectra.shape[1]
+
+        # fill TH1F histograms with the sum of all bosons and the boson spectra (one call per histogram)
+        self.contents[:, 1:num_bins_visible + 1] = data.spectra[frame_index].T
+        for hist_index in range(num_hists):
+            hist[hist_index].SetContent(self.contents[hist_index])
+
+        # y axis maximum of the frame (dynamic y range)
+        if data.y_heights is not None:
+            for hist_index in range(num_hists):
+                hist[hist_index].SetMaximum(data.y_heights[frame_index])
+
+        # replace legend header, repaint the canvas
+        self.leg.SetHeader(self.header_text(frame_index))
+        self.canvas.Modified()
+        self.canvas.Update()
+
+    def print_frame(self, filename):
+        """
+        prints the canvas (see TCanvas::Print)
+
+        :param filename: output filename (and options, e.g. 'animation.gif+3')
+        """
+        self.canvas.Print(filename)
+
+    def get_image(self):
+        """
+        captures the canvas as RGB image array (without image file)
+
+        :rtype : numpy.ndarray
+        :return: image (height x width x 3, uint8)
+        """
+        self.canvas.Update()
+        self.image.FromPad(self.canvas)
+        width = self.image.GetWidth()
+        height = self.image.GetHeight()
+        # ARGB pixel values (one 32 bit integer per pixel)
+        argb = self.image.GetArgbArray()
+        argb.SetSize(width * height * 4)
+        pixels = np.frombuffer(argb, dtype=np.uint32, count=width * height).reshape(height, width)
+        rgb = np.empty((height, width, 3), dtype=np.uint8)
+        rgb[:, :, 0] = pixels >> 16
+        rgb[:, :, 1] = pixels >> 8
+        rgb[:, :, 2] = pixels
+        return rgb
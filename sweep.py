@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+Batch mode of the viewer: renders many animations (tan beta, production mode, Higgs boson and m_A range
+combinations) in one process. The jobs are read from a JSON (or YAML) job list or built from the Cartesian product
+of the given values, the benchmark grids are loaded once, jobs with the same physics input share the computed
+spectra and the animations are rendered by a pool of worker processes.
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import animatehiggspeak
+import diskcache
+import gridcache
+import physicsmemo
+import th2grid
+import viewer
+
+# output filename of a job (formatted with the job parameters, bosons joined, m_A and tan beta values of the scan path
+# points joined with '-')
+DEFAULT_OUTPUT_PATTERN = "{production_mode}_{higgs_bosons}_tb{tan_beta}_mA{m_A_range}.gif"
+
+# job parameters and their default values (keys as the long options of viewer.py)
+JOB_DEFAULTS = {
+    'higgs_bosons': None,
+    'tan_beta': None,
+    'm_A_range': None,
+    'scan_path': None,
+    'x_range': None,
+    'production_mode': 'gg',
+    'decay_branch': None,
+    'sigma_gaussian': None,
+    'log_scale': False,
+    'y_range': 'exact',
+    'voigt_mode': 'exact',
+    'normalization': 'analytic',
+    'duration': None,
+    'frame_time': 30,
+    'output_filename': None,
+}
+
+# maximum number of submitted, not finished animations per worker process (limits the memory of the queued
+# AnimationData)
+PENDING_JOBS_PER_PROCESS = 2
+
+# job parameters, which change the computed spectra (jobs with equal values share them)
+SPECTRA_PARAMETERS = ('higgs_bosons', 'tan_beta', 'm_A_range', 'scan_path', 'x_range', 'production_mode',
+                      'decay_branch', 'sigma_gaussian', 'voigt_mode', 'normalization', 'duration', 'frame_time')
+
+# job parameters without value (None) by default
+OPTIONAL_PARAMETERS = ('scan_path', 'x_range', 'decay_branch', 'sigma_gaussian', 'log_scale', 'output_filename')
+
+
+def read_job_list(filename):
+    """
+    reads a job list (list of job parameter dictionaries) from a JSON or YAML (.yaml/.yml, requires PyYAML) file
+
+    :rtype : list
+    :param filename: job list filename
+    :return: list of job parameter dictionaries
+    """
+    with open(filename) as job_file:
+        if os.path.splitext(filename)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("PyYAML is required to read YAML job lists, use JSON instead")
+            jobs = yaml.safe_load(job_file)
+        else:
+            jobs = json.load(job_file)
+    if not isinstance(jobs, list):
+        raise ValueError("job list '" + filename + "' has to contain a list of jobs")
+    return jobs
+
+
+def get_product_jobs(list_tan_beta, list_production_modes, list_higgs_bosons, list_ma_ranges):
+    """
+    creates the jobs of all combinations of the given values (Cartesian product)
+
+    :rtype : list
+    :param list_tan_beta: tangent beta values or ranges ('first-last')
+    :param list_production_modes: production modes
+    :param list_higgs_bosons: Higgs boson sets (list of bosons, e.g. ['H', 'A'])
+    :param list_ma_ranges: m_A ranges ('min-max')
+    :return: list of job parameter dictionaries
+    """
+    return [dict(tan_beta=tan_beta, production_mode=production_mode, higgs_bosons=higgs_bosons, m_A_range=ma_range)
+            for tan_beta, production_mode, higgs_bosons, ma_range
+            in itertools.product(list_tan_beta, list_production_modes, list_higgs_bosons, list_ma_ranges)]
+
+
+def complete_job(job, defaults, output_dir, output_pattern):
+    """
+    adds the default values and the output filename to a job and checks its parameters
+
+    :rtype : dict
+    :param job: job parameter dictionary
+    :param defaults: default values of the job parameters
+    :param output_dir: output directory of the animations
+    :param output_pattern: output filename pattern (see DEFAULT_OUTPUT_PATTERN)
+    :return: completed job parameter dictionary
+    """
+    unknown = set(job) - set(JOB_DEFAULTS)
+    if unknown:
+        raise ValueError("unknown job parameters: " + ", ".join(sorted(unknown)))
+    completed = dict(defaults)
+    completed.update(job)
+    if isinstance(completed['higgs_bosons'], basestring):
+        completed['higgs_bosons'] = completed['higgs_bosons'].split()
+    optional = OPTIONAL_PARAMETERS
+    if completed['scan_path'] is not None:
+        # the scan path replaces the m_A and tan beta ranges
+        optional += ('tan_beta', 'm_A_range')
+        completed['tan_beta'] = completed['m_A_range'] = None
+    for name, value in completed.items():
+        if value is None and name not in optional:
+            raise ValueError("job parameter '" + name + "' is missing: " + repr(job))
+    try:
+        scan_points = get_scan_points(completed)
+        if completed['x_range'] is not None:
+            viewer.parse_range(completed['x_range'])
+    except ValueError:
+        raise ValueError("invalid m_A_range, tan_beta, scan_path or x_range (ranges as 'first-last', scan path as "
+                         "'m_A:tan_beta,m_A:tan_beta,...'): " + repr(job))
+    if isinstance(completed['tan_beta'], basestring):
+        # equal keys of the shared spectra for 10 and '10'
+        tan_beta_first, tan_beta_last = viewer.parse_range(completed['tan_beta'])
+        if tan_beta_first == tan_beta_last:
+            completed['tan_beta'] = tan_beta_first
+    elif completed['tan_beta'] is not None:
+        completed['tan_beta'] = float(completed['tan_beta'])
+    for ma, tan_beta in scan_points:
+        viewer.check_parameters(ma, ma, tan_beta)
+    if completed['output_filename'] is None:
+        values_ma, values_tan_beta = zip(*scan_points)
+        parameters = dict(completed, higgs_bosons=''.join(completed['higgs_bosons']),
+                          m_A_range=format_values(values_ma), tan_beta=format_values(values_tan_beta))
+        completed['output_filename'] = output_pattern.format(**parameters)
+    completed['output_filename'] = os.path.join(output_dir, completed['output_filename'])
+    return completed
+
+
+def get_scan_points(job):
+    """
+    points of the scan path of a job (see viewer.get_scan_points)
+
+    :rtype : list
+    :param job: job parameter dictionary (with m_A_range and tan_beta or scan_path)
+    :return: list of (m_A, tan beta) points
+    """
+    return viewer.get_scan_points(job['m_A_range'], job['tan_beta'], job['scan_path'])
+
+
+def format_values(values):
+    """
+    values of the scan path points in the output filename: a single value, if all are equal, or joined with '-'
+
+    :rtype : str
+    :param values: list of values
+    :return: formatted values
+    """
+    if len(set(values)) == 1:
+        return '%g' % values[0]
+    return '-'.join('%g' % value for value in values)
+
+
+def get_spectra_key(job):
+    """
+    key of the spectra of a job (equal for jobs, which can share the computed spectra)
+
+    :rtype : tuple
+    :param job: completed job parameter dictionary
+    :return: key
+    """
+    return tuple(tuple(job[name]) if isinstance(job[name], list) else job[name] for name in SPECTRA_PARAMETERS)
+
+
+def _render_job(render_arguments):
+    """
+    renders an animation in a worker process
+
+    :rtype : str
+    :param render_arguments: AnimationData, output filename and keyword arguments of animatehiggspeak.render_animation
+    :return: output filename
+    """
+    data, filename, options = render_arguments
+    animatehiggspeak.render_animation(data, filename, batch=True, **options)
+    return filename
+
+
+def wait_for_job(result, verbose=0):
+    """
+    waits for a rendered animation (re-raises the exceptions of the worker process)
+
+    :param result: multiprocessing.pool.AsyncResult of _render_job
+    :param verbose: verbosity
+    """
+    filename = result.get()
+    if verbose > 0:
+        print filename, "written"
+
+
+def run_jobs(jobs, input_filename, grid_cache=None, processes=1, render_options=None, memo=None, verbose=0):
+    """
+    renders the animations of a job list: loads the needed benchmark grids once (only if a job is not in the physics
+    memo), computes the spectra once per physics input and renders the animations in worker processes (while the
+    next spectra are computed)
+
+    :param jobs: list of completed job parameter dictionaries (see complete_job)
+    :param input_filename: ROOT input filename
+    :param grid_cache: NumPy grid cache directory (see gridcache.load_grids)
+    :param processes: number of worker processes rendering the animations
+    :param render_options: keyword arguments of animatehiggspeak.render_animation (fast_mode, renderer, ...)
+    :param memo: physicsmemo.PhysicsMemo of the interpolated values (None: interpolate all jobs)
+    :param verbose: verbosity
+    """
+    if render_options is None:
+        render_options = {}
+
+    # all histograms of all jobs, read at once
+    hist_names = []
+    for job in jobs:
+        for hist_name in viewer.get_hist_names(job['higgs_bosons'], job['production_mode'], job['decay_branch']):
+            if hist_name not in hist_names:
+                hist_names.append(hist_name)
+    grids = {}
+
+    def load_grids(names):
+        if not grids:
+            grids.update(zip(hist_names, gridcache.load_grids(input_filename, hist_names, cache_dir=grid_cache,
+                                                              verbose=verbose)))
+        return [grids[hist_name] for hist_name in names]
+
+    # jobs with the same physics input (e.g. only another y axis scale) are run one after another and share the
+    # spectra, which are dropped after the last of these jobs
+    list_spectra_keys = [get_spectra_key(job) for job in jobs]
+    first_index = {}
+    for job_index, spectra_key in enumerate(list_spectra_keys):
+        first_index.setdefault(spectra_key, job_index)
+    job_order = sorted(xrange(len(jobs)), key=lambda job_index: (first_index[list_spectra_keys[job_index]], job_index))
+    num_remaining = collections.Counter(list_spectra_keys)
+
+    list_spectra = {}
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = collections.deque()
+        for job_index in job_order:
+            job = jobs[job_index]
+            spectra_key = list_spectra_keys[job_index]
+            values_ma, values_tan_beta = viewer.get_scan_values(
+                get_scan_points(job), viewer.get_num_frames(job['duration'], job['frame_time']))
+            x_range = viewer.parse_range(job['x_range']) if job['x_range'] is not None else None
+            job_hist_names = viewer.get_hist_names(job['higgs_bosons'], job['production_mode'], job['decay_branch'])
+            if memo is not None:
+                values = memo.interpolate(job_hist_names, values_ma, values_tan_beta, load_grids)
+            else:
+                values = th2grid.interpolate_grids(load_grids(job_hist_names), values_ma, values_tan_beta)
+            list_values_mass, list_values_width, list_values_xs, list_values_br = viewer.get_boson_values(
+                values, job['higgs_bosons'], job['decay_branch'], values_ma)
+
+            data, _ = animatehiggspeak.create_animation_data(
+                values_ma, list_values_mass, list_values_width, list_values_xs, list_values_br, values_tan_beta,
+                job['higgs_bosons'], job['sigma_gaussian'], job['production_mode'], log_scale=job['log_scale'],
+                voigt_mode=job['voigt_mode'], normalization=job['normalization'], y_range=job['y_range'],
+                spectra=list_spectra.get(spectra_key), x_range=x_range)
+            num_remaining[spectra_key] -= 1
+            if num_remaining[spectra_key] > 0:
+                list_spectra[spectra_key] = data.spectra
+            else:
+                list_spectra.pop(spectra_key, None)
+
+            # wait for the oldest animation, if too many are queued
+            while len(results) >= PENDING_JOBS_PER_PROCESS * processes:
+                wait_for_job(results.popleft(), verbose)
+
+            options = dict(render_options, frame_time=job['frame_time'])
+            results.append(pool.apply_async(_render_job, [(data, job['output_filename'], options)]))
+
+        while results:
+            wait_for_job(results.popleft(), verbose)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main():
+    # create parser, add arguments
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-i", "--input_filename", required=True, type=str, help="ROOT input filename")
+    parser.add_argument("--grid_cache",           required=False, type=str,
+                        help="NumPy grid cache directory (default: <input_filename>.npcache, see viewer.py)")
+    parser.add_argument("-f", "--job_list",       required=False, type=str,
+                        help="JSON (or YAML) file with a list of jobs (parameters as the long options of "
+                             "viewer.py, e.g. {\"higgs_bosons\": [\"H\", \"A\"], \"tan_beta\": 10, "
+                             "\"m_A_range\": \"200-600\"} or a \"scan_path\"), used instead of the Cartesian "
+                             "product of -t, -p, -b, -m")
+    parser.add_argument("-t", "--tan_beta",       required=False, type=str, nargs='+', default=[],
+                        help="tangent beta values or ranges (first-last)")
+    parser.add_argument("-p", "--production_mode", required=False, type=str, nargs='+', default=['gg'],
+                        choices=['gg', 'bb5F', 'bb4F'], help="Higgs boson production modes (default=gg)")
+    parser.add_argument("-b", "--higgs_bosons",   required=False, type=str, nargs='+', default=[],
+                        help="Higgs boson sets, bosons of a set separated by spaces (e.g. 'H A h' A)")
+    parser.add_argument("-m", "--m_A_range",      required=False, type=str, nargs='+', default=[],
+                        help="m_A ranges (min-max)")
+    parser.add_argument("--x_range",              required=False, type=str,
+                        help="mass (x axis) range of the plots (min-max, default for all jobs, see viewer.py)")
+    parser.add_argument("-y", "--decay_branch",   required=False, type=str, help="decay branch (default for all jobs)")
+    parser.add_argument("-s", "--sigma_gaussian", required=False, type=str,
+                        help="sigma value for the gaussian function (default for all jobs, see viewer.py)")
+    parser.add_argument("-d", "--duration",       required=True, type=int,
+                        help="GIF animation duration in milliseconds (default for all jobs)")
+    parser.add_argument("--frame_time",           required=False, type=int, default=30,
+                        help="Time (in milliseconds) per GIF animation frame (default for all jobs, default=30)")
+    parser.add_argument("-o", "--output_dir",     required=False, type=str, default='.',
+                        help="output directory of the animations (default: working directory)")
+    parser.add_argument("--output_pattern",       required=False, type=str, default=DEFAULT_OUTPUT_PATTERN,
+                        help="output filename of jobs without output_filename, formatted with the job parameters "
+                             "(default=" + DEFAULT_OUTPUT_PATTERN + ")")
+    parser.add_argument("-j", "--processes",      required=False, type=int, default=multiprocessing.cpu_count(),
+                        help="number of worker processes rendering the animations (default: number of CPUs)")
+    parser.add_argument("--fast_mode",            required=False, action="store_true", default=False,
+                        help="use fast gif creation mode (larger filesize)")
+    parser.add_argument("--renderer",             required=False, type=str, default='root', choices=['root', 'fast'],
+                        help="frame renderer: ROOT canvas (default) or fast NumPy/PIL rasterizer (enables "
+                             "--fast_mode)")
+    parser.add_argument("--gif_encoder",          required=False, type=str, default='pil', choices=['pil', 'lzw'],
+                        help="GIF image data encoder in fast mode (default=pil)")
+    parser.add_argument("--frame_cache",          required=False, type=str,
+                        help="directory of the persistent cache of rendered frames, shared by all jobs (ROOT "
+                             "renderer only, enables --fast_mode)")
+    parser.add_argument("--frame_cache_size",     required=False, type=int, default=1024,
+                        help="maximum size of the frame cache in MB (default=1024)")
+    parser.add_argument("--physics_cache",        required=False, type=str,
+                        help="directory of the persistent memo of the interpolated benchmark values")
+    parser.add_argument("--physics_cache_size",   required=False, type=int, default=64,
+                        help="maximum size of the physics memo in MB (default=64)")
+    parser.add_argument("-v", "--verbose", action="count", default=0, help="increase output verbosity")
+
+    args = parser.parse_args()
+
+    if args.processes < 1:
+        raise argparse.ArgumentTypeError("number of processes has to be at least 1")
+
+    fast_mode = args.fast_mode
+    if args.renderer == 'fast' and not fast_mode:
+        fast_mode = True
+        print "--fast_mode enabled (required for --renderer fast)"
+
+    if args.frame_cache is not None:
+        if not fast_mode:
+            fast_mode = True
+            print "--fast_mode enabled (required for --frame_cache)"
+        frame_cache = diskcache.DiskCache(args.frame_cache, max_size=args.frame_cache_size * 1024 * 1024)
+        # the jobs start from this size and only add their own writes (no walk through the cache per job)
+        frame_cache.update_size()
+    else:
+        frame_cache = None
+
+    if args.job_list is not None:
+        jobs = read_job_list(args.job_list)
+    else:
+        if not (args.tan_beta and args.higgs_bosons and args.m_A_range):
+            parser.error("-t, -b and -m are required without job list (-f)")
+        jobs = get_product_jobs(args.tan_beta, args.production_mode, [bosons.split() for bosons in args.higgs_bosons],
+                                args.m_A_range)
+
+    defaults = dict(JOB_DEFAULTS, x_range=args.x_range, decay_branch=args.decay_branch,
+                    sigma_gaussian=args.sigma_gaussian, duration=args.duration, frame_time=args.frame_time)
+    jobs = [complete_job(job, defaults, args.output_dir, args.output_pattern) for job in jobs]
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    if args.verbose > 0:
+        print "rendering", len(jobs), "animations with", args.processes, "processes"
+
+    run_jobs(jobs, args.input_filename, grid_cache=args.grid_cache, processes=args.processes,
+             render_options=dict(fast_mode=fast_mode, keep_frames=False, renderer=args.renderer,
+                                 gif_encoder=args.gif_encoder, frame_cache=frame_cache),
+             memo=physicsmemo.PhysicsMemo(args.input_filename, args.physics_cache,
+                                          max_size=args.physics_cache_size * 1024 * 1024,
+                                          grid_cache=args.grid_cache),
+             verbose=args.verbose)
+
+
+if __name__ == '__main__':
+    main()
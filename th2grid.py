@@ -0,0 +1,106 @@
+# coding=utf-8
+"""
+NumPy representation of TH2 histograms (bin edges and contents) and a vectorized bilinear interpolation
+with the semantics of TH2::Interpolate, so the benchmark grids are read once and all frames are interpolated
+in a single call instead of one PyROOT call per frame and histogram.
+"""
+
+import collections
+import numpy as np
+
+# x_edges: (nx + 1) bin edges, y_edges: (ny + 1) bin edges, contents: (nx, ny) bin contents (without under-/overflow)
+TH2Grid = collections.namedtuple('TH2Grid', ['x_edges', 'y_edges', 'contents'])
+
+
+def read_th2_grid(hist):
+    """
+    reads bin edges and bin contents of a ROOT TH2 histogram into a TH2Grid
+
+    :rtype : TH2Grid
+    :param hist: ROOT TH2 histogram
+    :return: grid with the histogram values
+    """
+    x_axis = hist.GetXaxis()
+    y_axis = hist.GetYaxis()
+    num_x = hist.GetNbinsX()
+    num_y = hist.GetNbinsY()
+    x_edges = np.array([x_axis.GetBinLowEdge(bin_x) for bin_x in xrange(1, num_x + 2)])
+    y_edges = np.array([y_axis.GetBinLowEdge(bin_y) for bin_y in xrange(1, num_y + 2)])
+    contents = np.array([[hist.GetBinContent(bin_x, bin_y) for bin_y in xrange(1, num_y + 1)]
+                         for bin_x in xrange(1, num_x + 1)])
+    return TH2Grid(x_edges, y_edges, contents)
+
+
+def axis_interpolation(edges, values):
+    """
+    calculates the neighbouring bins and interpolation weights along one axis like TH2::Interpolate:
+    between the centres of the bin containing the value and its left (lower half of the bin) or
+    right (upper half of the bin) neighbour, constant in the outer half bins
+
+    :rtype : tuple
+    :param edges: bin edges of the axis
+    :param values: values to interpolate at
+    :return: (lower bin indices, upper bin indices, weights of the upper bins, mask of values inside the axis range)
+    """
+    edges = np.asarray(edges, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    num_bins = len(edges) - 1
+    widths = np.diff(edges)
+
+    # bin index like TAxis::FindBin (the upper edge belongs to the overflow bin)
+    bins = np.searchsorted(edges, values, side='right') - 1
+    inside = (bins >= 0) & (bins < num_bins)
+    bins = np.clip(bins, 0, num_bins - 1)
+
+    # upper half of the bin: interpolate between this and the next bin centre, else previous and this bin centre
+    upper_half = (edges[bins + 1] - values) <= widths[bins] / 2
+    lower_bins = np.where(upper_half, bins, bins - 1)
+
+    # bin centres including the centres of the under- and overflow bins
+    centers = np.concatenate(([edges[0] - widths[0] / 2], 0.5 * (edges[:-1] + edges[1:]),
+                              [edges[-1] + widths[-1] / 2]))
+    lower_centers = centers[lower_bins + 1]
+    upper_centers = centers[lower_bins + 2]
+    weights = (values - lower_centers) / (upper_centers - lower_centers)
+
+    # under- and overflow bins use the content of the first/last bin
+    return np.clip(lower_bins, 0, num_bins - 1), np.clip(lower_bins + 1, 0, num_bins - 1), weights, inside
+
+
+def interpolate_grids(grids, x, y):
+    """
+    bilinear interpolation of several TH2Grids at the points (x, y), equivalent to calling TH2::Interpolate for
+    every grid and point (values outside the histogram domain are 0); grids with the same binning are
+    interpolated together
+
+    :rtype : numpy.ndarray
+    :param grids: list of TH2Grid
+    :param x: x values (e.g. m_A of every frame)
+    :param y: y values (e.g. tan beta of every frame), scalars are broadcast
+    :return: array of interpolated values (grids x points)
+    """
+    x, y = np.broadcast_arrays(np.atleast_1d(np.asarray(x, dtype=np.float64)),
+                               np.atleast_1d(np.asarray(y, dtype=np.float64)))
+    result = np.zeros((len(grids),) + x.shape)
+
+    # group grids with identical binning
+    groups = collections.OrderedDict()
+    for grid_index, grid in enumerate(grids):
+        key = (grid.x_edges.tostring(), grid.y_edges.tostring())
+        groups.setdefault(key, []).append(grid_index)
+
+    for grid_indices in groups.itervalues():
+        x_edges = grids[grid_indices[0]].x_edges
+        y_edges = grids[grid_indices[0]].y_edges
+        contents = np.array([grids[grid_index].contents for grid_index in grid_indices])
+
+        x1, x2, x_weight, x_inside = axis_interpolation(x_edges, x)
+        y1, y2, y_weight, y_inside = axis_interpolation(y_edges, y)
+        values = ((1 - x_weight) * (1 - y_weight) * contents[:, x1, y1] +
+                  x_weight * (1 - y_weight) * contents[:, x2, y1] +
+                  (1 - x_weight) * y_weight * contents[:, x1, y2] +
+                  x_weight * y_weight * contents[:, x2, y2])
+        # TH2::Interpolate returns 0 outside of the histogram domain
+        result[grid_indices] = np.where(x_inside & y_inside, values, 0.0)
+
+    return result
@@ -7,20 +7,227 @@ and starts the other program components.
 """
 
 import argparse
-import ROOT
+import numpy as np
+import diskcache
+import gridcache
+import physicsmemo
+import th2grid
 from animatehiggspeak import animate_higgs_peak
 
 
+def parse_range(value_range, value_type=float):
+    """
+    splits a range ('first-last' or a single value) into first and last value
+
+    :rtype : tuple
+    :param value_range: range string
+    :param value_type: type of the values
+    :return: first and last value (equal for a single value)
+    """
+    values = value_range.strip().split("-")
+    if len(values) == 1:
+        return value_type(values[0]), value_type(values[0])
+    first_str, last_str = values
+    return value_type(first_str), value_type(last_str)
+
+
+def parse_ma_range(ma_range):
+    """
+    splits an m_A range ('min-max') into minimum and maximum value
+
+    :rtype : tuple
+    :param ma_range: m_A range string
+    :return: minimum and maximum m_A value (int)
+    """
+    return parse_range(ma_range, int)
+
+
+def parse_scan_path(scan_path):
+    """
+    splits a scan path ('m_A:tan_beta,m_A:tan_beta,...') into its points
+
+    :rtype : list
+    :param scan_path: scan path string
+    :return: list of (m_A, tan beta) points
+    """
+    points = []
+    for point in scan_path.split(","):
+        ma_str, tan_beta_str = point.strip().split(":")
+        points.append((float(ma_str), float(tan_beta_str)))
+    return points
+
+
+def get_scan_points(ma_range, tan_beta, scan_path=None):
+    """
+    points of the scan path: first and last point of the m_A and tan beta ranges or the points of the scan path
+
+    :rtype : list
+    :param ma_range: m_A range string ('min-max')
+    :param tan_beta: tan beta value or range string ('first-last')
+    :param scan_path: scan path string (see parse_scan_path, None: m_A and tan beta range)
+    :return: list of (m_A, tan beta) points
+    """
+    if scan_path is not None:
+        return parse_scan_path(scan_path)
+    ma_first, ma_last = parse_ma_range(ma_range)
+    tan_beta_first, tan_beta_last = parse_range(str(tan_beta))
+    return [(ma_first, tan_beta_first), (ma_last, tan_beta_last)]
+
+
+def check_parameters(ma_min, ma_max, tan_beta):
+    """
+    checks, if the m_A range and tangent beta are inside the benchmark data range
+
+    :param ma_min: minimum m_A value
+    :param ma_max: maximum m_A value
+    :param tan_beta: tangent beta value
+    """
+    # check, if min and max values are in diagram range
+    if ma_min < 90 or ma_max > 2000:
+        raise argparse.ArgumentTypeError("m_A has to be in range of 90 - 2000")
+
+    if tan_beta < 0.5 or tan_beta > 60:
+        raise argparse.ArgumentTypeError("tangent_beta has to be in range of 0.5 - 60")
+
+
+def get_num_frames(duration, frame_time):
+    """
+    number of frames of an animation
+
+    :rtype : int
+    :param duration: animation duration in milliseconds
+    :param frame_time: time per frame in milliseconds
+    :return: number of frames
+    """
+    return int(round(float(duration) / float(frame_time)))
+
+
+def get_scan_values(points, num_frames):
+    """
+    m_A and tan beta values of the frames along a scan path (polyline through the (m_A, tan beta) plane); the frames
+    are distributed evenly over the path length (both axes scaled to the extent of the path), the first frame is one
+    step after the first point and the last frame at the last point (as get_values_ma)
+
+    :rtype : tuple
+    :param points: list of (m_A, tan beta) points
+    :param num_frames: number of frames
+    :return: m_A value and tan beta value of every frame (lists)
+    """
+    points = np.array(points, dtype=np.float64).reshape(-1, 2)
+    extent = points.max(axis=0) - points.min(axis=0)
+    extent[extent == 0] = 1.0
+    # path length at the points
+    lengths = np.sqrt((((points[1:] - points[:-1]) / extent) ** 2).sum(axis=1))
+    path_lengths = np.concatenate(([0.0], np.cumsum(lengths)))
+    frame_lengths = path_lengths[-1] * np.arange(1, num_frames + 1) / float(num_frames)
+    values_ma = np.interp(frame_lengths, path_lengths, points[:, 0])
+    values_tan_beta = np.interp(frame_lengths, path_lengths, points[:, 1])
+    return list(values_ma), list(values_tan_beta)
+
+
+def get_values_ma(ma_min, ma_max, duration, frame_time):
+    """
+    m_A values of the frames of an animation
+
+    :rtype : list
+    :param ma_min: minimum m_A value
+    :param ma_max: maximum m_A value
+    :param duration: animation duration in milliseconds
+    :param frame_time: time per frame in milliseconds
+    :return: m_A value of every frame
+    """
+    values_ma = []
+
+    num_frames = get_num_frames(duration, frame_time)
+    ma_delta = (float(ma_max - ma_min) / float(num_frames))
+
+    for frame in xrange(1, (num_frames + 1)):
+        values_ma.append(ma_min + (ma_delta * frame))
+    return values_ma
+
+
+def get_hist_names(list_higgs_bosons, production_mode, decay_branch=None):
+    """
+    TH2F histogram names (mass, width, cross section and optional branching ratio) for every Higgs boson
+
+    :rtype : list
+    :param list_higgs_bosons: list of Higgs bosons
+    :param production_mode: Higgs boson production mode
+    :param decay_branch: decay branch (None: no branching ratio)
+    :return: histogram names (same number per boson, in boson order)
+    """
+    hist_names = []
+    for boson in list_higgs_bosons:
+        hist_names += ["m_" + boson, "width_" + boson, "xs_" + production_mode + "_" + boson]
+        # only read branching ratio dataset if decay branch is specified
+        if decay_branch is not None:
+            hist_names.append("br_" + boson + "_" + decay_branch)
+    return hist_names
+
+
+def get_boson_values(values, list_higgs_bosons, decay_branch, values_ma):
+    """
+    splits the interpolated values of the histograms of get_hist_names into the value lists of every Higgs boson
+
+    :rtype : tuple
+    :param values: interpolated values (histograms x frames, see th2grid.interpolate_grids)
+    :param list_higgs_bosons: list of Higgs bosons
+    :param decay_branch: decay branch (None: no branching ratio)
+    :param values_ma: m_A value of every frame
+    :return: lists (one list per boson) of mass, width, cross section and branching ratio (empty without decay
+             branch) value lists (one value per frame)
+    """
+    list_values_mass = []
+    list_values_width = []
+    list_values_xs = []
+    list_values_br = []
+
+    num_hists_per_boson = len(values) / len(list_higgs_bosons)
+
+    for boson_index in xrange(0, len(list_higgs_bosons)):
+        values_boson = values[boson_index * num_hists_per_boson:(boson_index + 1) * num_hists_per_boson]
+
+        # if Higgs boson A is chosen, overwrite the only zeros containing mass list with values_ma
+        if list_higgs_bosons[boson_index] == 'A':
+            list_values_mass.append(values_ma)
+        else:
+            list_values_mass.append(values_boson[0])
+        list_values_width.append(values_boson[1])
+        list_values_xs.append(values_boson[2])
+        if decay_branch is not None:
+            list_values_br.append(values_boson[3])
+    return list_values_mass, list_values_width, list_values_xs, list_values_br
+
+
 def main():
     # create parser, add arguments
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--input_filename",  required=True, type=str, help="ROOT input filename")
-    parser.add_argument("-o", "--output_filename", required=True, type=str, help="GIF output filename")
+    parser.add_argument("--grid_cache",            required=False, type=str,
+                        help="NumPy grid cache directory, used if newer than the ROOT input file "
+                             "(default: <input_filename>.npcache, create with gridcache.py)")
+    parser.add_argument("-o", "--output_filename", required=False, type=str,
+                        help="GIF output filename (required without --export_spectra)")
+    parser.add_argument("--physics_cache",         required=False, type=str,
+                        help="directory of the persistent memo of the interpolated benchmark values (repeated runs "
+                             "neither read nor interpolate the grids)")
+    parser.add_argument("--physics_cache_size",    required=False, type=int, default=64,
+                        help="maximum size of the physics memo in MB (default=64)")
+    parser.add_argument("--export_spectra",        required=False, type=str,
+                        help="save the spectra of all frames as NumPy .npz file (without -o: no rendering)")
 
     parser.add_argument("-b", "--higgs_bosons",   required=True, help="Higgs boson(s) (H A h) to show",
                         nargs='+', dest="list_higgs_bosons")
-    parser.add_argument("-t", "--tan_beta",       required=True,  type=float, help="tangent beta value")
-    parser.add_argument("-m", "--m_A_range",      required=True,  type=str, help="m_A range to loop trough (min-max)")
+    parser.add_argument("-t", "--tan_beta",       required=False, type=str,
+                        help="tangent beta value or range to loop through (first-last, tan beta scan)")
+    parser.add_argument("-m", "--m_A_range",      required=False, type=str,
+                        help="m_A range to loop trough (first-last) or fixed m_A value (e.g. for tan beta scans)")
+    parser.add_argument("--scan_path",            required=False, type=str,
+                        help="path through the (m_A, tan beta) plane instead of -m and -t: points m_A:tan_beta "
+                             "separated by commas (e.g. 200:10,500:10,500:40)")
+    parser.add_argument("--x_range",              required=False, type=str,
+                        help="mass (x axis) range (min-max, default: m_A range of the frames, 0.5 - 1.5 m_A "
+                             "for a fixed m_A)")
     parser.add_argument("-s", "--sigma_gaussian", required=False, type=str,
                         help="sigma value (as fixed value or in percent to higgs boson mass) for gaussian function"
                              " inside voigtian function to blur the values")
@@ -30,25 +237,63 @@ def main():
     parser.add_argument("-l", "--log_scale",      required=False, type=float, action='store', nargs='?', default=False,
                         help="use logarithmic scale for y axis (optional set y axis minimum; default=1e-18)")
     # args.log_scale: False if not set, None if set without value, else specified value
+    parser.add_argument("--y_range",        required=False, type=str, default="exact",
+                        choices=['exact', 'estimate', 'dynamic'],
+                        help="y axis maximum: exact (highest peak of the animation), estimate (from the voigt "
+                             "widths, faster) or dynamic (highest peak of every frame) (default=exact)")
+    parser.add_argument("--voigt_mode",     required=False, type=str, default="exact", choices=['exact', 'pseudo'],
+                        help="voigt profile evaluation: exact (Faddeeva function) or pseudo "
+                             "(faster pseudo-Voigt approximation) (default=exact)")
+    parser.add_argument("--normalization",  required=False, type=str, default="analytic",
+                        choices=['analytic', 'roofit'],
+                        help="voigt profile normalization: analytic (closed form) or roofit "
+                             "(numeric RooFit integration, for validation) (default=analytic)")
 
     parser.add_argument("-d", "--duration", required=True,  type=int, help="GIF animation duration in milliseconds")
     parser.add_argument("--frame_time",     required=False, type=int, default=30,
                         help="Time (in milliseconds) per GIF animation frame (default=30)")
     parser.add_argument("--fast_mode",      required=False, action="store_true", default=False,
                         help="use fast gif creation mode (larger filesize)")
+    parser.add_argument("-j", "--jobs",     required=False, type=int, default=1,
+                        help="number of processes for parallel frame rendering (default=1)")
+    parser.add_argument("--palette",        required=False, type=str, default='shared', choices=['shared', 'frame'],
+                        help="GIF palette in fast mode: one palette created from sample frames and shared by all "
+                             "frames (default) or a palette per frame")
+    parser.add_argument("--gif_rectangles", required=False, type=int, default=1,
+                        help="maximum number of changed rectangles written per frame in fast mode (default=1, more "
+                             "rectangles give smaller files, but may slow down the animation in some viewers)")
+    parser.add_argument("--gif_encoder",    required=False, type=str, default='pil', choices=['pil', 'lzw'],
+                        help="GIF image data encoder in fast mode: PIL (default) or own LZW encoder (smaller files "
+                             "for few colors, slower)")
+    parser.add_argument("--encode_jobs",    required=False, type=int, default=0,
+                        help="number of processes compressing the GIF frames in fast mode (default=0: compress "
+                             "while rendering)")
+    parser.add_argument("--renderer",       required=False, type=str, default='root', choices=['root', 'fast'],
+                        help="frame renderer: ROOT canvas (default) or fast NumPy/PIL rasterizer (enables "
+                             "--fast_mode)")
     parser.add_argument("--keep_pictures",      required=False, action="store_true", default=False,
-                        help="do not delete frame images (saved in '<filename>/<filename>_N.png') "
+                        help="save the frames also as images ('<filename>/<filename>_N.png') "
                              "(useful for LaTeX/beamer)")
+    parser.add_argument("--frame_cache",    required=False, type=str,
+                        help="directory of the persistent cache of rendered frames, only frames not rendered by "
+                             "previous animations are rendered (ROOT renderer only, enables --fast_mode)")
+    parser.add_argument("--frame_cache_size", required=False, type=int, default=1024,
+                        help="maximum size of the frame cache in MB, least recently used frames are removed "
+                             "(default=1024)")
 
     parser.add_argument("-v", "--verbose", action="count", default=0, help="increase output verbosity")
 
     args = parser.parse_args()
 
-    # split m_A range into minimum and maximum value, cast to int
-    ma_min_str, ma_max_str = args.m_A_range.strip().split("-")
-    ma_min = int(ma_min_str)
-    ma_max = int(ma_max_str)
-    ma_range = (ma_max - ma_min)
+    if args.output_filename is None and args.export_spectra is None:
+        parser.error("argument -o/--output_filename is required (unless --export_spectra is used)")
+
+    # points of the scan path: first and last point of the m_A and tan beta ranges or path points
+    if args.scan_path is None and (args.m_A_range is None or args.tan_beta is None):
+        parser.error("arguments -m/--m_A_range and -t/--tan_beta (or --scan_path) are required")
+    scan_points = get_scan_points(args.m_A_range, args.tan_beta, args.scan_path)
+
+    x_range = parse_range(args.x_range) if args.x_range is not None else None
 
     fast_mode = args.fast_mode
 
@@ -56,61 +301,56 @@ def main():
         fast_mode = True
         print "--fast_mode enabled (required for --keep_pictures)"
 
-    # check, if min and max values are in diagram range
-    if ma_min < 90 or ma_max > 2000:
-        raise argparse.ArgumentTypeError("m_A has to be in range of 90 - 2000")
+    if args.jobs < 1:
+        raise argparse.ArgumentTypeError("number of jobs has to be at least 1")
 
-    if args.tan_beta < 0.5 or args.tan_beta > 60:
-        raise argparse.ArgumentTypeError("tangent_beta has to be in range of 0.5 - 60")
+    if args.jobs > 1 and not fast_mode:
+        fast_mode = True
+        print "--fast_mode enabled (required for --jobs)"
 
-    list_values_mass = []
-    list_values_width = []
-    list_values_xs = []
-    list_values_br = []
-    values_ma = []
+    if args.renderer == 'fast' and not fast_mode:
+        fast_mode = True
+        print "--fast_mode enabled (required for --renderer fast)"
 
-    num_frames = int(round(float(args.duration) / float(args.frame_time)))
-    ma_delta = (float(ma_range) / float(num_frames))
+    if args.frame_cache is not None and not fast_mode:
+        fast_mode = True
+        print "--fast_mode enabled (required for --frame_cache)"
 
-    for frame in xrange(1, (num_frames + 1)):
-        values_ma.append(ma_min + (ma_delta * frame))
+    if args.physics_cache_size < 0:
+        raise argparse.ArgumentTypeError("physics memo size has to be at least 0")
 
-    # open root file
-    f = ROOT.TFile(args.input_filename)
+    if args.frame_cache_size < 0:
+        raise argparse.ArgumentTypeError("frame cache size has to be at least 0")
 
-    # loop through the Higgs bosons list
-    for boson_index in xrange(0, len(args.list_higgs_bosons)):
-        # open TH2F histograms from root file for inline created dataset names
-        root_mass = f.Get("m_" + args.list_higgs_bosons[boson_index])
-        root_width = f.Get("width_" + args.list_higgs_bosons[boson_index])
-        root_xs = f.Get("xs_" + args.production_mode + "_" + args.list_higgs_bosons[boson_index])
-        # only read branching ratio dataset if decay branch is specified
-        if args.decay_branch is not None:
-            root_br = f.Get("br_" + args.list_higgs_bosons[boson_index] + "_" + args.decay_branch)
-
-        # read values from root file into list
-        values_mass = []
-        values_width = []
-        values_xs = []
-        if args.decay_branch is not None:
-            values_br = []
-        # loop trough the m_A range
-        for frame_index in xrange(num_frames):
-            values_mass.append(root_mass.Interpolate(values_ma[frame_index], args.tan_beta))
-            values_width.append(root_width.Interpolate(values_ma[frame_index], args.tan_beta))
-            values_xs.append(root_xs.Interpolate(values_ma[frame_index], args.tan_beta))
-            if args.decay_branch is not None:
-                values_br.append(root_br.Interpolate(values_ma[frame_index], args.tan_beta))
+    if args.gif_rectangles < 1:
+        raise argparse.ArgumentTypeError("number of GIF rectangles has to be at least 1")
 
-        # if Higgs boson A is chosen, overwrite the only zeros containing mass list with values_ma
-        if args.list_higgs_bosons[boson_index] == 'A':
-            values_mass = values_ma
+    if args.encode_jobs < 0:
+        raise argparse.ArgumentTypeError("number of encoding jobs has to be at least 0")
+
+    for ma, tan_beta in scan_points:
+        check_parameters(ma, ma, tan_beta)
+
+    values_ma, values_tan_beta = get_scan_values(scan_points, get_num_frames(args.duration, args.frame_time))
 
-        list_values_mass.append(values_mass)
-        list_values_width.append(values_width)
-        list_values_xs.append(values_xs)
-        if args.decay_branch is not None:
-            list_values_br.append(values_br)
+    # read TH2F histograms into numpy grids (from the grid cache or the root file) and interpolate them, or take the
+    # interpolated values from the physics memo
+    hist_names = get_hist_names(args.list_higgs_bosons, args.production_mode, args.decay_branch)
+
+    def load_grids(names):
+        return gridcache.load_grids(args.input_filename, names, cache_dir=args.grid_cache, verbose=args.verbose)
+
+    if args.physics_cache is not None:
+        memo = physicsmemo.PhysicsMemo(args.input_filename, args.physics_cache,
+                                       max_size=args.physics_cache_size * 1024 * 1024, grid_cache=args.grid_cache)
+        values = memo.interpolate(hist_names, values_ma, values_tan_beta, load_grids)
+        if args.verbose > 1 and memo.num_disk > 0:
+            print "interpolated values from physics memo", args.physics_cache
+    else:
+        values = th2grid.interpolate_grids(load_grids(hist_names), values_ma, values_tan_beta)
+
+    list_values_mass, list_values_width, list_values_xs, list_values_br = get_boson_values(
+        values, args.list_higgs_bosons, args.decay_branch, values_ma)
 
     if args.verbose > 1:
         print "list_higgs_bosons =", args.list_higgs_bosons
@@ -118,12 +358,17 @@ def main():
         print "list_values_mass = ", list_values_mass
         print "list_values_xs = ", list_values_xs
 
+    if args.frame_cache is not None:
+        frame_cache = diskcache.DiskCache(args.frame_cache, max_size=args.frame_cache_size * 1024 * 1024)
+    else:
+        frame_cache = None
+
     animate_higgs_peak(values_ma,
                        list_values_mass,
                        list_values_width,
                        list_values_xs,
                        list_values_br,
-                       args.tan_beta,
+                       values_tan_beta,
                        args.list_higgs_bosons,
                        args.sigma_gaussian,
                        args.production_mode,
@@ -132,7 +377,19 @@ def main():
                        keep_frames=args.keep_pictures,
                        frame_time=args.frame_time,
                        debug=args.verbose,
-                       log_scale=args.log_scale)
+                       log_scale=args.log_scale,
+                       voigt_mode=args.voigt_mode,
+                       normalization=args.normalization,
+                       jobs=args.jobs,
+                       palette_mode=args.palette,
+                       max_rectangles=args.gif_rectangles,
+                       gif_encoder=args.gif_encoder,
+                       encode_jobs=args.encode_jobs,
+                       renderer=args.renderer,
+                       y_range=args.y_range,
+                       export_filename=args.export_spectra,
+                       x_range=x_range,
+                       frame_cache=frame_cache)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,328 @@
+# coding=utf-8
+"""
+Vectorized evaluation of the Voigt profile with NumPy.
+
+The functions in this module follow the (unnormalized) convention of RooFit's RooVoigtian::evaluate(),
+so the values can be used as a drop-in replacement for per-bin RooVoigtian.getVal() calls. Any array shapes
+that broadcast against each other are accepted, e.g. a bin grid of shape (bins,) together with mean, width
+and sigma arrays of shape (bosons, frames, 1) evaluates all bins of all frames and bosons at once.
+"""
+
+import numpy as np
+
+try:
+    from scipy.special import wofz
+except ImportError:
+    wofz = None
+
+# available accuracy modes: exact (Faddeeva function) and pseudo (Thompson-Cox-Hastings pseudo-Voigt)
+VOIGT_MODES = ('exact', 'pseudo')
+
+SQRT_PI = np.sqrt(np.pi)
+LN2 = np.log(2.0)
+
+# lookup table of the standardized Voigt CDF (see voigt_cdf_table), created on first use
+CDF_TABLE_RHO_POINTS = 101
+CDF_TABLE_T_MAX = 40.0
+CDF_TABLE_T_STEP = 0.02
+_cdf_table = None
+
+
+def faddeeva_weideman(z, n=32):
+    """
+    Faddeeva function w(z) = exp(-z^2) erfc(-iz) for Im(z) >= 0 using Weideman's rational approximation
+    (J.A.C. Weideman, SIAM J. Numer. Anal. 31 (1994) 1497-1518); used if scipy is not available
+
+    :rtype : numpy.ndarray
+    :param z: complex argument(s) with non-negative imaginary part
+    :param n: number of expansion terms (n=32 gives a relative accuracy better than 1e-7)
+    :return: w(z)
+    """
+    m = 2 * n
+    k = np.arange(-m + 1, m)
+    l = np.sqrt(n / np.sqrt(2))
+    t = l * np.tan(k * np.pi / (2 * m))
+    f = np.concatenate(([0.0], np.exp(-t ** 2) * (l ** 2 + t ** 2)))
+    a = np.real(np.fft.fft(np.fft.fftshift(f))) / (2 * m)
+    a = a[1:n + 1][::-1]
+    denominator = l - 1j * z
+    p = np.polyval(a, (l + 1j * z) / denominator)
+    return 2 * p / denominator ** 2 + (1 / SQRT_PI) / denominator
+
+
+def faddeeva(z):
+    """
+    Faddeeva function w(z) (scipy.special.wofz if available)
+
+    :rtype : numpy.ndarray
+    :param z: complex argument(s) with non-negative imaginary part
+    :return: w(z)
+    """
+    if wofz is not None:
+        return wofz(z)
+    return faddeeva_weideman(z)
+
+
+def erf(x):
+    """
+    error function (vectorized), calculated from the Faddeeva function: erfc(y) = exp(-y^2) w(iy)
+
+    :rtype : numpy.ndarray
+    :param x: real argument(s)
+    :return: erf(x)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.abs(x)
+    erfc = np.exp(-y * y) * faddeeva(1j * y).real
+    return np.sign(x) * (1.0 - erfc)
+
+
+def voigt_tail(t, rho):
+    """
+    tail probability of the standardized Voigt profile (see voigt_cdf_table) beyond |t| >> 1:
+    Lorentzian tail with the leading correction from the gaussian smearing
+
+    :rtype : numpy.ndarray
+    :param t: (x - mean) / (sigma + width / 2)
+    :param rho: (width / 2) / (sigma + width / 2)
+    :return: probability of values beyond |t|
+    """
+    t = np.abs(t)
+    return (np.arctan(rho / t) + (1 - rho) ** 2 * rho * t / (t * t + rho * rho) ** 2) / np.pi
+
+
+def voigt_cdf_table():
+    """
+    lookup table of the cumulative distribution function G(t; rho) of the unit-normalized Voigt profile with
+    gaussian sigma (1 - rho) and Lorentzian half width rho, i.e. the Voigt profile in units of (sigma + width / 2)
+
+    The table is created once per process (trapezoidal integration of the Faddeeva function on a fine grid with
+    end point correction, starting with the Lorentzian tail below -CDF_TABLE_T_MAX).
+
+    :rtype : tuple
+    :return: (cdf, density) arrays of shape (CDF_TABLE_RHO_POINTS, number of t values)
+    """
+    global _cdf_table
+    if _cdf_table is None:
+        rho = np.linspace(0.0, 1.0, CDF_TABLE_RHO_POINTS)[:, np.newaxis]
+        num_t = int(round(2 * CDF_TABLE_T_MAX / CDF_TABLE_T_STEP)) + 1
+        t = np.linspace(-CDF_TABLE_T_MAX, CDF_TABLE_T_MAX, num_t)
+        s = 1.0 - rho
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s_safe = np.where(s > 0, s, 1.0)
+            rho_safe = np.where(rho > 0, rho, 1.0)
+            density = faddeeva((t + 1j * rho) / (np.sqrt(2.0) * s_safe)).real / (s_safe * np.sqrt(2 * np.pi))
+            # pure Gauss (rho = 0) and pure Lorentzian (rho = 1) limits
+            density = np.where(rho > 0, density, np.exp(-0.5 * t * t) / np.sqrt(2 * np.pi))
+            density = np.where(s > 0, density, rho_safe / (np.pi * (t * t + rho_safe * rho_safe)))
+            lower_tail = voigt_tail(-CDF_TABLE_T_MAX, rho)
+        step = t[1] - t[0]
+        cdf = np.empty(density.shape)
+        cdf[:, 0] = 0.0
+        cdf[:, 1:] = np.cumsum(0.5 * (density[:, 1:] + density[:, :-1]), axis=1) * step
+        # Euler-Maclaurin correction of the trapezoidal rule
+        derivative = np.gradient(density, step, axis=1)
+        cdf -= step * step / 12.0 * (derivative - derivative[:, :1])
+        _cdf_table = (cdf + lower_tail, density)
+    return _cdf_table
+
+
+def voigt_cdf(t, rho):
+    """
+    cumulative distribution function of the standardized Voigt profile (see voigt_cdf_table),
+    cubic Hermite interpolation in t (using the tabulated density as derivative), cubic Lagrange interpolation
+    in rho and voigt_tail() outside of the table range (absolute accuracy ~1e-8)
+
+    :rtype : numpy.ndarray
+    :param t: (x - mean) / (sigma + width / 2)
+    :param rho: (width / 2) / (sigma + width / 2)
+    :return: G(t; rho)
+    """
+    cdf_table, density_table = voigt_cdf_table()
+    t, rho = np.broadcast_arrays(np.asarray(t, dtype=np.float64), np.asarray(rho, dtype=np.float64))
+
+    rho_pos = np.clip(rho, 0.0, 1.0) * (CDF_TABLE_RHO_POINTS - 1)
+    rho_index = np.clip(np.floor(rho_pos).astype(np.intp), 1, CDF_TABLE_RHO_POINTS - 3)
+    v = rho_pos - rho_index
+    t_pos = (np.clip(t, -CDF_TABLE_T_MAX, CDF_TABLE_T_MAX) + CDF_TABLE_T_MAX) / CDF_TABLE_T_STEP
+    t_index = np.clip(np.floor(t_pos).astype(np.intp), 0, cdf_table.shape[1] - 2)
+    u = t_pos - t_index
+
+    # cubic Hermite basis functions
+    h00 = (1 + 2 * u) * (1 - u) * (1 - u)
+    h10 = u * (1 - u) * (1 - u) * CDF_TABLE_T_STEP
+    h01 = u * u * (3 - 2 * u)
+    h11 = u * u * (u - 1) * CDF_TABLE_T_STEP
+
+    # cubic Lagrange weights for the rho nodes rho_index - 1 ... rho_index + 2
+    rho_weights = (-v * (v - 1) * (v - 2) / 6.0, (v + 1) * (v - 1) * (v - 2) / 2.0,
+                   -(v + 1) * v * (v - 2) / 2.0, (v + 1) * v * (v - 1) / 6.0)
+
+    cdf = 0.0
+    for offset, weight in zip((-1, 0, 1, 2), rho_weights):
+        index = rho_index + offset
+        cdf = cdf + weight * (h00 * cdf_table[index, t_index] + h10 * density_table[index, t_index] +
+                              h01 * cdf_table[index, t_index + 1] + h11 * density_table[index, t_index + 1])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tail = voigt_tail(t, rho)
+    cdf = np.where(t < -CDF_TABLE_T_MAX, tail, cdf)
+    cdf = np.where(t > CDF_TABLE_T_MAX, 1.0 - tail, cdf)
+    return cdf
+
+
+def pseudo_voigt_parameters(width, sigma):
+    """
+    Thompson-Cox-Hastings approximation of the Voigt FWHM and the Lorentzian fraction eta
+
+    :rtype : tuple
+    :param width: Breit-Wigner width (FWHM, RooVoigtian convention)
+    :param sigma: gaussian sigma
+    :return: (fwhm, eta)
+    """
+    f_g = 2 * sigma * np.sqrt(2 * LN2)
+    f_l = width
+    fwhm = np.power(f_g ** 5 + 2.69269 * f_g ** 4 * f_l + 2.42843 * f_g ** 3 * f_l ** 2 +
+                    4.47163 * f_g ** 2 * f_l ** 3 + 0.07842 * f_g * f_l ** 4 + f_l ** 5, 0.2)
+    ratio = f_l / fwhm
+    eta = 1.36603 * ratio - 0.47719 * ratio ** 2 + 0.11116 * ratio ** 3
+    return fwhm, eta
+
+
+def voigtian(x, mean, width, sigma, mode='exact'):
+    """
+    Evaluate the Voigt profile like RooVoigtian::evaluate() (integral over all x is sqrt(pi),
+    limits for zero sigma/width are the unnormalized Breit-Wigner/Gaussian as in RooFit)
+
+    :rtype : numpy.ndarray
+    :param x: observable value(s)
+    :param mean: Voigt mean value(s)
+    :param width: Breit-Wigner width value(s)
+    :param sigma: gaussian sigma value(s)
+    :param mode: 'exact' (Faddeeva function) or 'pseudo' (faster pseudo-Voigt approximation, ~1% accuracy)
+    :return: Voigt profile values (broadcast shape of all arguments)
+    """
+    if mode not in VOIGT_MODES:
+        raise ValueError("unknown Voigt mode '" + str(mode) + "' (choose from " + ", ".join(VOIGT_MODES) + ")")
+
+    arg = np.asarray(x, dtype=np.float64) - np.asarray(mean, dtype=np.float64)
+    w = np.abs(np.asarray(width, dtype=np.float64))
+    s = np.abs(np.asarray(sigma, dtype=np.float64))
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # replace zeros to keep the general expression finite, the limits are selected below
+        s_safe = np.where(s > 0, s, 1.0)
+        w_safe = np.where(w > 0, w, 1.0)
+        if mode == 'exact':
+            c = 1.0 / (np.sqrt(2.0) * s_safe)
+            val = c * faddeeva(c * arg + 0.5j * c * w_safe).real
+        else:
+            fwhm, eta = pseudo_voigt_parameters(w_safe, s_safe)
+            hwhm = 0.5 * fwhm
+            lorentz = hwhm / (np.pi * (arg * arg + hwhm * hwhm))
+            gauss = np.sqrt(4 * LN2 / np.pi) / fwhm * np.exp(-4 * LN2 * arg * arg / (fwhm * fwhm))
+            val = SQRT_PI * (eta * lorentz + (1 - eta) * gauss)
+
+        # Breit-Wigner for zero sigma, Gauss for zero width, constant for both zero
+        val = np.where(s > 0, np.where(w > 0, val, np.exp(-0.5 * arg * arg / (s_safe * s_safe))),
+                       np.where(w > 0, 1.0 / (arg * arg + 0.25 * w * w), 1.0))
+    return val
+
+
+def voigtian_integral(x_min, x_max, mean, width, sigma, mode='exact'):
+    """
+    Integral of voigtian() from x_min to x_max in closed form (no numeric integration),
+    equivalent to RooVoigtian.createIntegral() over the same range
+
+    :rtype : numpy.ndarray
+    :param x_min: lower integration limit(s)
+    :param x_max: upper integration limit(s)
+    :param mean: Voigt mean value(s)
+    :param width: Breit-Wigner width value(s)
+    :param sigma: gaussian sigma value(s)
+    :param mode: 'exact' (precomputed CDF lookup table, absolute accuracy ~1e-8) or 'pseudo' (exact integral of
+                 the pseudo-Voigt approximation)
+    :return: integral values (broadcast shape of all arguments)
+    """
+    if mode not in VOIGT_MODES:
+        raise ValueError("unknown Voigt mode '" + str(mode) + "' (choose from " + ", ".join(VOIGT_MODES) + ")")
+
+    mean = np.asarray(mean, dtype=np.float64)
+    arg_min = np.asarray(x_min, dtype=np.float64) - mean
+    arg_max = np.asarray(x_max, dtype=np.float64) - mean
+    w = np.abs(np.asarray(width, dtype=np.float64))
+    s = np.abs(np.asarray(sigma, dtype=np.float64))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s_safe = np.where(s > 0, s, 1.0)
+        w_safe = np.where(w > 0, w, 1.0)
+        if mode == 'exact':
+            scale = s_safe + 0.5 * w_safe
+            rho = 0.5 * w_safe / scale
+            val = SQRT_PI * (voigt_cdf(arg_max / scale, rho) - voigt_cdf(arg_min / scale, rho))
+        else:
+            fwhm, eta = pseudo_voigt_parameters(w_safe, s_safe)
+            lorentz = (np.arctan(2 * arg_max / fwhm) - np.arctan(2 * arg_min / fwhm)) / np.pi
+            gauss = 0.5 * (erf(2 * np.sqrt(LN2) * arg_max / fwhm) - erf(2 * np.sqrt(LN2) * arg_min / fwhm))
+            val = SQRT_PI * (eta * lorentz + (1 - eta) * gauss)
+
+        # Breit-Wigner for zero sigma, Gauss for zero width, constant for both zero
+        bw = 2.0 / w_safe * (np.arctan(2 * arg_max / w_safe) - np.arctan(2 * arg_min / w_safe))
+        gauss = s_safe * np.sqrt(0.5 * np.pi) * (erf(arg_max / (np.sqrt(2.0) * s_safe)) -
+                                                 erf(arg_min / (np.sqrt(2.0) * s_safe)))
+        val = np.where(s > 0, np.where(w > 0, val, gauss), np.where(w > 0, bw, arg_max - arg_min))
+    return val
+
+
+def compare_with_roofit(values=((125.0, 0.004, 25.0), (400.0, 2.5, 40.0), (400.0, 2.5, 1.0),
+                                (800.0, 40.0, 8.0), (1500.0, 120.0, 15.0)),
+                        num_points=201, mode='exact'):
+    """
+    Compare voigtian() and voigtian_integral() with RooVoigtian.getVal() and RooVoigtian.createIntegral()
+    for representative (mass, width, sigma) values
+
+    :rtype : float
+    :param values: list of (mass, width, sigma) tuples
+    :param num_points: number of x values per tuple (mass +/- 10 Voigt widths)
+    :param mode: voigtian() mode to test
+    :return: maximum relative deviation
+    """
+    import ROOT
+
+    x = ROOT.RooRealVar("x", "x", 0, 1e4)
+    mean = ROOT.RooRealVar("mean", "mean", 0)
+    width = ROOT.RooRealVar("width", "width", 0)
+    sigma = ROOT.RooRealVar("sigma", "sigma", 0)
+    pdf = ROOT.RooVoigtian("voigtian", "Voigtian", x, mean, width, sigma)
+
+    max_deviation = 0.0
+    for mass_val, width_val, sigma_val in values:
+        mean.setVal(mass_val)
+        width.setVal(width_val)
+        sigma.setVal(sigma_val)
+        x_values = np.linspace(mass_val - 10 * (width_val + sigma_val), mass_val + 10 * (width_val + sigma_val),
+                               num_points)
+        roofit_values = []
+        for x_val in x_values:
+            x.setVal(x_val)
+            roofit_values.append(pdf.getVal())
+        numpy_values = voigtian(x_values, mass_val, width_val, sigma_val, mode=mode)
+        deviation = np.max(np.abs(numpy_values - roofit_values) / np.abs(roofit_values))
+
+        x.setRange("window", x_values[0], x_values[-1])
+        roofit_integral = pdf.createIntegral(ROOT.RooArgSet(x), "window").getVal()
+        numpy_integral = voigtian_integral(x_values[0], x_values[-1], mass_val, width_val, sigma_val, mode=mode)
+        integral_deviation = abs(numpy_integral - roofit_integral) / roofit_integral
+
+        print ("m = {0:7.2f}  width = {1:8.4f}  sigma = {2:6.2f}  max. rel. deviation = {3:.3e}"
+               "  integral rel. deviation = {4:.3e}").format(mass_val, width_val, sigma_val, deviation,
+                                                             integral_deviation)
+        max_deviation = max(max_deviation, deviation, integral_deviation)
+    return max_deviation
+
+
+if __name__ == '__main__':
+    # accuracy test against RooVoigtian (requires ROOT)
+    for test_mode in VOIGT_MODES:
+        print "mode:", test_mode
+        print "maximum relative deviation:", compare_with_roofit(mode=test_mode)